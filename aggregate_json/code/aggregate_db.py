@@ -0,0 +1,276 @@
+from typing import List, Dict, Optional
+import json
+import sqlite3
+import argparse, sys
+from pathlib import Path
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id INTEGER PRIMARY KEY,
+    name TEXT UNIQUE NOT NULL,
+    version TEXT
+);
+CREATE TABLE IF NOT EXISTS samples (
+    run_id INTEGER NOT NULL,
+    sample_id INTEGER NOT NULL,
+    name TEXT,
+    type TEXT,
+    PRIMARY KEY (run_id, sample_id)
+);
+CREATE INDEX IF NOT EXISTS samples_name ON samples (name);
+CREATE TABLE IF NOT EXISTS snv (
+    run_id INTEGER NOT NULL,
+    snv_id INTEGER NOT NULL,
+    key TEXT NOT NULL,
+    chr TEXT,
+    start INTEGER,
+    reference TEXT,
+    variant TEXT,
+    strand TEXT,
+    consequence TEXT,
+    symbol TEXT,
+    gene TEXT,
+    amino_acid_change TEXT,
+    vaf TEXT,
+    vaf_counts TEXT,
+    PRIMARY KEY (run_id, snv_id)
+);
+CREATE INDEX IF NOT EXISTS snv_key ON snv (key);
+CREATE INDEX IF NOT EXISTS snv_symbol ON snv (symbol);
+CREATE INDEX IF NOT EXISTS snv_gene ON snv (gene);
+CREATE TABLE IF NOT EXISTS clusters (
+    run_id INTEGER NOT NULL,
+    cluster_id INTEGER NOT NULL,
+    sample_id INTEGER NOT NULL,
+    sample_name TEXT,
+    PRIMARY KEY (run_id, cluster_id, sample_id)
+);
+CREATE TABLE IF NOT EXISTS cluster_variants (
+    run_id INTEGER NOT NULL,
+    cluster_id INTEGER NOT NULL,
+    sample_id INTEGER NOT NULL,
+    snv_id INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS cluster_variants_cluster ON cluster_variants (run_id, cluster_id);
+CREATE TABLE IF NOT EXISTS trees (
+    run_id INTEGER NOT NULL,
+    tree_id INTEGER NOT NULL,
+    tree_name TEXT,
+    tree_score REAL,
+    PRIMARY KEY (run_id, tree_id)
+);
+CREATE TABLE IF NOT EXISTS nodes (
+    run_id INTEGER NOT NULL,
+    tree_id INTEGER NOT NULL,
+    node_name TEXT NOT NULL,
+    cluster_id INTEGER,
+    PRIMARY KEY (run_id, tree_id, node_name)
+);
+CREATE TABLE IF NOT EXISTS node_children (
+    run_id INTEGER NOT NULL,
+    tree_id INTEGER NOT NULL,
+    node_name TEXT NOT NULL,
+    child_name TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS node_children_tree ON node_children (run_id, tree_id);
+CREATE TABLE IF NOT EXISTS node_prevalence (
+    run_id INTEGER NOT NULL,
+    tree_id INTEGER NOT NULL,
+    node_name TEXT NOT NULL,
+    sample_id INTEGER NOT NULL,
+    value REAL
+);
+CREATE INDEX IF NOT EXISTS node_prevalence_tree ON node_prevalence (run_id, tree_id);
+"""
+
+RUN_TABLES = ["samples", "snv", "clusters", "cluster_variants", "trees",
+              "nodes", "node_children", "node_prevalence"]
+
+
+def connect(db_file: str) -> sqlite3.Connection:
+    """Open (and create if needed) an aggregate database.
+
+    Args:
+        db_file (str): path to SQLite file
+
+    Returns:
+        sqlite3.Connection: connection with rows accessible by column name
+    """
+    conn = sqlite3.connect(db_file)
+    conn.row_factory = sqlite3.Row
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def write_aggregate_db(data: Dict, db_file: str, run_name: str):
+    """Write an aggregated JSON document into indexed tables.
+
+    A run that is already in the database is replaced.
+
+    Args:
+        data (Dict): aggregated data, as built by aggregate_json.aggregate
+        db_file (str): path to SQLite file [output]
+        run_name (str): name identifying this run in the cohort
+    """
+    conn = connect(db_file)
+    with conn:
+        row = conn.execute("SELECT run_id FROM runs WHERE name = ?", (run_name,)).fetchone()
+        if row is not None:
+            for table in RUN_TABLES:
+                conn.execute(f"DELETE FROM {table} WHERE run_id = ?", (row["run_id"],))
+            conn.execute("DELETE FROM runs WHERE run_id = ?", (row["run_id"],))
+        run_id = conn.execute("INSERT INTO runs (name, version) VALUES (?, ?)",
+                              (run_name, data["version"])).lastrowid
+
+        conn.executemany(
+            "INSERT INTO samples VALUES (?, ?, ?, ?)",
+            [(run_id, s["sample_id"], s["name"], s["type"]) for s in data["samples"]])
+        conn.executemany(
+            "INSERT INTO snv VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            [(run_id, v["SNV_id"], f"{v['chr']}:{v['start']}", v["chr"], v["start"],
+              v["reference"], v["variant"], v["strand"], v["consequence"], v["symbol"],
+              v["gene"], v["amino_acid_change"], json.dumps(v["vaf"]), json.dumps(v["vaf_counts"]))
+             for v in data["SNV"]])
+        conn.executemany(
+            "INSERT INTO clusters VALUES (?, ?, ?, ?)",
+            [(run_id, c["cluster_id"], c["sample_id"], c["sample_name"]) for c in data["clusters"]])
+        conn.executemany(
+            "INSERT INTO cluster_variants VALUES (?, ?, ?, ?)",
+            [(run_id, c["cluster_id"], c["sample_id"], snv_id)
+             for c in data["clusters"] for snv_id in c["variants"]])
+        for tree in data["trees"]:
+            conn.execute("INSERT INTO trees VALUES (?, ?, ?, ?)",
+                         (run_id, tree["tree_id"], tree["tree_name"], tree["tree_score"]))
+            conn.executemany(
+                "INSERT INTO nodes VALUES (?, ?, ?, ?)",
+                [(run_id, tree["tree_id"], node["node_name"], node.get("cluster_id"))
+                 for node in tree["nodes"]])
+            conn.executemany(
+                "INSERT INTO node_children VALUES (?, ?, ?, ?)",
+                [(run_id, tree["tree_id"], node["node_name"], child)
+                 for node in tree["nodes"] for child in node["children"]])
+            conn.executemany(
+                "INSERT INTO node_prevalence VALUES (?, ?, ?, ?, ?)",
+                [(run_id, tree["tree_id"], node["node_name"], p["sample_id"], p["value"])
+                 for node in tree["nodes"] for p in node["prevalence"]])
+    conn.close()
+
+
+def _snv_from_row(row: sqlite3.Row) -> Dict:
+    return {
+        "SNV_id":               row["snv_id"],
+        "chr":                  row["chr"],
+        "start":                row["start"],
+        "reference":            row["reference"],
+        "variant":              row["variant"],
+        "strand":               row["strand"],
+        "consequence":          row["consequence"],
+        "symbol":               row["symbol"],
+        "gene":                 row["gene"],
+        "vaf":                  json.loads(row["vaf"]),
+        "vaf_counts":           json.loads(row["vaf_counts"]),
+        "amino_acid_change":    row["amino_acid_change"],
+    }
+
+
+def get_variant(conn: sqlite3.Connection, run_name: str, key: str) -> Optional[Dict]:
+    """Look up one SNV of a run by its chr:start key.
+
+    Returns:
+        Optional[Dict]: SNV in the aggregated JSON format, None if absent
+    """
+    row = conn.execute(
+        "SELECT snv.* FROM snv JOIN runs USING (run_id) WHERE runs.name = ? AND snv.key = ?",
+        (run_name, key)).fetchone()
+    return _snv_from_row(row) if row is not None else None
+
+
+def variants_in_cluster(conn: sqlite3.Connection, run_name: str, cluster_id: int) -> List[Dict]:
+    """List the SNVs assigned to a cluster of a run.
+
+    Returns:
+        List[Dict]: SNVs in the aggregated JSON format
+    """
+    rows = conn.execute(
+        """SELECT DISTINCT snv.* FROM cluster_variants cv
+           JOIN runs USING (run_id)
+           JOIN snv ON snv.run_id = cv.run_id AND snv.snv_id = cv.snv_id
+           WHERE runs.name = ? AND cv.cluster_id = ?
+           ORDER BY snv.snv_id""",
+        (run_name, cluster_id)).fetchall()
+    return [_snv_from_row(row) for row in rows]
+
+
+def best_tree(conn: sqlite3.Connection, sample_name: str) -> Optional[Dict]:
+    """Get the best tree of the run that contains a sample.
+
+    Trees are ranked by tree_score when SPRUCE provides one, otherwise
+    the first solution enumerated by SPRUCE is used.
+
+    Returns:
+        Optional[Dict]: tree in the aggregated JSON format, None if absent
+    """
+    tree = conn.execute(
+        """SELECT trees.* FROM trees JOIN samples USING (run_id)
+           WHERE samples.name = ?
+           ORDER BY trees.tree_score IS NULL, trees.tree_score DESC, trees.tree_id
+           LIMIT 1""",
+        (sample_name,)).fetchone()
+    if tree is None:
+        return None
+    key = (tree["run_id"], tree["tree_id"])
+    nodes = {}
+    for row in conn.execute(
+            "SELECT * FROM nodes WHERE run_id = ? AND tree_id = ? ORDER BY rowid", key):
+        node = {"node_name": row["node_name"], "prevalence": [], "children": []}
+        if row["cluster_id"] is not None:
+            node["cluster_id"] = row["cluster_id"]
+        nodes[row["node_name"]] = node
+    for row in conn.execute(
+            "SELECT * FROM node_prevalence WHERE run_id = ? AND tree_id = ? ORDER BY rowid", key):
+        nodes[row["node_name"]]["prevalence"].append(
+            {"sample_id": row["sample_id"], "value": row["value"]})
+    for row in conn.execute(
+            "SELECT * FROM node_children WHERE run_id = ? AND tree_id = ? ORDER BY rowid", key):
+        nodes[row["node_name"]]["children"].append(row["child_name"])
+    return {
+        "tree_id": tree["tree_id"],
+        "tree_name": tree["tree_name"],
+        "tree_score": tree["tree_score"],
+        "nodes": list(nodes.values()),
+    }
+
+
+def gene_hits(conn: sqlite3.Connection, gene: str) -> List[Dict]:
+    """Find the SNVs of every run that hit a gene, by symbol or Ensembl id.
+
+    Returns:
+        List[Dict]: run name and SNV in the aggregated JSON format
+    """
+    rows = conn.execute(
+        """SELECT runs.name AS run_name, snv.* FROM snv JOIN runs USING (run_id)
+           WHERE snv.symbol = ? OR snv.gene = ?
+           ORDER BY runs.name, snv.snv_id""",
+        (gene, gene)).fetchall()
+    return [{"run": row["run_name"], "SNV": _snv_from_row(row)} for row in rows]
+
+
+def main(args):
+    with open(args.json, "r") as ifile:
+        data = json.load(ifile)
+    run_name = args.run if args.run else Path(args.json).stem
+    write_aggregate_db(data, args.db, run_name)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog="Aggregate DB",
+        description="Export an aggregate JSON file into an indexed SQLite database")
+
+    parser.add_argument("-j", "--json", help="aggregate JSON file [workflow]", required=True)
+    parser.add_argument("-d", "--db", help="SQLite database file [output]", required=True)
+    parser.add_argument("-r", "--run", help="run name in the database, defaults to the JSON file name")
+    args = parser.parse_args(None if sys.argv[1:] else ['-h'])
+
+    main(args)
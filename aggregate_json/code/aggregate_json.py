@@ -1,19 +1,26 @@
-from typing import List, Dict, Tuple
+from typing import List, Dict, Optional, Tuple, Union
 import json
 import pandas as pd
 import argparse, sys
 import pysam
 from collections import defaultdict
 import urllib.parse
-import gzip
 import numpy as np
+from pathlib import Path
+from aggregate_db import write_aggregate_db
+from bgzf import DECOMPRESS_THREADS, open_compressed
+import serialization
+from batch import add_batch_arguments, run_manifest, split_batch_arguments
+from vcf_selection import Region, parse_regions, parse_samples, subset_samples, fetch_records
+from variant_index import encode, read_variant_index, strip_bytes_literal
 
 
-def parse_vcf_samples(vcf_file: str) -> Tuple[List[Dict], Dict]:
+def parse_vcf_samples(vcf_file: str, samples: Optional[List[str]] = None) -> Tuple[List[Dict], Dict]:
     """Parse VEP output format to get sample info.
 
     Args:
         vcf_file (str): path to VCF file
+        samples (Optional[List[str]]): tumor samples to keep, None for all
 
     Returns:
         List[Dict]: list of sample info
@@ -28,32 +35,40 @@ def parse_vcf_samples(vcf_file: str) -> Tuple[List[Dict], Dict]:
             temp.append({"sample_id": idx, "name": rec.value, "type": "normal"})
             sample2id[rec.value] = idx
             idx += 1
-        elif rec.key == "tumor_sample":
+        elif rec.key == "tumor_sample" and (not samples or rec.value in samples):
             temp.append({"sample_id": idx, "name": rec.value, "type": "tumor"})
             sample2id[rec.value] = idx
             idx += 1
     return temp, sample2id
 
 
-def parse_vep_variants(vep_file: str, program: str="moss") -> Tuple[List[Dict], Dict]:
+def parse_vep_variants(vep_file: str, program: str="moss",
+                       regions: Optional[List[Region]] = None,
+                       samples: Optional[List[str]] = None,
+                       threads: Optional[int] = None) -> Tuple[List[Dict], pd.Index]:
     """Parse VEP output format.
 
     VEP details are written in INFO field CSQ.
 
     Args:
         vep_file (str): path to VEP output file
+        regions (Optional[List[Region]]): regions to read, through the index when there is one
+        samples (Optional[List[str]]): tumor samples to keep, None for all
+        threads (Optional[int]): htslib threads decompressing a bgzipped file
 
     Returns:
         List[Dict]: list of variant info
+        pd.Index: variant key (chrom:pos) of every SNV, in SNV_id order
     """
-    vep = pysam.VariantFile(vep_file)
+    vep = pysam.VariantFile(vep_file, threads=threads or DECOMPRESS_THREADS)
+    subset_samples(vep, samples)
     samples = vep.header.samples
     fields = vep.header.info["CSQ"].description.split(": ")[1].split("|")
     index = {field.lower(): i for i, field in enumerate(fields)}
     variants = []
-    variants2id = {}
+    variant_keys = []
     idx = 0
-    for rec in vep:
+    for rec in fetch_records(vep, regions):
         annotation = rec.info["CSQ"][0].split("|")
         if program == "moss":
             vaf = [rec.samples[sample]["TCOUNT"] / rec.samples[sample]["DP"] if rec.samples[sample]["TCOUNT"] > 0 else 0
@@ -90,24 +105,121 @@ def parse_vep_variants(vep_file: str, program: str="moss") -> Tuple[List[Dict],
                 # "drug": '',
                 # "drug_pathway": ''
             })
-            variants2id[f"{rec.contig}:{rec.start+1}"] = idx
+            variant_keys.append(f"{rec.contig}:{rec.start+1}")
             idx += 1
-    return variants, variants2id
+    return variants, pd.Index(variant_keys)
+
+
+def vcf_columns(vep_file: str, samples: Optional[List[str]] = None) -> List[str]:
+    """Sample columns parsed from a VCF, see parse_vep_variants.
+
+    Args:
+        vep_file (str): path to VEP output file
+        samples (Optional[List[str]]): tumor samples to keep, None for all
+
+    Returns:
+        List[str]: sample columns in the order of their vaf values
+    """
+    with pysam.VariantFile(vep_file) as vep:
+        subset_samples(vep, samples)
+        return list(vep.header.samples)
+
+
+def merge_vcf_samples(vep_files: List[str], samples: Optional[List[str]] = None) -> Tuple[List[Dict], Dict]:
+    """Parse the samples of the VCFs of one patient.
+
+    A sample found in several VCFs (the normal shared by the regions) is listed once.
+
+    Args:
+        vep_files (List[str]): paths to the VEP output files of the patient
+        samples (Optional[List[str]]): tumor samples to keep, None for all
+
+    Returns:
+        List[Dict]: list of sample info
+        Dict: sample to id mapping
+    """
+    merged = []
+    sample2id = {}
+    for vep_file in vep_files:
+        vcf_samples, _ = parse_vcf_samples(vep_file, samples)
+        for sample in vcf_samples:
+            if sample["name"] not in sample2id:
+                sample2id[sample["name"]] = len(merged) + 1
+                merged.append(dict(sample, sample_id=len(merged) + 1))
+    return merged, sample2id
+
+
+def merge_vep_variants(vep_files: List[str], program: str = "moss",
+                       regions: Optional[List[Region]] = None,
+                       samples: Optional[List[str]] = None,
+                       threads: Optional[int] = None) -> Tuple[List[Dict], pd.Index]:
+    """Parse the variants of the VCFs of one patient, see parse_vep_variants.
+
+    A variant called in several VCFs is listed once, with the annotation of
+    the first VCF. Its vaf values cover the sample columns of every VCF, 0
+    (and 0 of 0 reads) for the samples of VCFs that did not call it.
+
+    Args:
+        vep_files (List[str]): paths to the VEP output files of the patient
+        regions (Optional[List[Region]]): regions to read
+        samples (Optional[List[str]]): tumor samples to keep, None for all
+        threads (Optional[int]): htslib threads decompressing bgzipped files
+
+    Returns:
+        List[Dict]: list of variant info
+        pd.Index: variant key (chrom:pos) of every SNV, in SNV_id order
+    """
+    if len(vep_files) == 1:
+        return parse_vep_variants(vep_files[0], program, regions, samples, threads)
+    file_columns = [vcf_columns(vep_file, samples) for vep_file in vep_files]
+    columns = list(dict.fromkeys(column for names in file_columns for column in names))
+    variants = {}
+    for vep_file, names in zip(vep_files, file_columns):
+        positions = [columns.index(column) for column in names]
+        file_variants, file_keys = parse_vep_variants(vep_file, program, regions, samples, threads)
+        for variant, key in zip(file_variants, file_keys):
+            if key not in variants:
+                variants[key] = dict(variant, vaf=[0] * len(columns),
+                                     vaf_counts=[[0, 0] for _ in columns])
+            merged = variants[key]
+            for position, vaf, vaf_counts in zip(positions, variant["vaf"], variant["vaf_counts"]):
+                if merged["vaf_counts"][position][1] == 0:
+                    merged["vaf"][position] = vaf
+                    merged["vaf_counts"][position] = vaf_counts
+    for snv_id, variant in enumerate(variants.values()):
+        variant["SNV_id"] = snv_id
+    return list(variants.values()), pd.Index(list(variants))
+
 
 def skip_lines(file, n_skip):
     for i in range(n_skip):
         # print(next(file), end='')
         next(file)
 
-def parse_spruce_result(spruce_file: str, sample2id: dict) -> List[Dict]:
-    with (
-        gzip.open(spruce_file, "rt") if (
-            spruce_file.endswith("gzip") or
-            spruce_file.endswith("gz")
-        ) else open(spruce_file, "rt")
-     ) as spruce:
+def parse_spruce_result(spruce_file: str, sample2id: dict,
+                        prevalence_file: str = None,
+                        top_k: Optional[int] = None,
+                        threads: Optional[int] = None) -> Tuple[np.ndarray, List[int]]:
+    """Parse the usage (prevalence) matrices of every SPRUCE solution.
+
+    Args:
+        spruce_file (str): path to SPRUCE result file, optionally gzipped
+        sample2id (dict): sample name to id mapping
+        prevalence_file (str): optional .npy file backing the matrices as a memory map
+        top_k (Optional[int]): only parse the first k solutions, None for all
+        threads (Optional[int]): threads decompressing a bgzipped file
+
+    Returns:
+        np.ndarray: prevalences of shape (solutions, samples, nodes)
+        List[int]: sample id of every row of the usage matrices
+    """
+    with open_compressed(spruce_file, "rt", threads) as spruce:
         n_sol = int(next(spruce).strip().split()[0])
-        sols = []
+        if top_k is not None:
+            # the remaining solutions are never read
+            n_sol = min(n_sol, top_k)
+        prevalence = None
+        sample_ids = []
         for i in range(n_sol):
             while True:
                 line = next(spruce)
@@ -122,17 +234,28 @@ def parse_spruce_result(spruce_file: str, sample2id: dict) -> List[Dict]:
             skip_lines(spruce, n * 2 + 1) # tree (A)
             skip_lines(spruce, 2 + n + 1)
             skip_lines(spruce, 2)
-            usage = []
-            for _ in range(m):
-                usage.append([float(x) for x in next(spruce).strip().split()])
-            sols.append({
-                "prevalence": np.array(usage),
-            })
+            usage_text = "".join(next(spruce) for _ in range(m))
+            usage = np.fromstring(usage_text, dtype=np.float64, sep=" ").reshape(m, -1)
+            if prevalence is None:
+                # every solution has the same samples and nodes, so all of them
+                # fit in one contiguous array sized from the first one
+                shape = (n_sol,) + usage.shape
+                if prevalence_file:
+                    prevalence = np.lib.format.open_memmap(prevalence_file, mode="w+",
+                                                           dtype=np.float64, shape=shape)
+                else:
+                    prevalence = np.empty(shape, dtype=np.float64)
+            prevalence[i] = usage
             skip_lines(spruce, 3 + k*m + 4) # inferred F
-        return sols, sample_ids
+        if prevalence is None:
+            prevalence = np.empty((0, 0, 0), dtype=np.float64)
+        return prevalence, sample_ids
 
-def parse_spruce(spruce_json: str, spruce_res: str, sample2id: dict) -> List[defaultdict]:
-    res, sample_ids = parse_spruce_result(spruce_res, sample2id)
+def parse_spruce(spruce_json: str, spruce_res: str, sample2id: dict,
+                 prevalence_file: str = None, top_k: Optional[int] = None,
+                 threads: Optional[int] = None) -> List[defaultdict]:
+    prevalence, sample_ids = parse_spruce_result(spruce_res, sample2id, prevalence_file, top_k, threads)
+    sample_ids = [int(sample_id) for sample_id in sample_ids]
     with open(spruce_json, "r") as ifile:
         spruce = json.load(ifile)
         spruce_convert = {int(node["id"]): node["label"].strip("()").split(",")[0] for node in spruce["nodes"]}
@@ -140,6 +263,10 @@ def parse_spruce(spruce_json: str, spruce_res: str, sample2id: dict) -> List[def
         for key, sol in spruce.items():
             if key.startswith("sol"):
                 idx_sol = int(key.split('_')[1])
+                if idx_sol >= len(prevalence):
+                    continue
+                # one (samples, nodes) slice per solution, converted to floats in bulk
+                node_prevalence = prevalence[idx_sol].T.tolist()
                 tree = {
                     "tree_id": int(idx_sol),
                     "tree_name": f"tree_{idx_sol}",
@@ -149,40 +276,99 @@ def parse_spruce(spruce_json: str, spruce_res: str, sample2id: dict) -> List[def
                             "node_name": spruce_convert[i],
                             "prevalence": [
                                 {
-                                    "sample_id": int(sample_id),
-                                    "value": float(prevalence),
+                                    "sample_id": sample_id,
+                                    "value": value,
                                 }
-                                for sample_id, prevalence in zip(sample_ids, res[idx_sol]["prevalence"][:, i])
+                                for sample_id, value in zip(sample_ids, node_prevalence[i])
                             ],
                             "children": []
                         }
                         for i in spruce_convert
                     ]
                 }
-                for edge in sol:
+                nodes_by_name = {node["node_name"]: node for node in tree["nodes"]}
+                if len(sol) > 0:
                     for node in tree["nodes"]:
                         if node["node_name"] != "*":
                             node["cluster_id"] = int(node["node_name"])
-                        if node["node_name"] == spruce_convert[edge["source"]]:
-                            node["children"].append(spruce_convert[edge["target"]])
+                for edge in sol:
+                    nodes_by_name[spruce_convert[edge["source"]]]["children"].append(spruce_convert[edge["target"]])
                 trees.append(tree)
         return trees
 
 
-def parse_cluster_assign(cluster_file: str, sample_to_id: dict, variants_to_id) -> List[Dict]:
+def parse_cluster_assign(cluster_file: str, sample_to_id: dict, variant_keys: pd.Index) -> List[Dict]:
     """Parse cluster assignment file.
 
     Args:
         cluster_file (str): path to cluster assignment file
+        variant_keys (pd.Index): variant key of every SNV, see parse_vep_variants
+
+    Returns:
+        List[Dict]: list of cluster info
+    """
+    df_cluster = read_cluster_assign(cluster_file)
+    snv_ids = assign_snv_ids(df_cluster, variant_keys)
+    if (snv_ids < 0).any():
+        raise KeyError(df_cluster["mutation_id"][snv_ids < 0].iloc[0])
+    return clusters_from_assign(df_cluster, sample_to_id, snv_ids)
+
+
+def read_cluster_assign(cluster_file: str, threads: Optional[int] = None) -> pd.DataFrame:
+    """Read cluster assignment file, without the b'' quoting written by pyclone-vi.
+
+    Args:
+        cluster_file (str): path to cluster assignment file, optionally gzipped
+        threads (Optional[int]): threads decompressing a bgzipped file
+
+    Returns:
+        pd.DataFrame: one row per (mutation_id, sample_id) assignment
+    """
+    with open_compressed(cluster_file, "rt", threads) as cluster:
+        df_cluster = pd.read_csv(cluster, sep='\t', dtype={"mutation_id": str, "sample_id": str})
+    df_cluster["mutation_id"] = strip_bytes_literal(df_cluster["mutation_id"])
+    df_cluster["sample_id"] = strip_bytes_literal(df_cluster["sample_id"])
+    return df_cluster
+
+
+def assign_snv_ids(df_cluster: pd.DataFrame, variant_keys: pd.Index,
+                   variant_index: Optional[pd.Index] = None) -> np.ndarray:
+    """Find the SNV of every cluster assignment through integer codes.
+
+    The mutation ids are encoded once, with the variant index of vcf_transform
+    when there is one, and mapped to SNV ids by an array lookup.
+
+    Args:
+        df_cluster (pd.DataFrame): cluster assignments, see read_cluster_assign
+        variant_keys (pd.Index): variant key of every SNV, see parse_vep_variants
+        variant_index (Optional[pd.Index]): variant index written by vcf_transform
+
+    Returns:
+        np.ndarray: SNV id of every assignment, -1 for variants that are not SNVs
+    """
+    if variant_index is None:
+        # SNV ids are the positions of the variant keys
+        return encode(df_cluster["mutation_id"], variant_keys)
+    snv_of_variant = np.full(len(variant_index), -1)
+    variant_ids = encode(variant_keys, variant_index)
+    indexed = variant_ids >= 0
+    snv_of_variant[variant_ids[indexed]] = np.flatnonzero(indexed)
+    assign_ids = encode(df_cluster["mutation_id"], variant_index)
+    return np.where(assign_ids >= 0, snv_of_variant[assign_ids], -1)
+
+
+def clusters_from_assign(df_cluster: pd.DataFrame, sample_to_id: dict, snv_ids: np.ndarray) -> List[Dict]:
+    """Group cluster assignments already loaded in memory.
+
+    Args:
+        df_cluster (pd.DataFrame): cluster assignments with plain string ids
+        snv_ids (np.ndarray): SNV id of every assignment, see assign_snv_ids
 
     Returns:
         List[Dict]: list of cluster info
     """
     clusters = []
-    df_cluster = pd.read_csv(cluster_file, sep='\t')
-    df_cluster["mutation_id"] = df_cluster["mutation_id"].str.strip("b\'\"")
-    df_cluster["sample_id"] = df_cluster["sample_id"].str.strip("b\'\"")
-    grouped = df_cluster.groupby(["sample_id", "cluster_id"])
+    grouped = df_cluster.assign(SNV_id=snv_ids).groupby(["sample_id", "cluster_id"])
 
 
     for (sample_name, cluster_id), group in grouped:
@@ -190,13 +376,82 @@ def parse_cluster_assign(cluster_file: str, sample_to_id: dict, variants_to_id)
             "cluster_id": int(cluster_id),
             "sample_name": str(sample_name),
             "sample_id": sample_to_id[sample_name],
-            "variants": [variants_to_id[v] for v in group["mutation_id"]]
+            "variants": group["SNV_id"].tolist()
         })
     return clusters
 
 
+def read_cluster_map(cluster_map_file: str) -> Dict:
+    """Read the cluster map written by cluster_transform when it pruned the clusters.
 
-def main(args):
+    Args:
+        cluster_map_file (str): path to cluster map JSON file
+
+    Returns:
+        Dict: pruning options, the fate of every input cluster and the dropped mutations
+    """
+    with open(cluster_map_file, "r") as ifile:
+        return json.load(ifile)
+
+
+def read_spruce_status(status_file: str) -> Dict:
+    """Read the status written by a budgeted SPRUCE run.
+
+    Args:
+        status_file (str): path to spruce.status.json
+
+    Returns:
+        Dict: budget, running time, tree count and whether the trees may be truncated
+    """
+    with open(status_file, "r") as ifile:
+        return json.load(ifile)
+
+
+def apply_cluster_map(df_cluster: pd.DataFrame, cluster_map: Dict) -> pd.DataFrame:
+    """Give the cluster assignments the pruned cluster ids SPRUCE was run on.
+
+    Args:
+        df_cluster (pd.DataFrame): cluster assignments, see read_cluster_assign
+        cluster_map (Dict): cluster map, see read_cluster_map
+
+    Returns:
+        pd.DataFrame: assignments of the kept mutations, with the pruned cluster ids
+    """
+    new_ids = {cluster["cluster_id"]: cluster["new_cluster_id"] for cluster in cluster_map["clusters"]}
+    df_cluster = df_cluster[~df_cluster["mutation_id"].isin(cluster_map["dropped_mutations"])]
+    df_cluster = df_cluster.assign(cluster_id=df_cluster["cluster_id"].map(new_ids))
+    df_cluster = df_cluster[df_cluster["cluster_id"].notna()]
+    return df_cluster.astype({"cluster_id": int})
+
+
+def aggregate(vep: Union[str, List[str]], df_cluster: pd.DataFrame, spruce_json: str, spruce_res: str,
+              program: str, prevalence_file: str = None,
+              regions: Optional[List[Region]] = None, samples: Optional[List[str]] = None,
+              variant_index: Optional[pd.Index] = None,
+              cluster_map: Optional[Dict] = None,
+              top_k: Optional[int] = None,
+              spruce_status: Optional[Dict] = None,
+              threads: Optional[int] = None) -> Dict:
+    """Aggregate the results of one workflow run.
+
+    Args:
+        vep (Union[str, List[str]]): path to VEP output file, or the VEP output files of one patient
+        df_cluster (pd.DataFrame): cluster assignments, see read_cluster_assign
+        spruce_json (str): path to SPRUCE visualization JSON file
+        spruce_res (str): path to SPRUCE result file
+        program (str): program for variant calling
+        prevalence_file (str): optional .npy file to memory-map SPRUCE prevalences
+        regions (Optional[List[Region]]): regions of the VEP file to aggregate
+        samples (Optional[List[str]]): tumor samples to aggregate
+        variant_index (Optional[pd.Index]): variant index written by vcf_transform
+        cluster_map (Optional[Dict]): cluster map already applied to df_cluster, reported as is
+        top_k (Optional[int]): only aggregate the first k SPRUCE trees, None for all
+        spruce_status (Optional[Dict]): budget of a budgeted SPRUCE run, reported as is
+        threads (Optional[int]): threads decompressing bgzipped inputs
+
+    Returns:
+        Dict: aggregated data for visualization
+    """
     data = {
         "version": "phylodiver v0.1.0",
         "samples": [],
@@ -204,28 +459,100 @@ def main(args):
         "clusters": [],
         "trees": [],
     }
-    samples, sample2id = parse_vcf_samples(args.vep)
-    data["samples"] += samples
-    variants, variants2id = parse_vep_variants(args.vep, args.program)
+    vep_files = [vep] if isinstance(vep, str) else vep
+    vcf_samples, sample2id = merge_vcf_samples(vep_files, samples)
+    data["samples"] += vcf_samples
+    variants, variant_keys = merge_vep_variants(vep_files, program, regions, samples, threads)
     data["SNV"] += variants
-    data["clusters"] += parse_cluster_assign(args.cluster, sample2id, variants2id)
-    trees = parse_spruce(args.spruce_json, args.spruce_res, sample2id)
+    snv_ids = assign_snv_ids(df_cluster, variant_keys, variant_index)
+    if regions or samples:
+        # assignments of variants and samples outside the selection are left out
+        selected = (snv_ids >= 0) & df_cluster["sample_id"].isin(sample2id.keys()).to_numpy()
+        df_cluster, snv_ids = df_cluster[selected], snv_ids[selected]
+    elif (snv_ids < 0).any():
+        raise KeyError(df_cluster["mutation_id"][snv_ids < 0].iloc[0])
+    data["clusters"] += clusters_from_assign(df_cluster, sample2id, snv_ids)
+    trees = parse_spruce(spruce_json, spruce_res, sample2id, prevalence_file, top_k, threads)
     data["trees"] += trees
-    with open(args.json, "w") as ofile:
-        json.dump(data, ofile, indent=2)
+    if cluster_map is not None:
+        data["cluster_pruning"] = cluster_map
+    if spruce_status is not None:
+        data["spruce_status"] = spruce_status
+    return data
 
 
-if __name__ == "__main__":
+def write_aggregate(data: Dict, json_file: str, compact: bool = False):
+    serialization.dump(data, json_file, None if compact else serialization.PRETTY_INDENT)
+
+
+def main(args):
+    df_cluster = read_cluster_assign(args.cluster, args.threads)
+    regions = parse_regions(args.regions) if args.regions else None
+    samples = parse_samples(args.samples) if args.samples else None
+    variant_index = read_variant_index(args.variant_index) if args.variant_index else None
+    cluster_map = read_cluster_map(args.cluster_map) if args.cluster_map else None
+    if cluster_map is not None:
+        df_cluster = apply_cluster_map(df_cluster, cluster_map)
+    spruce_status = read_spruce_status(args.spruce_status) if args.spruce_status else None
+    data = aggregate(args.vep, df_cluster, args.spruce_json, args.spruce_res, args.program,
+                     args.prevalence_mmap, regions, samples, variant_index, cluster_map,
+                     args.top_k, spruce_status, args.threads)
+    if args.json:
+        write_aggregate(data, args.json, args.compact)
+    if args.db:
+        run_name = args.run if args.run else Path(args.vep[0]).stem
+        write_aggregate_db(data, args.db, run_name)
+
+
+def build_parser() -> argparse.ArgumentParser:
     parser = argparse.ArgumentParser(
         prog="Aggregate JSON",
         description="Aggregate results, generate a JSON file for visualization")
 
     parser.add_argument("-j", "--json", help="aggregate JSON file [output]")
-    parser.add_argument("-v", "--vep", help="VEP output file [workflow]")
+    parser.add_argument("-v", "--vep", nargs="+",
+                        help="VEP output file, or the VEP output files of the regions of one patient [workflow]")
     parser.add_argument("-c", "--cluster", help="Clustering output file [workflow]")
     parser.add_argument("-s", "--spruce-json", help="SPRUCE visualization JSON file [workflow]")
     parser.add_argument("-S", "--spruce-res", help="SPRUCE result file [workflow]")
+    parser.add_argument("-i", "--variant-index", help="variant index written by vcf_transform [workflow]")
+    parser.add_argument("--cluster-map", help="cluster map written by cluster_transform when pruning [workflow]")
+    parser.add_argument("--spruce-status", help="status of a budgeted SPRUCE run [workflow]")
+    parser.add_argument("--top-k", type=int, help="only aggregate the first k SPRUCE trees")
+    parser.add_argument("--compact", action="store_true", help="write compact rather than indented JSON")
+    parser.add_argument("--prevalence-mmap", help="memory-map SPRUCE prevalences to this .npy file [output]")
+    parser.add_argument("-d", "--db", help="indexed SQLite export of the aggregate [output]")
+    parser.add_argument("-r", "--run", help="run name in the SQLite export, defaults to the VEP file name")
+    parser.add_argument("--regions", help="BED file or comma separated contig[:start-end] list to aggregate")
+    parser.add_argument("--samples", help="file or comma separated list of tumor samples to aggregate")
+    parser.add_argument("-t", "--threads", type=int,
+                        help="threads decompressing bgzipped inputs, defaults to the CPU count up to 4")
     parser.add_argument("-p", "--program", help="program for variant calling", required=True, choices=["moss", "mutect"])
-    args = parser.parse_args(None if sys.argv[1:] else ['-h'])
+    add_batch_arguments(parser)
+    return parser
+
+
+def run_batch_row(argv: List[str]) -> List[str]:
+    """Aggregate one sample of a manifest.
+
+    Args:
+        argv (List[str]): arguments of the sample
+
+    Returns:
+        List[str]: files written
+    """
+    args = build_parser().parse_args(argv)
+    main(args)
+    return [output for output in (args.json, args.db) if output]
+
+
+if __name__ == "__main__":
+    argv = sys.argv[1:]
+    options, shared_argv = split_batch_arguments(argv)
+    if options.manifest:
+        # many samples in one process, fails only when every sample failed
+        report, succeeded = run_manifest(run_batch_row, shared_argv, options)
+        sys.exit(0 if succeeded else 1)
+    args = build_parser().parse_args(argv if argv else ['-h'])
 
     main(args)
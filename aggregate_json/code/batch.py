@@ -0,0 +1,106 @@
+from typing import Callable, Dict, List, Tuple
+import argparse
+import csv
+import json
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+
+
+# A manifest lists the inputs and outputs of many samples, one per TSV row
+# or JSON line. Columns are the long options of the tool without the
+# leading dashes, a "sample" column names the sample in the report. Every
+# row runs in the same interpreter, optionally on a process pool, and a
+# failing sample is reported without stopping the others.
+
+
+def add_batch_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--manifest", help="TSV or JSONL manifest, one sample per row, "
+                                           "options of the command line apply to every row")
+    parser.add_argument("--processes", type=int, default=1, help="worker processes for the manifest rows")
+    parser.add_argument("--report", help="JSON report of every manifest row [output]")
+
+
+def split_batch_arguments(argv: List[str]) -> Tuple[argparse.Namespace, List[str]]:
+    """Separate the batch options from the options shared by every row.
+
+    Args:
+        argv (List[str]): command line arguments
+
+    Returns:
+        argparse.Namespace: batch options
+        List[str]: remaining arguments
+    """
+    parser = argparse.ArgumentParser(add_help=False)
+    add_batch_arguments(parser)
+    return parser.parse_known_args(argv)
+
+
+def read_manifest(manifest_file: str) -> List[Dict]:
+    """Read a batch manifest.
+
+    Args:
+        manifest_file (str): JSON lines for .jsonl/.json files, TSV otherwise
+
+    Returns:
+        List[Dict]: options of every sample
+    """
+    with open(manifest_file, "r") as manifest:
+        if manifest_file.endswith((".jsonl", ".json")):
+            return [json.loads(line) for line in manifest if line.strip()]
+        return [row for row in csv.DictReader(manifest, delimiter="\t")]
+
+
+def row_to_argv(row: Dict) -> List[str]:
+    argv = []
+    for option, value in row.items():
+        if option == "sample" or value is None or value == "":
+            continue
+        values = value if isinstance(value, list) else str(value).split()
+        argv += [f"--{option}"] + [str(v) for v in values]
+    return argv
+
+
+def run_row(job: Tuple[Callable, str, List[str]]) -> Dict:
+    run_argv, sample, argv = job
+    start = time.time()
+    result = {"sample": sample, "status": "ok", "error": None, "outputs": []}
+    try:
+        result["outputs"] = run_argv(argv)
+    except (Exception, SystemExit) as e:
+        result["status"] = "failed"
+        result["error"] = "".join(traceback.format_exception_only(type(e), e)).strip()
+    result["seconds"] = round(time.time() - start, 3)
+    return result
+
+
+def run_manifest(run_argv: Callable[[List[str]], List[str]], shared_argv: List[str],
+                 options: argparse.Namespace) -> Tuple[List[Dict], bool]:
+    """Run every sample of a manifest.
+
+    Args:
+        run_argv (Callable): runs one sample from its arguments, returns the files written
+        shared_argv (List[str]): arguments shared by every row
+        options (argparse.Namespace): batch options, see add_batch_arguments
+
+    Returns:
+        List[Dict]: status, error, outputs and duration of every sample
+        bool: whether at least one sample succeeded
+    """
+    rows = read_manifest(options.manifest)
+    jobs = [(run_argv, row.get("sample", str(i)), shared_argv + row_to_argv(row))
+            for i, row in enumerate(rows)]
+    if options.processes > 1 and len(jobs) > 1:
+        with ProcessPoolExecutor(min(options.processes, len(jobs))) as pool:
+            report = list(pool.map(run_row, jobs))
+    else:
+        report = [run_row(job) for job in jobs]
+
+    failed = [result for result in report if result["status"] != "ok"]
+    for result in failed:
+        print(f"sample {result['sample']} failed: {result['error']}")
+    print(f"{len(report) - len(failed)} of {len(report)} samples succeeded")
+    if options.report:
+        with open(options.report, "w") as report_file:
+            json.dump(report, report_file, indent=2)
+    return report, len(failed) < len(report) or not report
@@ -0,0 +1,474 @@
+from typing import Callable, Dict, Iterator, List, Optional, TextIO, Tuple, Union
+import argparse
+import json
+import os
+import sys
+
+from bgzf import open_compressed
+
+
+# The aggregate schema is compiled once into a tree of checks, covering the
+# JSON schema keywords aggregate.schema uses. Documents are validated while
+# they are read: an aggregate and its arrays (SNV, clusters, trees), and the
+# list of aggregates of aggregated workflows, are walked token by token.
+# Every element is decoded on its own by the C decoder, checked and dropped,
+# so memory is bounded by the largest element (a tree), not by the document.
+
+SCHEMA_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "aggregate.schema")
+STREAM_DEPTH = 2            # container levels of an aggregate walked token by token
+CHUNK_SIZE = 1 << 20
+MAX_ERRORS = 100
+
+# keywords without effect on validation
+ANNOTATIONS = {"$schema", "$id", "title", "description", "default", "examples", "$comment"}
+
+
+class SchemaError(ValueError):
+    """A document does not follow the schema, raised at the first error when failing fast."""
+
+
+# JSON types by the exact Python types the decoder gives (bool is not a number)
+PYTHON_TYPES = {
+    "object": (dict,),
+    "array": (list,),
+    "string": (str,),
+    "number": (int, float),
+    "integer": (int,),
+    "boolean": (bool,),
+    "null": (type(None),),
+}
+
+# a path is "$" or a (parent path, name or index) pair, formatted on errors only
+Path = Union[str, Tuple]
+
+
+def format_path(path: Path) -> str:
+    """Format a path as $.name[index]..."""
+    parts = []
+    while isinstance(path, tuple):
+        path, key = path
+        parts.append(f"[{key}]" if isinstance(key, int) else f".{key}")
+    return path + "".join(reversed(parts))
+
+
+class CompiledSchema:
+    """Checks of one schema node, and of its properties and items.
+
+    The checks of a node are compiled into a closure specialized to the
+    keywords it uses, calling the closures of its properties and items.
+    """
+
+    def __init__(self, schema: Dict):
+        unknown = set(schema) - ANNOTATIONS - {"type", "enum", "properties", "required",
+                                                "items", "additionalProperties"}
+        if unknown:
+            raise ValueError(f"Unsupported schema keywords: {sorted(unknown)}")
+        types = schema.get("type")
+        self.types = [types] if isinstance(types, str) else types
+        self.python_types = None
+        if self.types is not None:
+            self.python_types = frozenset(t for name in self.types for t in PYTHON_TYPES[name])
+        self.enum = schema.get("enum")
+        self.properties = {name: CompiledSchema(child)
+                           for name, child in schema.get("properties", {}).items()}
+        self.required = schema.get("required", [])
+        items = schema.get("items")
+        self.items = CompiledSchema(items) if isinstance(items, dict) else None
+        additional = schema.get("additionalProperties", True)
+        self.additional = CompiledSchema(additional) if isinstance(additional, dict) else additional
+        self.check = self.compile()
+
+    def type_error(self, value, path: Path, report: Callable[[Path, str], None]) -> bool:
+        # slow path of the type check, integral floats are integers
+        if "integer" in self.types and type(value) is float and value.is_integer():
+            return False
+        report(path, f"{type_name(value)} is not of type {' or '.join(self.types)}")
+        return True
+
+    def check_node(self, value, path: Path, report: Callable[[Path, str], None]) -> bool:
+        """Check the type and enum of a value, not its content.
+
+        Args:
+            value: decoded value, or an empty dict or list for a streamed container
+            path (Path): JSON path of the value
+            report (Callable[[Path, str], None]): called with the path and message of every error
+
+        Returns:
+            bool: whether the value has an allowed type
+        """
+        if self.python_types is not None and type(value) not in self.python_types:
+            if self.type_error(value, path, report):
+                return False
+        if self.enum is not None and value not in self.enum:
+            report(path, f"{value!r} is not one of {self.enum}")
+        return True
+
+    def child(self, name: str) -> Optional["CompiledSchema"]:
+        """Schema of a property, None when any value is allowed."""
+        if name in self.properties:
+            return self.properties[name]
+        if isinstance(self.additional, CompiledSchema):
+            return self.additional
+        return None
+
+    def is_scalar(self) -> bool:
+        """Whether the node only constrains the type of a value that is not a container."""
+        return (self.python_types is not None and self.enum is None
+                and not self.python_types & {dict, list})
+
+    def compile(self) -> Callable:
+        """Compile the checks of the node into check(value, path, report)."""
+        types = self.python_types
+        type_error = self.type_error
+        enum = self.enum
+        properties = {name: child.check for name, child in self.properties.items()}
+        required = self.required
+        closed = self.additional is False
+        additional = self.additional.check if isinstance(self.additional, CompiledSchema) else None
+        items = self.items.check if self.items is not None else None
+        item_types = self.items.python_types if self.items is not None and self.items.is_scalar() else None
+
+        def check(value, path, report):
+            value_type = type(value)
+            if types is not None and value_type not in types and type_error(value, path, report):
+                return
+            if enum is not None and value not in enum:
+                report(path, f"{value!r} is not one of {enum}")
+            if value_type is dict:
+                for name in required:
+                    if name not in value:
+                        report(path, f"missing required property {name!r}")
+                for name, item in value.items():
+                    child = properties.get(name)
+                    if child is None:
+                        if closed:
+                            report(path, f"unexpected property {name!r}")
+                            continue
+                        child = additional
+                        if child is None:
+                            continue
+                    child(item, (path, name), report)
+            elif value_type is list and items is not None:
+                # arrays of numbers or strings are checked in one pass
+                if item_types is not None and all(type(item) in item_types for item in value):
+                    return
+                for index, item in enumerate(value):
+                    items(item, (path, index), report)
+
+        return check
+
+
+compiled_schemas = {}
+
+
+def compile_schema(schema_file: str = SCHEMA_FILE) -> CompiledSchema:
+    """Compile a schema file, once per process.
+
+    Args:
+        schema_file (str): path to the JSON schema
+
+    Returns:
+        CompiledSchema: the compiled schema
+    """
+    schema_file = os.path.abspath(schema_file)
+    if schema_file not in compiled_schemas:
+        with open(schema_file, "r") as ifile:
+            compiled_schemas[schema_file] = CompiledSchema(json.load(ifile))
+    return compiled_schemas[schema_file]
+
+
+def type_name(value) -> str:
+    if isinstance(value, dict):
+        return "object"
+    if isinstance(value, list):
+        return "array"
+    if value is None:
+        return "null"
+    return {bool: "boolean", str: "string"}.get(type(value), "number")
+
+
+class JsonStream:
+    """Reads the values of a JSON document one at a time from a text file."""
+
+    WHITESPACE = " \t\n\r"
+    # what the decoder may leave of a number cut by the end of the buffer,
+    # e.g. "." of "0." or "e+" of "1e+" before their digits
+    NUMBER_TAIL = "0123456789.eE+-"
+
+    def __init__(self, file: TextIO, chunk_size: int = CHUNK_SIZE):
+        self.file = file
+        self.chunk_size = chunk_size
+        self.buffer = ""
+        self.pos = 0
+        self.at_end = False
+        self.decoder = json.JSONDecoder()
+
+    def fill(self, size: int) -> bool:
+        # drops what was consumed, returns False at the end of the file
+        if self.at_end:
+            return False
+        chunk = self.file.read(size)
+        if not chunk:
+            self.at_end = True
+            return False
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self) -> str:
+        """Next character that is not whitespace, empty at the end of the file."""
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in self.WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buffer) or not self.fill(self.chunk_size):
+                return self.buffer[self.pos:self.pos + 1]
+
+    def expect(self, char: str):
+        found = self.peek()
+        if found != char:
+            raise json.JSONDecodeError(f"Expecting {char!r}", self.buffer, self.pos)
+        self.pos += 1
+
+    def value(self):
+        """Decode the next value whole."""
+        self.peek()
+        size = self.chunk_size
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                # the value may continue past the buffer
+                if self.fill(size):
+                    size *= 2
+                    continue
+                raise
+            rest = len(self.buffer) - end
+            if rest <= 2 and not self.buffer[end:].strip(self.NUMBER_TAIL) and self.fill(size):
+                # a number may continue past the buffer
+                continue
+            self.pos = end
+            return value
+
+    def members(self) -> Iterator[str]:
+        """Names of the members of the object starting here, the stream at their values."""
+        self.expect("{")
+        if self.peek() == "}":
+            self.pos += 1
+            return
+        while True:
+            name = self.value()
+            self.expect(":")
+            yield name
+            if self.peek() == ",":
+                self.pos += 1
+                continue
+            self.expect("}")
+            return
+
+    def elements(self) -> Iterator[int]:
+        """Indexes of the elements of the array starting here, the stream at their values."""
+        self.expect("[")
+        if self.peek() == "]":
+            self.pos += 1
+            return
+        index = 0
+        while True:
+            yield index
+            index += 1
+            if self.peek() == ",":
+                self.pos += 1
+                continue
+            self.expect("]")
+            return
+
+
+def validate_stream(stream: JsonStream, schema: Optional[CompiledSchema], path: Path,
+                    report: Callable[[Path, str], None], depth: int):
+    """Validate the next value of a stream against a compiled schema.
+
+    Args:
+        stream (JsonStream): stream positioned at the value
+        schema (Optional[CompiledSchema]): schema of the value, None when any value is allowed
+        path (Path): JSON path of the value
+        report (Callable[[Path, str], None]): called with the path and message of every error
+        depth (int): container levels left to stream, deeper values are decoded whole
+    """
+    start = stream.peek()
+    if schema is None or depth == 0 or start not in "{[" or not start:
+        value = stream.value()
+        if schema is not None:
+            schema.check(value, path, report)
+        return
+    container = {} if start == "{" else []
+    if not schema.check_node(container, path, report):
+        stream.value()
+        return
+    if start == "{":
+        seen = set()
+        for name in stream.members():
+            seen.add(name)
+            if schema.additional is False and name not in schema.properties:
+                report(path, f"unexpected property {name!r}")
+                stream.value()
+                continue
+            validate_stream(stream, schema.child(name), (path, name), report, depth - 1)
+        for name in schema.required:
+            if name not in seen:
+                report(path, f"missing required property {name!r}")
+    else:
+        for index in stream.elements():
+            validate_stream(stream, schema.items, (path, index), report, depth - 1)
+
+
+class ErrorLog:
+    """Reporter collecting the errors of one document.
+
+    Args:
+        fail_fast (bool): raise SchemaError at the first error
+        max_errors (int): errors kept, the others are only counted
+    """
+
+    def __init__(self, fail_fast: bool = False, max_errors: int = MAX_ERRORS):
+        self.fail_fast = fail_fast
+        self.max_errors = max_errors
+        self.count = 0
+        self.errors = []
+
+    def __call__(self, path: Path, message: str):
+        if self.fail_fast:
+            raise SchemaError(f"{format_path(path)}: {message}")
+        self.count += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append({"path": format_path(path), "message": message})
+
+    def result(self, name: Optional[str]) -> Dict:
+        """Validation report, whether the document is valid, its error count and errors."""
+        return {"file": name, "valid": self.count == 0, "error_count": self.count, "errors": self.errors}
+
+
+def validate_value(value, schema: CompiledSchema = None, fail_fast: bool = False,
+                   max_errors: int = MAX_ERRORS, name: str = None) -> Dict:
+    """Validate a document already decoded.
+
+    Args:
+        value: decoded document
+        schema (CompiledSchema): compiled schema, aggregate.schema by default
+        fail_fast (bool): raise SchemaError at the first error
+        max_errors (int): errors kept in the report, validation goes on past them
+        name (str): name of the document in the report
+
+    Returns:
+        Dict: validation report, see ErrorLog.result
+    """
+    schema = schema or compile_schema()
+    log = ErrorLog(fail_fast, max_errors)
+    schema.check(value, "$", log)
+    return log.result(name)
+
+
+def validate_file(json_file, schema: CompiledSchema = None, fail_fast: bool = False,
+                  max_errors: int = MAX_ERRORS, many: bool = False,
+                  chunk_size: int = CHUNK_SIZE) -> Dict:
+    """Validate a JSON document while streaming it.
+
+    Args:
+        json_file: path to the JSON document (optionally gzipped) or an open text file
+        schema (CompiledSchema): compiled schema, aggregate.schema by default
+        fail_fast (bool): raise SchemaError at the first error
+        max_errors (int): errors kept in the report, validation goes on past them
+        many (bool): the document is an array of documents (aggregated workflows)
+        chunk_size (int): characters read at a time
+
+    Returns:
+        Dict: validation report, see ErrorLog.result
+    """
+    schema = schema or compile_schema()
+    log = ErrorLog(fail_fast, max_errors)
+    opened = isinstance(json_file, (str, os.PathLike))
+    file = open_compressed(str(json_file), "rt") if opened else json_file
+    try:
+        stream = JsonStream(file, chunk_size)
+        if many:
+            aggregates = CompiledSchema({"type": "array"})
+            aggregates.items = schema
+            validate_stream(stream, aggregates, "$", log, STREAM_DEPTH + 1)
+        else:
+            validate_stream(stream, schema, "$", log, STREAM_DEPTH)
+        if stream.peek():
+            raise json.JSONDecodeError("Extra data", stream.buffer, stream.pos)
+    finally:
+        if opened:
+            file.close()
+    return log.result(str(json_file) if opened else getattr(json_file, "name", None))
+
+
+def validate_files(json_files: List[str], schema: CompiledSchema = None, fail_fast: bool = False,
+                   max_errors: int = MAX_ERRORS, many: bool = False) -> List[Dict]:
+    """Validate JSON documents, a document that cannot be decoded is reported as invalid.
+
+    Args:
+        json_files (List[str]): paths to the JSON documents
+        schema (CompiledSchema): compiled schema, aggregate.schema by default
+        fail_fast (bool): stop at the first error, reported as the only error of its document
+        max_errors (int): errors kept per document
+        many (bool): every document is an array of documents
+
+    Returns:
+        List[Dict]: validation reports of the documents, see ErrorLog.result
+    """
+    reports = []
+    for json_file in json_files:
+        try:
+            reports.append(validate_file(json_file, schema, fail_fast, max_errors, many))
+        except (SchemaError, json.JSONDecodeError) as error:
+            reports.append({"file": str(json_file), "valid": False, "error_count": 1,
+                            "errors": [{"path": "$", "message": str(error)}]})
+            if fail_fast:
+                break
+    return reports
+
+
+def write_report(reports: List[Dict], report_file: str):
+    """Write validation reports as JSON.
+
+    Args:
+        reports (List[Dict]): validation reports, see ErrorLog.result
+        report_file (str): path to the JSON report
+    """
+    with open(report_file, "w") as ofile:
+        json.dump(reports, ofile, indent=2)
+
+
+def main(args) -> bool:
+    reports = validate_files(args.json, compile_schema(args.schema), args.fail_fast,
+                             args.max_errors, args.many)
+    for report in reports:
+        status = "valid" if report["valid"] else f"{report['error_count']} errors"
+        print(f"{report['file']}: {status}")
+        for error in report["errors"]:
+            print(f"    {error['path']}: {error['message']}")
+    if args.report:
+        write_report(reports, args.report)
+    return all(report["valid"] for report in reports)
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog="Aggregate schema validation",
+        description="Validate aggregate JSON files against aggregate.schema while streaming them")
+    parser.add_argument("json", nargs="+", help="aggregate JSON files, optionally gzipped")
+    parser.add_argument("--schema", default=SCHEMA_FILE, help="JSON schema, aggregate.schema by default")
+    parser.add_argument("--many", action="store_true",
+                        help="every file is an array of aggregates (aggregated workflows)")
+    parser.add_argument("--fail-fast", action="store_true", help="stop at the first error")
+    parser.add_argument("--max-errors", type=int, default=MAX_ERRORS, help="errors reported per file")
+    parser.add_argument("--report", help="JSON validation report [output]")
+    parser.add_argument("--strict", action="store_true",
+                        help="exit with an error when a file is not valid, implied by --fail-fast")
+    return parser
+
+
+if __name__ == "__main__":
+    args = build_parser().parse_args()
+    valid = main(args)
+    sys.exit(0 if valid or not (args.strict or args.fail_fast) else 1)
@@ -0,0 +1,102 @@
+import json
+import math
+from typing import Any, Optional
+
+import numpy as np
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# JSON outputs are encoded by orjson when it is installed, by the stdlib
+# encoder otherwise. NumPy arrays and scalars are written as lists and
+# numbers by both, without converting them beforehand. Both write the same
+# JSON: orjson only knows one indentation, 2 spaces, and writes NaN and
+# infinities as null, so the stdlib encoder does the same. indent=None
+# writes compact JSON.
+
+PRETTY_INDENT = 2
+
+
+def default(obj: Any) -> Any:
+    """Encode the types neither encoder knows about.
+
+    Args:
+        obj (Any): object the encoder could not serialize
+
+    Returns:
+        Any: a JSON serializable version of the object
+    """
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, tuple):
+        # namedtuples, orjson only takes plain tuples
+        return list(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def finite(obj: Any) -> Any:
+    """Replace NaN and infinities by None, as orjson writes them.
+
+    Args:
+        obj (Any): data to encode
+
+    Returns:
+        Any: the data with every non-finite float replaced by None
+    """
+    if isinstance(obj, float):
+        return obj if math.isfinite(obj) else None
+    if isinstance(obj, dict):
+        return {key: finite(value) for key, value in obj.items()}
+    if isinstance(obj, list):
+        return [finite(item) for item in obj]
+    if isinstance(obj, (tuple, np.ndarray, np.generic)):
+        return finite(default(obj))
+    return obj
+
+
+def dumps_bytes(data: Any, indent: Optional[int] = PRETTY_INDENT) -> bytes:
+    """Encode data as UTF-8 JSON.
+
+    Args:
+        data (Any): data to encode
+        indent (Optional[int]): indentation of pretty JSON, None for compact JSON
+
+    Returns:
+        bytes: the encoded JSON
+    """
+    if orjson is not None:
+        option = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+        if indent is not None:
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(data, default=default, option=option)
+    separators = (",", ":") if indent is None else None
+    return json.dumps(finite(data), indent=indent, separators=separators, default=default).encode()
+
+
+def dumps(data: Any, indent: Optional[int] = PRETTY_INDENT) -> str:
+    """Encode data as a JSON string, see dumps_bytes."""
+    return dumps_bytes(data, indent).decode()
+
+
+def dump(data: Any, json_file: str, indent: Optional[int] = PRETTY_INDENT):
+    """Write data as JSON.
+
+    Args:
+        data (Any): data to write
+        json_file (str): path to the JSON file
+        indent (Optional[int]): indentation of pretty JSON, None for compact JSON
+    """
+    with open(json_file, "wb") as ofile:
+        ofile.write(dumps_bytes(data, indent))
+
+
+def loads(text) -> Any:
+    """Decode a JSON document given as str or bytes."""
+    if orjson is not None:
+        return orjson.loads(text)
+    return json.loads(text)
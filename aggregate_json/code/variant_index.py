@@ -0,0 +1,43 @@
+import numpy as np
+import pandas as pd
+
+
+def read_variant_index(index_file: str) -> pd.Index:
+    """Read the variant index written by vcf_transform.
+
+    Args:
+        index_file (str): path to variant_index.tsv
+
+    Returns:
+        pd.Index: mutation ids (chrom:pos) ordered by their dense variant id
+    """
+    df_index = pd.read_csv(index_file, sep="\t", dtype={"mutation_id": str})
+    df_index = df_index.sort_values("variant_id")
+    if not np.array_equal(df_index["variant_id"].to_numpy(), np.arange(len(df_index))):
+        raise ValueError(f"Variant ids of {index_file} are not dense")
+    return pd.Index(df_index["mutation_id"])
+
+
+def strip_bytes_literal(ids: pd.Series) -> pd.Series:
+    """Remove the b'' quoting pyclone-vi writes around its ids.
+
+    Args:
+        ids (pd.Series): ids, quoted or not
+
+    Returns:
+        pd.Series: plain string ids
+    """
+    return ids.astype(str).str.replace(r"^b(['\"])(.*)\1$", r"\2", regex=True)
+
+
+def encode(ids, index: pd.Index) -> np.ndarray:
+    """Turn ids into integer codes.
+
+    Args:
+        ids: ids to encode
+        index (pd.Index): unique ids, the code of an id is its position
+
+    Returns:
+        np.ndarray: code of every id, -1 for ids missing from the index
+    """
+    return index.get_indexer(ids)
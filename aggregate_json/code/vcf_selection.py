@@ -0,0 +1,147 @@
+from typing import Iterator, List, Optional, Set
+from collections import namedtuple
+import os
+import pysam
+
+
+# zero based, half open, end is None for the whole contig
+Region = namedtuple("Region", ["contig", "start", "end"])
+
+
+def parse_regions(spec: str) -> List[Region]:
+    """Parse a region selection.
+
+    Accepts a BED file or a comma separated list of contig or
+    contig:start-end items (one based, inclusive). Overlapping regions
+    are merged so no record is read twice.
+
+    Args:
+        spec (str): BED file path or region list
+
+    Returns:
+        List[Region]: sorted, non overlapping regions
+    """
+    regions = []
+    if os.path.isfile(spec):
+        with open(spec, "r") as bed:
+            for line in bed:
+                if not line.strip() or line.startswith(("#", "track", "browser")):
+                    continue
+                fields = line.split("\t")
+                regions.append(Region(fields[0], int(fields[1]), int(fields[2])))
+    else:
+        for item in spec.split(","):
+            item = item.strip()
+            if ":" in item:
+                contig, interval = item.rsplit(":", 1)
+                start, end = interval.split("-")
+                regions.append(Region(contig, int(start) - 1, int(end)))
+            elif item:
+                regions.append(Region(item, 0, None))
+    return merge_regions(regions)
+
+
+def merge_regions(regions: List[Region]) -> List[Region]:
+    """Merge overlapping and adjacent regions.
+
+    Args:
+        regions (List[Region]): regions in any order
+
+    Returns:
+        List[Region]: non overlapping regions, sorted by contig name and start
+    """
+    merged = []
+    for region in sorted(regions, key=lambda r: (r.contig, r.start)):
+        last = merged[-1] if merged else None
+        if last is not None and last.contig == region.contig and \
+                (last.end is None or region.start <= last.end):
+            end = None if last.end is None or region.end is None else max(last.end, region.end)
+            merged[-1] = Region(last.contig, last.start, end)
+        else:
+            merged.append(region)
+    return merged
+
+
+def order_regions(regions: List[Region], contigs: List[str]) -> List[Region]:
+    """Merge regions and sort them in file order.
+
+    Args:
+        regions (List[Region]): selected regions
+        contigs (List[str]): contigs in the order of the VCF header
+
+    Returns:
+        List[Region]: non overlapping regions by header contig order, then start
+    """
+    rank = {contig: index for index, contig in enumerate(contigs)}
+    return sorted(merge_regions(regions), key=lambda r: (rank.get(r.contig, len(rank)), r.contig, r.start))
+
+
+def in_region(start: int, region: Region) -> bool:
+    return start >= region.start and (region.end is None or start < region.end)
+
+
+def parse_samples(spec: str) -> List[str]:
+    """Parse a sample selection, a file with one sample per line or a comma separated list.
+
+    Args:
+        spec (str): sample file path or sample list
+
+    Returns:
+        List[str]: sample names
+    """
+    if os.path.isfile(spec):
+        with open(spec, "r") as sample_file:
+            return [line.strip() for line in sample_file if line.strip()]
+    return [sample.strip() for sample in spec.split(",") if sample.strip()]
+
+
+def tumor_samples(vcf: pysam.VariantFile) -> Set[str]:
+    return {rec.value for rec in vcf.header.records if rec.key == "tumor_sample"}
+
+
+def subset_samples(vcf: pysam.VariantFile, samples: Optional[List[str]]):
+    """Restrict the samples parsed from every record.
+
+    Tumor samples not selected are dropped, other samples (the normal) are kept.
+
+    Args:
+        vcf (pysam.VariantFile): opened VCF, before reading any record
+        samples (Optional[List[str]]): selected tumor samples, None for all
+    """
+    if not samples:
+        return
+    tumors = tumor_samples(vcf)
+    keep = [sample for sample in vcf.header.samples if sample not in tumors or sample in samples]
+    if not any(sample in tumors for sample in keep):
+        raise ValueError(f"None of the samples {samples} is a tumor sample of the VCF")
+    vcf.subset_samples(keep)
+
+
+def fetch_records(vcf: pysam.VariantFile, regions: Optional[List[Region]]) -> Iterator[pysam.VariantRecord]:
+    """Iterate over the records of the selected regions.
+
+    Indexed (tabix/CSI) files only read the blocks overlapping the regions,
+    other files are streamed and filtered record by record. Both keep the
+    records starting in a region, in file order, each record once.
+
+    Args:
+        vcf (pysam.VariantFile): opened VCF
+        regions (Optional[List[Region]]): selected regions, None for every record
+
+    Returns:
+        Iterator[pysam.VariantRecord]: records in file order
+    """
+    if not regions:
+        yield from vcf
+    elif vcf.index is not None:
+        for region in order_regions(regions, list(vcf.header.contigs) or list(vcf.index)):
+            if region.contig not in vcf.index:
+                continue
+            # fetch also returns the records overlapping the region from before it
+            for rec in vcf.fetch(region.contig, region.start, region.end):
+                if in_region(rec.start, region):
+                    yield rec
+    else:
+        for rec in vcf:
+            if any(rec.contig == r.contig and in_region(rec.start, r) for r in regions):
+                yield rec
@@ -0,0 +1,89 @@
+import argparse
+import csv
+import json
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+
+
+# A manifest lists the inputs and outputs of many samples, one per TSV row
+# or JSON line. Columns are the long options of the tool without the
+# leading dashes, a 'sample' column names the sample in the report. Every
+# row runs in the same interpreter, optionally on a process pool, and a
+# failing sample is reported without stopping the others.
+
+
+def add_batch_arguments(parser):
+    parser.add_argument("--manifest", type=str,
+                        help="TSV or JSONL manifest, one sample per row, "
+                             "options of the command line apply to every row")
+    parser.add_argument("--processes", type=int, default=1,
+                        help="worker processes for the manifest rows")
+    parser.add_argument("--report", type=str,
+                        help="JSON report of every manifest row [output]")
+
+
+def split_batch_arguments(argv):
+    """
+    separates the batch options from the options shared by every row
+    """
+    parser = argparse.ArgumentParser(add_help=False)
+    add_batch_arguments(parser)
+    return parser.parse_known_args(argv)
+
+
+def read_manifest(manifest_file):
+    """
+    returns one dict per sample, JSON lines for .jsonl/.json files, TSV otherwise
+    """
+    with open(manifest_file, "r") as manifest:
+        if manifest_file.endswith((".jsonl", ".json")):
+            return [json.loads(line) for line in manifest if line.strip()]
+        return [row for row in csv.DictReader(manifest, delimiter="\t")]
+
+
+def row_to_argv(row):
+    argv = []
+    for option, value in row.items():
+        if option == "sample" or value is None or value == "":
+            continue
+        values = value if isinstance(value, list) else str(value).split()
+        argv += [f"--{option}"] + [str(v) for v in values]
+    return argv
+
+
+def run_row(job):
+    run_argv, sample, argv = job
+    start = time.time()
+    result = {"sample": sample, "status": "ok", "error": None, "outputs": []}
+    try:
+        result["outputs"] = run_argv(argv)
+    except (Exception, SystemExit) as e:
+        result["status"] = "failed"
+        result["error"] = "".join(traceback.format_exception_only(type(e), e)).strip()
+    result["seconds"] = round(time.time() - start, 3)
+    return result
+
+
+def run_manifest(run_argv, shared_argv, options):
+    """
+    runs run_argv(shared_argv + row options) for every manifest row,
+    returns the report and whether at least one row succeeded
+    """
+    rows = read_manifest(options.manifest)
+    jobs = [(run_argv, row.get("sample", str(i)), shared_argv + row_to_argv(row))
+            for i, row in enumerate(rows)]
+    if options.processes > 1 and len(jobs) > 1:
+        with ProcessPoolExecutor(min(options.processes, len(jobs))) as pool:
+            report = list(pool.map(run_row, jobs))
+    else:
+        report = [run_row(job) for job in jobs]
+
+    failed = [result for result in report if result["status"] != "ok"]
+    for result in failed:
+        print(f"sample {result['sample']} failed: {result['error']}")
+    print(f"{len(report) - len(failed)} of {len(report)} samples succeeded")
+    if options.report:
+        with open(options.report, "w") as report_file:
+            json.dump(report, report_file, indent=2)
+    return report, len(failed) < len(report) or not report
@@ -0,0 +1,129 @@
+import gzip
+import io
+import os
+import struct
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+# BGZF files (bgzip, htslib) are gzip files made of independent members of
+# at most 64 KiB, each giving its compressed size in a 'BC' extra field.
+# The reader walks the block headers, inflates batches of blocks on a thread
+# pool (zlib releases the GIL) and keeps READ_AHEAD batches per thread in
+# flight ahead of the consumer. Plain gzip files are one deflate stream and
+# are streamed by gzip, uncompressed files are opened as they are.
+
+GZIP_MAGIC = b'\x1f\x8b'
+BGZF_MAGIC = b'\x1f\x8b\x08\x04'
+BLOCKS_PER_TASK = 64        # about 4 MiB of compressed data per task
+READ_AHEAD = 2
+DECOMPRESS_THREADS = min(4, os.cpu_count() or 1)
+
+
+def read_block(bgzf_file):
+    """
+    returns the (deflate data, crc32, size) of the next block, None at the end
+    """
+    header = bgzf_file.read(12)
+    if not header:
+        return None
+    if len(header) < 12 or header[:4] != BGZF_MAGIC:
+        raise IOError('Not a BGZF block at offset ' + str(bgzf_file.tell() - len(header)))
+    xlen = struct.unpack('<H', header[10:12])[0]
+    extra = bgzf_file.read(xlen)
+    block_size = None
+    position = 0
+    while position + 4 <= len(extra):
+        subfield, length = extra[position:position + 2], struct.unpack('<H', extra[position + 2:position + 4])[0]
+        if subfield == b'BC':
+            block_size = struct.unpack('<H', extra[position + 4:position + 6])[0] + 1
+        position += 4 + length
+    if block_size is None:
+        raise IOError('BGZF block without its size')
+    rest = bgzf_file.read(block_size - 12 - xlen)
+    crc, size = struct.unpack('<II', rest[-8:])
+    return rest[:-8], crc, size
+
+
+def inflate(blocks):
+    chunks = []
+    for data, crc, size in blocks:
+        chunk = zlib.decompress(data, -15)
+        if len(chunk) != size or zlib.crc32(chunk) != crc:
+            raise IOError('Corrupted BGZF block')
+        chunks.append(chunk)
+    return b''.join(chunks)
+
+
+class BgzfReader(io.RawIOBase):
+    """
+    decompressed bytes of a BGZF file, blocks inflated in parallel
+    """
+
+    def __init__(self, path, threads=None):
+        self.file = open(path, 'rb')
+        self.threads = threads or DECOMPRESS_THREADS
+        self.pool = ThreadPoolExecutor(self.threads)
+        self.pending = deque()
+        self.buffer = b''
+        self.offset = 0
+        self.at_end = False
+        self.read_ahead()
+
+    def read_ahead(self):
+        while not self.at_end and len(self.pending) < self.threads * READ_AHEAD:
+            blocks = []
+            while len(blocks) < BLOCKS_PER_TASK:
+                block = read_block(self.file)
+                if block is None:
+                    self.at_end = True
+                    break
+                blocks.append(block)
+            if blocks:
+                self.pending.append(self.pool.submit(inflate, blocks))
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while self.offset >= len(self.buffer):
+            if not self.pending:
+                return 0
+            self.buffer = self.pending.popleft().result()
+            self.offset = 0
+            self.read_ahead()
+        n = min(len(buffer), len(self.buffer) - self.offset)
+        buffer[:n] = memoryview(self.buffer)[self.offset:self.offset + n]
+        self.offset += n
+        return n
+
+    def close(self):
+        if not self.closed:
+            self.pool.shutdown(wait=True, cancel_futures=True)
+            self.file.close()
+        super().close()
+
+
+def is_bgzf(path):
+    with open(path, 'rb') as compressed:
+        header = compressed.read(18)
+    return header[:4] == BGZF_MAGIC and header[12:14] == b'BC'
+
+
+def open_compressed(path, mode='rt', threads=None, encoding='utf-8'):
+    """
+    opens a BGZF, gzip or uncompressed file for reading, whatever its name.
+    BGZF blocks are decompressed on threads, plain gzip is streamed
+    """
+    with open(path, 'rb') as raw:
+        magic = raw.read(2)
+    if is_bgzf(path):
+        binary = io.BufferedReader(BgzfReader(path, threads), buffer_size=1 << 20)
+    elif magic == GZIP_MAGIC:
+        binary = gzip.open(path, 'rb')
+    else:
+        binary = open(path, 'rb')
+    if 'b' in mode:
+        return binary
+    return io.TextIOWrapper(binary, encoding=encoding)
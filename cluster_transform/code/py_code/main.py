@@ -1,9 +1,14 @@
 import sys
+import numpy as np
 import pandas as pd
 import argparse
-import ast
 from dataclasses import dataclass, asdict
 
+import py_code.batch as batch
+import py_code.pruning as pruning
+from py_code.bgzf import open_compressed
+from py_code.variant_index import encode, read_variant_index, strip_bytes_literal
+
 
 @dataclass
 class Clustered(object):
@@ -29,80 +34,148 @@ SUPPORT_CLUSTER = ["pyclone", "pyclone_vi", "pyclone-vi"]
 
 def main(args):
     success = False
-    if args.type not in SUPPORT_CLUSTER:
-        raise Exception('Can only understand input from ' +
-                        ', '.join(SUPPORT_CLUSTER))
-    
-    if args.alpha <= 0 or args.alpha > 1:
-        raise Exception('Tail probability alpha is not in (0, 1]')
-
-    if args.type == "pyclone":
-        list_clustered, n_cluster, n_sample = get_cluster_pyclone(args.cluster, args.alpha)
-    elif args.type == "pyclone_vi" or args.type == "pyclone-vi":
-        list_clustered, n_cluster, n_sample = get_cluster_pyclone_vi(args.cluster, args.pyclone_vi, args.alpha)
-
-    write_spruce(list_clustered, n_cluster, n_sample, args.output)
+    settings = get_settings(args.type, args.alpha, args.output)
+
+    prune = pruning.is_pruning(args.max_clusters, args.min_cluster_size, args.min_assignment_prob)
+    if args.cluster_map and not prune:
+        raise Exception('A cluster map is only written when the clusters are pruned')
+
+    # Each input table is parsed (and pruned) once and shared by every (type, alpha) setting
+    loaded = dict()
+    for cluster_type, alpha, output in settings:
+        if cluster_type not in loaded:
+            df_vaf, vaf_column = load_clusters(cluster_type, args.cluster, args.pyclone_vi,
+                                               args.variant_index)
+            if prune:
+                df_vaf, cluster_map = pruning.prune_clusters(df_vaf, vaf_column, args.max_clusters,
+                                                             args.min_cluster_size,
+                                                             args.min_assignment_prob)
+                if args.cluster_map:
+                    pruning.write_cluster_map(cluster_map, args.cluster_map)
+            loaded[cluster_type] = df_vaf, vaf_column
+        df_vaf, vaf_column = loaded[cluster_type]
+        list_clustered, n_cluster, n_sample = summarize_clusters(df_vaf, vaf_column, alpha)
+        write_spruce(list_clustered, n_cluster, n_sample, output)
+
     success = True
     return success
 
 
-def get_cluster_pyclone(cluster_file, alpha):
-    df_clusters = pd.read_csv(cluster_file, sep='\t')
-    # mutation_id
-    # sample_id
-    # cluster_id
-    # cellular_prevalence
-    # cellular_prevalence_std
-    # variant_allele_frequency
+def get_settings(cluster_types, alphas, outputs):
+    """
+    pairs up the cluster types, alphas and output files given on the command line.
+    A single cluster type or alpha is broadcast to every output file.
+    """
+    n_settings = len(outputs)
+    if len(cluster_types) == 1:
+        cluster_types = cluster_types * n_settings
+    if len(alphas) == 1:
+        alphas = alphas * n_settings
+    if len(cluster_types) != n_settings or len(alphas) != n_settings:
+        raise Exception('Need one output file per (cluster type, alpha) setting')
+
+    for cluster_type in cluster_types:
+        if cluster_type not in SUPPORT_CLUSTER:
+            raise Exception('Can only understand input from ' +
+                            ', '.join(SUPPORT_CLUSTER))
+    for alpha in alphas:
+        if alpha <= 0 or alpha > 1:
+            raise Exception('Tail probability alpha is not in (0, 1]')
+
+    return list(zip(cluster_types, alphas, outputs))
+
+
+def load_clusters(cluster_type, cluster_file, tsv_file, index_file=None):
+    """
+    reads the clustering output once, returns a table with one row per
+    (sample_id, cluster_id, mutation) and the name of its VAF column
+    """
+    if cluster_type == "pyclone":
+        return load_cluster_pyclone(cluster_file), "variant_allele_frequency"
+    elif cluster_type == "pyclone_vi" or cluster_type == "pyclone-vi":
+        return load_cluster_pyclone_vi(cluster_file, tsv_file, index_file), "VAF"
+
+
+def summarize_clusters(df_vaf, vaf_column, alpha):
+    """
+    computes the [alpha/2, 1 - alpha/2] VAF interval of every cluster in every sample
+    """
     list_clustered = []
-    grouped = df_clusters.groupby(["sample_id", "cluster_id"])
+    grouped = df_vaf.groupby(["sample_id", "cluster_id"])[vaf_column]
+    vaf_lb = grouped.quantile(alpha/2)
+    vaf_mean = grouped.mean()
+    vaf_ub = grouped.quantile(1 - alpha/2)
     sample_to_id = {s: i for i, s in enumerate(
-        df_clusters["sample_id"].unique())}
-    for (sample_name, cluster_id), group in grouped:
-        vaf_lb = group["variant_allele_frequency"].quantile(alpha/2)
-        vaf_mean = group["variant_allele_frequency"].mean()
-        vaf_ub = group["variant_allele_frequency"].quantile(1 - alpha/2)
+        df_vaf["sample_id"].unique())}
+    for (sample_name, cluster_id) in vaf_mean.index:
         list_clustered.append(Clustered(sample_to_id[sample_name],
                                         sample_name,
                                         cluster_id,
                                         cluster_id,
-                                        vaf_lb,
-                                        vaf_mean,
-                                        vaf_ub))
-    n_cluster = len(df_clusters["cluster_id"].unique())
+                                        vaf_lb[(sample_name, cluster_id)],
+                                        vaf_mean[(sample_name, cluster_id)],
+                                        vaf_ub[(sample_name, cluster_id)]))
+    n_cluster = len(df_vaf["cluster_id"].unique())
     n_sample = len(sample_to_id)
     return list_clustered, n_cluster, n_sample
 
 
+def get_cluster_pyclone(cluster_file, alpha):
+    df_clusters = load_cluster_pyclone(cluster_file)
+    return summarize_clusters(df_clusters, "variant_allele_frequency", alpha)
+
+
+def load_cluster_pyclone(cluster_file):
+    with open_compressed(cluster_file) as clusters:
+        df_clusters = pd.read_csv(clusters, sep='\t')
+    # mutation_id
+    # sample_id
+    # cluster_id
+    # cellular_prevalence
+    # cellular_prevalence_std
+    # variant_allele_frequency
+    return df_clusters
+
+
 def get_cluster_pyclone_vi(cluster_file, tsv_files, alpha):
-    df_clusters = pd.read_csv(cluster_file, sep='\t',
-                              dtype={"mutation_id": bytes, "sample_id": bytes})
-    # We need ast.literal_eval(x).decode("utf-8") since the csv file output by pyclone-vi
-    # contains literal "b'xxx_id'" in the csv file, we only want the string "xxx_id" inside.
-    # May change this to a better way in the future.
-    df_clusters["mutation_id"] = df_clusters["mutation_id"].apply(lambda x: ast.literal_eval(x).decode("utf-8"))
-    df_clusters["sample_id"] = df_clusters["sample_id"].apply(lambda x: ast.literal_eval(x).decode("utf-8"))
-    df_input = pd.read_csv(tsv_files, sep='\t').set_index(["sample_id", "mutation_id"])
-    df_input["VAF"] = df_input["alt_counts"] / (df_input["ref_counts"] + df_input["alt_counts"])
-    list_clustered = []
-    grouped = df_clusters.groupby(["sample_id", "cluster_id"])
-    sample_to_id = {s: i for i, s in enumerate(
-        df_clusters["sample_id"].unique())}
-    for (sample_name, cluster_id), group in grouped:
-        vaf = df_input.loc[(group["sample_id"], group["mutation_id"]), "VAF"]
-        vaf_lb = vaf.quantile(alpha/2)
-        vaf_mean = vaf.mean()
-        vaf_ub = vaf.quantile(1 - alpha/2)
-        list_clustered.append(Clustered(sample_to_id[sample_name],
-                                        sample_name,
-                                        cluster_id,
-                                        cluster_id,
-                                        vaf_lb,
-                                        vaf_mean,
-                                        vaf_ub))
-    n_cluster = len(df_clusters["cluster_id"].unique())
-    n_sample = len(sample_to_id)
-    return list_clustered, n_cluster, n_sample
+    df_clusters = load_cluster_pyclone_vi(cluster_file, tsv_files)
+    return summarize_clusters(df_clusters, "VAF", alpha)
+
+
+def load_cluster_pyclone_vi(cluster_file, tsv_files, index_file=None):
+    # bgzipped inputs are decompressed on threads, plain gzip is streamed
+    with open_compressed(cluster_file) as clusters:
+        df_clusters = pd.read_csv(clusters, sep='\t',
+                                  dtype={"mutation_id": str, "sample_id": str})
+    # the csv file output by pyclone-vi contains literal "b'xxx_id'", we only want "xxx_id"
+    df_clusters["mutation_id"] = strip_bytes_literal(df_clusters["mutation_id"])
+    df_clusters["sample_id"] = strip_bytes_literal(df_clusters["sample_id"])
+    with open_compressed(tsv_files) as tsv_file:
+        df_input = pd.read_csv(tsv_file, sep='\t', dtype={"mutation_id": str, "sample_id": str})
+    vaf = df_input["alt_counts"] / (df_input["ref_counts"] + df_input["alt_counts"])
+
+    # ids are turned into integer codes once, the variant index of vcf_transform
+    # numbers the variants when there is one, otherwise the pyclone-vi input does
+    if index_file:
+        variants = read_variant_index(index_file)
+    else:
+        variants = pd.Index(df_input["mutation_id"].unique())
+    samples = pd.Index(df_input["sample_id"].unique())
+    input_variants = encode(df_input["mutation_id"], variants)
+    if (input_variants < 0).any():
+        raise Exception('The pyclone-vi input has mutations missing from the variant index')
+    vaf_matrix = np.full((len(samples), len(variants)), np.nan)
+    vaf_matrix[encode(df_input["sample_id"], samples), input_variants] = vaf.to_numpy()
+
+    # the VAF of every clustered mutation is a lookup in the (sample, variant) matrix
+    cluster_samples = encode(df_clusters["sample_id"], samples)
+    cluster_variants = encode(df_clusters["mutation_id"], variants)
+    found = (cluster_samples >= 0) & (cluster_variants >= 0)
+    cluster_vaf = np.full(len(df_clusters), np.nan)
+    cluster_vaf[found] = vaf_matrix[cluster_samples[found], cluster_variants[found]]
+    df_clusters["variant_id"] = cluster_variants
+    df_clusters["VAF"] = cluster_vaf
+    return df_clusters
 
 
 def write_spruce(list_clustered, n_cluster, n_sample, tsv_file):
@@ -116,20 +189,51 @@ def write_spruce(list_clustered, n_cluster, n_sample, tsv_file):
             ofile.write(clu.to_line() + '\n')
 
 
-if __name__ == "__main__":
+def build_parser():
     parser = argparse.ArgumentParser("Cluster transform")
-    parser.add_argument("-t", "--type", type=str,
-                        help="input type", choices=SUPPORT_CLUSTER)
+    parser.add_argument("-t", "--type", type=str, nargs="+",
+                        help="input type, one per output file or a single one for all",
+                        choices=SUPPORT_CLUSTER)
     parser.add_argument("-c", "--cluster", type=str,
                         help="cluster file, in tsv format")
     parser.add_argument("-v", "--pyclone-vi", type=str,
                         help="pyclone-vi input file, in tsv format")
-    parser.add_argument("-a", "--alpha", type=float, help="the tail probability")
-    parser.add_argument("-o", "--output", type=str,
-                        help="output data file for SPRUCE")
-    args = parser.parse_args(None if sys.argv[1:] else ['-h'])
+    parser.add_argument("-i", "--variant-index", type=str,
+                        help="variant index written by vcf_transform, in tsv format")
+    parser.add_argument("-a", "--alpha", type=float, nargs="+",
+                        help="the tail probability, one per output file or a single one for all")
+    parser.add_argument("-o", "--output", type=str, nargs="+",
+                        help="output data file(s) for SPRUCE")
+    parser.add_argument("--max-clusters", type=int,
+                        help="merge the smallest clusters until at most this many are left")
+    parser.add_argument("--min-cluster-size", type=int,
+                        help="merge clusters with fewer mutations into their closest cluster")
+    parser.add_argument("--min-assignment-prob", type=float,
+                        help="drop mutations assigned to their cluster with a lower probability")
+    parser.add_argument("--cluster-map", type=str,
+                        help="output json file mapping the input clusters to the pruned ones")
+    batch.add_batch_arguments(parser)
+    return parser
+
+
+def run_batch_row(argv):
+    """
+    runs one sample of a manifest, returns the files it wrote
+    """
+    args = build_parser().parse_args(argv)
+    main(args)
+    return args.output
+
 
-    succeeded = main(args)
+if __name__ == "__main__":
+    argv = sys.argv[1:]
+    options, shared_argv = batch.split_batch_arguments(argv)
+    if options.manifest:
+        # many samples in one process, fails only when every sample failed
+        report, succeeded = batch.run_manifest(run_batch_row, shared_argv, options)
+    else:
+        args = build_parser().parse_args(argv if argv else ['-h'])
+        succeeded = main(args)
 
     if succeeded:
         exit_code = 0
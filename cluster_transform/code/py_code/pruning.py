@@ -0,0 +1,97 @@
+import numpy as np
+
+import py_code.serialization as serialization
+
+
+# SPRUCE enumerates trees over every cluster it is given, its running time
+# grows exponentially with their number. Before the clusters are written,
+# mutations with a low pyclone-vi assignment probability are dropped, and
+# the smallest cluster is merged into the cluster with the closest mean VAF
+# profile until every cluster is large enough and there are at most
+# max_clusters of them. The remaining clusters are renumbered 0..n-1 and
+# the cluster map records what happened to every input cluster, so that
+# aggregate_json can apply the same mapping and report it.
+
+
+def is_pruning(max_clusters=None, min_cluster_size=None, min_assignment_prob=None):
+    return max_clusters is not None or min_cluster_size is not None or \
+        min_assignment_prob is not None
+
+
+def prune_clusters(df_vaf, vaf_column, max_clusters=None, min_cluster_size=None,
+                   min_assignment_prob=None):
+    """
+    returns the assignments with the pruned cluster ids and the cluster map
+    """
+    if max_clusters is not None and max_clusters < 1:
+        raise Exception('The maximum cluster count must be at least 1')
+    cluster_sizes = df_vaf.groupby("cluster_id")["mutation_id"].nunique()
+
+    # a mutation is dropped when one of its assignments is not supported enough
+    dropped_mutations = []
+    if min_assignment_prob is not None and "cluster_assignment_prob" in df_vaf.columns:
+        low = df_vaf["cluster_assignment_prob"] < min_assignment_prob
+        dropped_mutations = sorted(df_vaf.loc[low, "mutation_id"].unique())
+        df_vaf = df_vaf[~df_vaf["mutation_id"].isin(dropped_mutations)]
+
+    sizes = df_vaf.groupby("cluster_id")["mutation_id"].nunique().to_dict()
+    profiles = df_vaf.groupby(["cluster_id", "sample_id"])[vaf_column].mean().unstack()
+    profiles = {cluster_id: row.to_numpy() for cluster_id, row in profiles.fillna(0).iterrows()}
+    merged_into = dict()
+
+    def too_many():
+        return max_clusters is not None and len(sizes) > max_clusters
+
+    def too_small(cluster_id):
+        return min_cluster_size is not None and sizes[cluster_id] < min_cluster_size
+
+    while len(sizes) > 1:
+        smallest = min(sizes, key=lambda cluster_id: (sizes[cluster_id], cluster_id))
+        if not too_many() and not too_small(smallest):
+            break
+        others = [cluster_id for cluster_id in sizes if cluster_id != smallest]
+        distances = [np.linalg.norm(profiles[cluster_id] - profiles[smallest]) for cluster_id in others]
+        nearest = others[int(np.argmin(distances))]
+        total = sizes[nearest] + sizes[smallest]
+        profiles[nearest] = (profiles[nearest] * sizes[nearest] +
+                             profiles[smallest] * sizes[smallest]) / total
+        sizes[nearest] = total
+        merged_into[smallest] = nearest
+        del sizes[smallest], profiles[smallest]
+
+    renumbered = {cluster_id: new_id for new_id, cluster_id in enumerate(sorted(sizes))}
+
+    def target(cluster_id):
+        while cluster_id in merged_into:
+            cluster_id = merged_into[cluster_id]
+        return renumbered.get(cluster_id)
+
+    clusters = []
+    for cluster_id, size in cluster_sizes.items():
+        new_id = target(cluster_id)
+        if new_id is None:
+            status = "dropped"
+        elif cluster_id in merged_into:
+            status = "merged"
+        else:
+            status = "kept"
+        clusters.append({"cluster_id": int(cluster_id),
+                         "new_cluster_id": None if new_id is None else int(new_id),
+                         "status": status,
+                         "mutations": int(size)})
+    cluster_map = {
+        "max_clusters": max_clusters,
+        "min_cluster_size": min_cluster_size,
+        "min_assignment_prob": min_assignment_prob,
+        "clusters": clusters,
+        "dropped_mutations": [str(mutation_id) for mutation_id in dropped_mutations]
+    }
+
+    df_vaf = df_vaf.copy()
+    df_vaf["cluster_id"] = df_vaf["cluster_id"].map(target).astype(int)
+    return df_vaf, cluster_map
+
+
+def write_cluster_map(cluster_map, out_fn):
+    print("writing cluster map as json to : " + str(out_fn))
+    serialization.dump(cluster_map, out_fn)
@@ -0,0 +1,63 @@
+import json
+import math
+
+import numpy as np
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# JSON outputs are encoded by orjson when it is installed, by the stdlib
+# encoder otherwise. NumPy arrays and scalars are written as lists and
+# numbers by both, without converting them beforehand. Both write the same
+# JSON: orjson only knows one indentation, 2 spaces, and writes NaN and
+# infinities as null, so the stdlib encoder does the same. indent=None
+# writes compact JSON.
+
+PRETTY_INDENT = 2
+
+
+def default(obj):
+    """
+    encodes the types neither encoder knows about
+    """
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, tuple):
+        # namedtuples, orjson only takes plain tuples
+        return list(obj)
+    raise TypeError('Object of type ' + type(obj).__name__ + ' is not JSON serializable')
+
+def finite(obj):
+    """
+    replaces NaN and infinities by None, as orjson writes them
+    """
+    if isinstance(obj, float):
+        return obj if math.isfinite(obj) else None
+    if isinstance(obj, dict):
+        return {key: finite(value) for key, value in obj.items()}
+    if isinstance(obj, list):
+        return [finite(item) for item in obj]
+    if isinstance(obj, (tuple, np.ndarray, np.generic)):
+        return finite(default(obj))
+    return obj
+
+def dumps_bytes(data, indent=PRETTY_INDENT) -> bytes:
+    if orjson is not None:
+        option = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+        if indent is not None:
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(data, default=default, option=option)
+    separators = (',', ':') if indent is None else None
+    return json.dumps(finite(data), indent=indent, separators=separators, default=default).encode()
+
+def dumps(data, indent=PRETTY_INDENT) -> str:
+    return dumps_bytes(data, indent).decode()
+
+def dump(data, out_fn:str, indent=PRETTY_INDENT) -> None:
+    with open(out_fn, 'wb') as outfile:
+        outfile.write(dumps_bytes(data, indent))
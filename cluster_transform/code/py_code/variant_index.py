@@ -0,0 +1,31 @@
+import numpy as np
+import pandas as pd
+
+
+# variant_index.tsv is written by vcf_transform: one row per variant with
+# its dense integer id and its mutation_id (chrom:pos)
+
+def read_variant_index(index_file):
+    """
+    returns the mutation ids ordered by variant id, as a pandas Index
+    so that get_indexer turns mutation ids into variant ids
+    """
+    df_index = pd.read_csv(index_file, sep='\t', dtype={"mutation_id": str})
+    df_index = df_index.sort_values("variant_id")
+    if not np.array_equal(df_index["variant_id"].to_numpy(), np.arange(len(df_index))):
+        raise Exception(f'Variant ids of {index_file} are not dense')
+    return pd.Index(df_index["mutation_id"])
+
+
+def strip_bytes_literal(ids):
+    """
+    pyclone-vi writes its ids as python bytes literals, b'xxx_id' becomes xxx_id
+    """
+    return ids.astype(str).str.replace(r"^b(['\"])(.*)\1$", r"\2", regex=True)
+
+
+def encode(ids, index):
+    """
+    integer codes of ids in index, -1 for ids missing from it
+    """
+    return index.get_indexer(ids)
@@ -0,0 +1,89 @@
+import re
+from typing import Callable, Dict, List
+
+from function_registry import FunctionRegistry, InvalidCall
+
+# --------------------- Workflow Plans ---------------------
+
+# A plan is a whole DAG of function calls sent in one model response.
+# Arguments of a step refer to the future id of another step as
+# '$<step id>'. Every step is validated before any of them is submitted,
+# then the steps are submitted in dependency order.
+
+REFERENCE = re.compile(r'^\$(\w+)$')
+
+PLAN_DESCRIPTION = {
+    'name': 'submit_plan',
+    'description': 'Submits several tasks at once. Arguments of a step can use the future id '
+                   'of another step by writing $ followed by that step id, e.g. "$vcf"',
+    'parameters': {
+        'type': 'object',
+        'properties': {
+            'steps': {
+                'type': 'array',
+                'items': {
+                    'type': 'object',
+                    'properties': {
+                        'id': {'type': 'string'},
+                        'function': {'type': 'string'},
+                        'arguments': {'type': 'object'}
+                    },
+                    'required': ['id', 'function', 'arguments']
+                }
+            }
+        },
+        'required': ['steps']
+    }
+}
+
+def references(arguments:dict) -> List[str]:
+    found = []
+    for value in arguments.values():
+        values = value if isinstance(value, list) else [value]
+        for item in values:
+            match = REFERENCE.match(item) if isinstance(item, str) else None
+            if match:
+                found.append(match.group(1))
+    return found
+
+def order_steps(steps:List[dict]) -> List[dict]:
+    by_id = {step['id']: step for step in steps}
+    if len(by_id) != len(steps):
+        raise InvalidCall('Plan step ids must be unique')
+    ordered, visiting, visited = [], set(), set()
+    def visit(step_id:str):
+        if step_id in visited:
+            return
+        if step_id in visiting:
+            raise InvalidCall(f'Plan has a cycle through {step_id}')
+        if step_id not in by_id:
+            raise InvalidCall(f'Plan refers to unknown step {step_id}')
+        visiting.add(step_id)
+        for dependency in references(by_id[step_id]['arguments']):
+            visit(dependency)
+        visiting.discard(step_id)
+        visited.add(step_id)
+        ordered.append(by_id[step_id])
+    for step in steps:
+        visit(step['id'])
+    return ordered
+
+def resolve(arguments:dict, future_ids:Dict[str, str]) -> dict:
+    def resolve_value(value):
+        if isinstance(value, list):
+            return [resolve_value(item) for item in value]
+        match = REFERENCE.match(value) if isinstance(value, str) else None
+        return future_ids[match.group(1)] if match else value
+    return {name: resolve_value(value) for name, value in arguments.items()}
+
+def submit_plan(steps:List[dict], registry:FunctionRegistry,
+                executor:Callable[[str, dict], str]) -> Dict[str, str]:
+    ordered = order_steps(steps)
+    for step in ordered:
+        # references stand in for future ids, which are strings as well
+        registry.check(step['function'], step['arguments'])
+    future_ids = {}
+    for step in ordered:
+        arguments = resolve(step['arguments'], future_ids)
+        future_ids[step['id']] = executor(step['function'], arguments)
+    return future_ids
@@ -9,6 +9,7 @@ from parsl.dataflow.futures import AppFuture
 class AppFutureManager:
     app_counter = 0
     appfuture_map = {}
+    stage_map = {}
 
     def new_future_id(run_function):
         AppFutureManager.app_counter += 1
@@ -20,6 +21,25 @@ class AppFutureManager:
     def query(future_id:str) -> AppFuture:
         return AppFutureManager.appfuture_map[future_id]
     
+    def lookup_stage(stage_key:str):
+        # failed stages are submitted again instead of being shared
+        future_id = AppFutureManager.stage_map.get(stage_key)
+        if future_id is None:
+            return None
+        future = AppFutureManager.appfuture_map[future_id]
+        if future.done() and (future.cancelled() or future.exception() is not None):
+            return None
+        return future_id
+
+    def index_stage(stage_key:str, future_id:str):
+        if stage_key is not None:
+            AppFutureManager.stage_map[stage_key] = future_id
+
+    def forget_stages():
+        AppFutureManager.stage_map.clear()
+
     def new_dir():
+        # stages of an earlier run directory are not shared with the new one
+        AppFutureManager.forget_stages()
         AppFutureManager.DIR = generate_datetime_subdir(RUNS_DIR)
         sleep(1)
\ No newline at end of file
@@ -0,0 +1,62 @@
+import json
+import sqlite3
+from typing import List
+
+from storage_policy import open_stored
+
+# --------------------- Cohort Store ---------------------
+
+# One row per sample holding its aggregated.json document. Adding or
+# replacing a sample only touches that sample's row, the combined
+# aggregated_workflows.json is streamed out of the table on request.
+
+class CohortStore:
+
+    def __init__(self, path:str) -> None:
+        self.path = path
+        with self.connect() as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS workflows (
+                    sample TEXT PRIMARY KEY,
+                    document TEXT NOT NULL
+                )''')
+
+    def connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=60)
+
+    def put(self, sample:str, aggregate_file:str) -> None:
+        with open_stored(aggregate_file) as file:
+            document = json.dumps(json.load(file))
+        with self.connect() as conn:
+            # upsert keeps the rowid, so samples keep their position in the export
+            conn.execute('''
+                INSERT INTO workflows (sample, document) VALUES (?, ?)
+                ON CONFLICT(sample) DO UPDATE SET document = excluded.document
+                ''', (sample, document))
+
+    def remove(self, sample:str) -> None:
+        with self.connect() as conn:
+            conn.execute('DELETE FROM workflows WHERE sample = ?', (sample,))
+
+    def get(self, sample:str) -> dict:
+        with self.connect() as conn:
+            row = conn.execute('SELECT document FROM workflows WHERE sample = ?',
+                               (sample,)).fetchone()
+        if row is None:
+            raise KeyError(sample)
+        return json.loads(row[0])
+
+    def samples(self) -> List[str]:
+        with self.connect() as conn:
+            rows = conn.execute('SELECT sample FROM workflows ORDER BY rowid').fetchall()
+        return [row[0] for row in rows]
+
+    def export(self, output_file:str) -> None:
+        with self.connect() as conn, open(output_file, 'w') as output:
+            output.write('[')
+            rows = conn.execute('SELECT document FROM workflows ORDER BY rowid')
+            for i, (document,) in enumerate(rows):
+                if i > 0:
+                    output.write(', ')
+                output.write(document)
+            output.write(']')
@@ -1,16 +1,22 @@
 
 
+import importlib
 import os
 import shutil
+import sys
 from datetime import datetime
 from typing import List
 
+from parsl.app.futures import DataFuture
 from parsl.data_provider.files import File
 
 ROOT = os.getcwd()
 DATA_DIR = os.path.join(ROOT, 'example_data')
 PARSL_DIR = os.path.join(ROOT, 'parsl')
 
+CLUSTER_TRANSFORM_CODE_DIR = os.path.join(ROOT, 'cluster_transform', 'code')
+AGGREGATE_JSON_CODE_DIR = os.path.join(ROOT, 'aggregate_json', 'code')
+
 LOGS_DIR = os.path.join(PARSL_DIR, 'logs')
 RUNS_DIR = os.path.join(PARSL_DIR, 'runs')
 
@@ -35,7 +41,19 @@ def get_stdfiles(outdir:str):
     stderr = f'{outdir}/stderr.txt'
     return stdout, stderr
 
+def import_stage_module(code_dir:str, module:str):
+    if code_dir not in sys.path:
+        sys.path.insert(0, code_dir)
+    return importlib.import_module(module)
+
 def format_files(dir:str, files:List[str]):
     files = [os.path.join(dir, file) for file in files]
     files = [File(f) for f in files]
-    return files
\ No newline at end of file
+    return files
+
+def store_path(file) -> str:
+    # a staged file's filepath is its node-local scratch copy, 
+    # path is where it lives in the run directory
+    if isinstance(file, DataFuture):
+        file = file.file_obj
+    return file.path
\ No newline at end of file
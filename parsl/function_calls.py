@@ -1,67 +1,86 @@
 
+import os
+from pathlib import Path
 
 from appfuture_manager import AppFutureManager
 from filesystem_util import ROOT, generate_subdir
+from storage_policy import StoragePolicy
+from task_planner import stage_key
 from workflow_tasks import *
 
 # --------------------- Function Calling ---------------------
 
-def fcall_execute(run_function, inputs):
+def fcall_execute(run_function, inputs, **kwargs):
+    key = stage_key(run_function, inputs, {**kwargs, **stage_switches()})
+    future_id = AppFutureManager.lookup_stage(key)
+    if future_id is not None:
+        return future_id
     future_id = AppFutureManager.new_future_id(run_function)
     future_dir = generate_subdir(AppFutureManager.DIR, future_id)
-    future = run_function(inputs, future_dir)
+    future = run_function(inputs, future_dir, **kwargs)
     print(future)
     AppFutureManager.index(future_id, future)
+    AppFutureManager.index_stage(key, future_id)
     return future_id
 
-def fcall_from_files(run_function, inputs:list[str]):
+def fcall_from_files(run_function, inputs:list[str], **kwargs):
     inputs = format_files(ROOT, inputs)
-    return fcall_execute(run_function, inputs)
+    return fcall_execute(run_function, inputs, **kwargs)
 
 
 # --------------------- VCF Transform ---------------------
 
-def fcall_vcf_transform_from_files(vep_vcf:str):
+def fcall_vcf_transform_from_files(vep_vcf:str, outputs:list[str]=None,
+                                   regions:str=None, samples:str=None):
     inputs = [vep_vcf]
-    return fcall_from_files(run_vcf_transform, inputs)
+    return fcall_from_files(run_vcf_transform, inputs, outputs=outputs,
+                            regions=regions, samples=samples)
 
 
 # --------------------- Pyclone Vi Clustering ---------------------
 
-def fcall_pyclone_vi_from_files(pyclone_vi_formatted:str):
+def fcall_pyclone_vi_from_files(pyclone_vi_formatted:str, restart_tasks:int=None):
     inputs = [pyclone_vi_formatted]
-    return fcall_from_files(run_pyclone_vi, inputs)
+    return fcall_from_files(run_pyclone_vi, inputs, restart_tasks=restart_tasks)
 
-def fcall_pyclone_vi_from_futures(vcf_future_id:str):
+def fcall_pyclone_vi_from_futures(vcf_future_id:str, restart_tasks:int=None):
     vcf_future = AppFutureManager.query(vcf_future_id)
     inputs = get_inputs_pyclone_vi(vcf_future)
-    return fcall_execute(run_pyclone_vi, inputs)
+    return fcall_execute(run_pyclone_vi, inputs, restart_tasks=restart_tasks)
 
 
 # --------------------- Cluster Transform ---------------------
 
-def fcall_cluster_transform_from_files(pyclone_vi_formatted:str, cluster_assignment:str):
+def fcall_cluster_transform_from_files(pyclone_vi_formatted:str, cluster_assignment:str,
+                                       pruning:dict=None):
     inputs = [pyclone_vi_formatted, 
               cluster_assignment]
-    return fcall_from_files(run_cluster_transform, inputs)
+    return fcall_from_files(run_cluster_transform, inputs, pruning=pruning)
 
-def fcall_cluster_transform_from_futures(vcf_future_id:str, pyclone_future_id:str):
+def fcall_cluster_transform_from_futures(vcf_future_id:str, pyclone_future_id:str,
+                                         pruning:dict=None):
     vcf_future = AppFutureManager.query(vcf_future_id)
     pyclone_future = AppFutureManager.query(pyclone_future_id)
     inputs = get_inputs_cluster_transform(vcf_future, pyclone_future)
-    return fcall_execute(run_cluster_transform, inputs)
+    return fcall_execute(run_cluster_transform, inputs, pruning=pruning)
+
+def fcall_cluster_transform_sweep_from_files(pyclone_vi_formatted:str, cluster_assignment:str,
+                                             alphas:list[float]):
+    inputs = [pyclone_vi_formatted, 
+              cluster_assignment]
+    return fcall_from_files(run_cluster_transform_sweep, inputs, alphas=alphas)
 
 
 # --------------------- Spruce Tree ---------------------
 
-def fcall_spruce_tree_from_files(spruce_formatted:str):
+def fcall_spruce_tree_from_files(spruce_formatted:str, time_limit:int=None, max_trees:int=None):
     inputs = [spruce_formatted]
-    return fcall_from_files(run_spruce_tree, inputs)
+    return fcall_from_files(run_spruce_tree, inputs, time_limit=time_limit, max_trees=max_trees)
 
-def fcall_spruce_tree_from_futures(cluster_future_id:str):
+def fcall_spruce_tree_from_futures(cluster_future_id:str, time_limit:int=None, max_trees:int=None):
     cluster_future = AppFutureManager.query(cluster_future_id)
     inputs = get_inputs_spruce_tree(cluster_future)
-    return fcall_execute(run_spruce_tree, inputs)
+    return fcall_execute(run_spruce_tree, inputs, time_limit=time_limit, max_trees=max_trees)
 
 
 # --------------------- Aggregate JSON ---------------------
@@ -75,47 +94,249 @@ def fcall_aggregate_json_from_files(vep_vcf:str, cluster_assignment:str,
     return fcall_from_files(run_aggregate_json, inputs)
 
 def fcall_aggregate_json_from_futures(vep_vcf:str, pyclone_future_id:AppFuture, 
-                                      spruce_future_id:AppFuture):
+                                      spruce_future_id:AppFuture,
+                                      regions:str=None, samples:str=None,
+                                      vcf_future_id:str=None, cluster_future_id:str=None,
+                                      top_k:int=None):
     pyclone_future = AppFutureManager.query(pyclone_future_id)
     spruce_future = AppFutureManager.query(spruce_future_id)
-    inputs = get_inputs_aggregate_json(vep_vcf, pyclone_future, spruce_future)
-    return fcall_execute(run_aggregate_json, inputs)
+    vcf_future = AppFutureManager.query(vcf_future_id) if vcf_future_id else None
+    cluster_future = AppFutureManager.query(cluster_future_id) if cluster_future_id else None
+    inputs = get_inputs_aggregate_json(vep_vcf, pyclone_future, spruce_future, vcf_future,
+                                       cluster_future)
+    return fcall_execute(run_aggregate_json, inputs, regions=regions, samples=samples, top_k=top_k)
 
 
 # --------------------- Full Workflow ---------------------
 
-def fcall_full_workflow(vep_vcf:str):    
+def fcall_full_workflow(vep_vcf:str, fused:bool=False, 
+                        regions:str=None, samples:str=None, pruning:dict=None,
+                        spruce_budget:dict=None):
+    # spruce_budget: time_limit and max_trees of SPRUCE, top_k trees aggregated
+    spruce_budget = spruce_budget or {}
+    if fused:
+        return fcall_fused_workflow(vep_vcf, regions=regions, samples=samples, pruning=pruning,
+                                    spruce_budget=spruce_budget)
     vcf_future_id = fcall_vcf_transform_from_files(
-        vep_vcf=vep_vcf
+        vep_vcf=vep_vcf,
+        regions=regions,
+        samples=samples
     )
     pyclone_future_id = fcall_pyclone_vi_from_futures(
         vcf_future_id=vcf_future_id
     )
     cluster_future_id = fcall_cluster_transform_from_futures(
         vcf_future_id=vcf_future_id,
-        pyclone_future_id=pyclone_future_id
+        pyclone_future_id=pyclone_future_id,
+        pruning=pruning
     )
     spruce_future_id = fcall_spruce_tree_from_futures(
-        cluster_future_id=cluster_future_id
+        cluster_future_id=cluster_future_id,
+        time_limit=spruce_budget.get('time_limit'),
+        max_trees=spruce_budget.get('max_trees')
     )
     aggregate_future_id = fcall_aggregate_json_from_futures(
         vep_vcf=vep_vcf,
         pyclone_future_id=pyclone_future_id,
-        spruce_future_id=spruce_future_id
+        spruce_future_id=spruce_future_id,
+        regions=regions,
+        samples=samples,
+        vcf_future_id=vcf_future_id,
+        cluster_future_id=cluster_future_id,
+        top_k=spruce_budget.get('top_k')
     )
     return aggregate_future_id
 
 
+# --------------------- Fused Workflow ---------------------
+
+def fcall_fused_workflow(vep_vcf:str, regions:str=None, samples:str=None, pruning:dict=None,
+                         spruce_budget:dict=None):
+    spruce_budget = spruce_budget or {}
+    vcf_future_id = fcall_vcf_transform_from_files(
+        vep_vcf=vep_vcf,
+        regions=regions,
+        samples=samples
+    )
+    pyclone_future_id = fcall_pyclone_vi_from_futures(
+        vcf_future_id=vcf_future_id
+    )
+    vcf_future = AppFutureManager.query(vcf_future_id)
+    pyclone_future = AppFutureManager.query(pyclone_future_id)
+    inputs = get_inputs_cluster_transform(vcf_future, pyclone_future)
+    cluster_future_id = fcall_execute(run_cluster_transform_fused, inputs, pruning=pruning)
+
+    spruce_future_id = fcall_spruce_tree_from_futures(
+        cluster_future_id=cluster_future_id,
+        time_limit=spruce_budget.get('time_limit'),
+        max_trees=spruce_budget.get('max_trees')
+    )
+    cluster_future = AppFutureManager.query(cluster_future_id)
+    spruce_future = AppFutureManager.query(spruce_future_id)
+    inputs = get_inputs_aggregate_json_fused(vep_vcf, spruce_future, vcf_future, cluster_future)
+    return fcall_execute(run_aggregate_json_fused, inputs, 
+                         cluster_future=cluster_future,
+                         regions=regions, samples=samples,
+                         top_k=spruce_budget.get('top_k'))
+
+
 # --------------------- Parallel Workflows ---------------------
 
-def fcall_parallel_workflows(vep_vcf_files:list[str]):
+def fcall_parallel_workflows(vep_vcf_files:list[str], fused:bool=False, batched:bool=False,
+                             by_patient:bool=False, sample_sheet:str=None,
+                             patient_pattern:str=None):
+    if by_patient or sample_sheet or patient_pattern:
+        return fcall_patient_workflows(vep_vcf_files, sample_sheet=sample_sheet,
+                                       patient_pattern=patient_pattern, fused=fused)
+    if batched:
+        return fcall_batched_workflows(vep_vcf_files, fused=fused)
     future_ids = []
     for vep_vcf in vep_vcf_files:
         future_id = fcall_full_workflow(
-            vep_vcf=vep_vcf
+            vep_vcf=vep_vcf,
+            fused=fused
+        )
+        future_ids.append(future_id)
+
+    futures = [AppFutureManager.query(id) for id in future_ids]
+    inputs = get_inputs_aggregate_workflows(futures)
+    return fcall_execute(run_aggregate_workflows, inputs)
+
+
+# --------------------- Batched Workflows ---------------------
+
+def fcall_batched_workflows(vep_vcf_files:list[str], fused:bool=False):
+    # small samples share their cluster_transform and aggregate_json tasks,
+    # large ones keep a workflow of their own
+    batches, large = group_samples(vep_vcf_files)
+    future_ids = []
+    for vep_vcf in large:
+        future_id = fcall_full_workflow(
+            vep_vcf=vep_vcf,
+            fused=fused
         )
         future_ids.append(future_id)
+    for batch in batches:
+        future_ids.append(fcall_batch_workflow(batch))
 
     futures = [AppFutureManager.query(id) for id in future_ids]
     inputs = get_inputs_aggregate_workflows(futures)
     return fcall_execute(run_aggregate_workflows, inputs)
+
+def fcall_batch_workflow(vep_vcf_files:list[str]):
+    vcf_future_ids = [fcall_vcf_transform_from_files(vep_vcf=vep_vcf) 
+                      for vep_vcf in vep_vcf_files]
+    pyclone_future_ids = [fcall_pyclone_vi_from_futures(vcf_future_id=vcf_future_id) 
+                          for vcf_future_id in vcf_future_ids]
+    vcf_futures = [AppFutureManager.query(id) for id in vcf_future_ids]
+    pyclone_futures = [AppFutureManager.query(id) for id in pyclone_future_ids]
+    inputs = get_inputs_cluster_transform_batch(vcf_futures, pyclone_futures)
+    cluster_future_id = fcall_execute(run_cluster_transform_batch, inputs)
+
+    cluster_future = AppFutureManager.query(cluster_future_id)
+    spruce_future_ids = [fcall_execute(run_spruce_tree, get_inputs_spruce_tree_batch(cluster_future, index))
+                         for index in range(len(vep_vcf_files))]
+    spruce_futures = [AppFutureManager.query(id) for id in spruce_future_ids]
+    vep_vcfs = format_files(ROOT, vep_vcf_files)
+    inputs = get_inputs_aggregate_json_batch(vep_vcfs, pyclone_futures, spruce_futures, vcf_futures)
+    return fcall_execute(run_aggregate_json_batch, inputs)
+
+
+# --------------------- Patient Workflows ---------------------
+
+def fcall_patient_workflows(vep_vcf_files:list[str], sample_sheet:str=None, 
+                            patient_pattern:str=None, fused:bool=False):
+    # one workflow per patient, see group_patients
+    groups = group_patients(vep_vcf_files, sample_sheet, patient_pattern)
+    future_ids = [fcall_patient_workflow(patient_vcf_files, fused=fused)
+                  for patient_vcf_files in groups.values()]
+    futures = [AppFutureManager.query(id) for id in future_ids]
+    inputs = get_inputs_aggregate_workflows(futures)
+    return fcall_execute(run_aggregate_workflows, inputs)
+
+def fcall_patient_workflow(vep_vcf_files:list[str], fused:bool=False,
+                           regions:str=None, samples:str=None, pruning:dict=None,
+                           spruce_budget:dict=None):
+    # the regions of one patient share their pyclone-vi fit and SPRUCE run
+    if len(vep_vcf_files) == 1:
+        return fcall_full_workflow(vep_vcf_files[0], fused=fused, regions=regions, samples=samples,
+                                   pruning=pruning, spruce_budget=spruce_budget)
+    spruce_budget = spruce_budget or {}
+    vcf_future_ids = [fcall_vcf_transform_from_files(vep_vcf=vep_vcf, regions=regions, samples=samples)
+                      for vep_vcf in vep_vcf_files]
+    vcf_futures = [AppFutureManager.query(id) for id in vcf_future_ids]
+    merge_future_id = fcall_execute(run_merge_patient, get_inputs_merge_patient(vcf_futures))
+    pyclone_future_id = fcall_pyclone_vi_from_futures(
+        vcf_future_id=merge_future_id
+    )
+    merge_future = AppFutureManager.query(merge_future_id)
+    pyclone_future = AppFutureManager.query(pyclone_future_id)
+    inputs = get_inputs_cluster_transform(merge_future, pyclone_future)
+    run_cluster = run_cluster_transform_fused if fused else run_cluster_transform
+    cluster_future_id = fcall_execute(run_cluster, inputs, pruning=pruning)
+
+    spruce_future_id = fcall_spruce_tree_from_futures(
+        cluster_future_id=cluster_future_id,
+        time_limit=spruce_budget.get('time_limit'),
+        max_trees=spruce_budget.get('max_trees')
+    )
+    cluster_future = AppFutureManager.query(cluster_future_id)
+    spruce_future = AppFutureManager.query(spruce_future_id)
+    if fused:
+        inputs = get_inputs_aggregate_json_patient_fused(vep_vcf_files, spruce_future,
+                                                         merge_future, cluster_future)
+        return fcall_execute(run_aggregate_json_fused, inputs, 
+                             cluster_future=cluster_future,
+                             regions=regions, samples=samples,
+                             top_k=spruce_budget.get('top_k'),
+                             vep_count=len(vep_vcf_files))
+    inputs = get_inputs_aggregate_json_patient(vep_vcf_files, pyclone_future, spruce_future,
+                                               merge_future, cluster_future)
+    return fcall_execute(run_aggregate_json, inputs, regions=regions, samples=samples,
+                         top_k=spruce_budget.get('top_k'), vep_count=len(vep_vcf_files))
+
+
+# --------------------- Cohort Store ---------------------
+
+def fcall_update_cohort(vep_vcf_files:list[str], cohort_store:str, fused:bool=False):
+    store_path = os.path.join(ROOT, cohort_store)
+    future_ids = []
+    for vep_vcf in vep_vcf_files:
+        aggregate_future_id = fcall_full_workflow(
+            vep_vcf=vep_vcf,
+            fused=fused
+        )
+        aggregate_future = AppFutureManager.query(aggregate_future_id)
+        inputs = get_inputs_aggregate_workflows([aggregate_future])
+        future_id = fcall_execute(run_store_workflow, inputs, store_path=store_path,
+                                  sample=Path(vep_vcf).stem)
+        future_ids.append(future_id)
+    return future_ids
+
+def fcall_export_cohort(cohort_store:str):
+    store_path = os.path.join(ROOT, cohort_store)
+    return fcall_execute(run_export_cohort, [], store_path=store_path)
+
+
+# --------------------- Storage Policy ---------------------
+
+def fcall_compact_run(compress:str='gzip', level:int=None, 
+                      dedupe:bool=True, drop_unused:bool=True):
+    policy = StoragePolicy(compress=compress, level=level, dedupe=dedupe)
+    if not drop_unused:
+        policy.drop = []
+    inputs = list(AppFutureManager.appfuture_map.values())
+    # outputs of the compacted run are no longer shared with new submissions
+    future_id = fcall_execute(run_storage_policy, inputs, 
+                              run_dir=AppFutureManager.DIR, policy=policy)
+    AppFutureManager.forget_stages()
+    return future_id
+
+
+# --------------------- Profiling ---------------------
+
+def fcall_profile_report():
+    # merges the profiles of every stage of the current run directory
+    # into profile.pstats and profile.collapsed
+    inputs = list(AppFutureManager.appfuture_map.values())
+    return fcall_execute(run_profile_report, inputs, run_dir=AppFutureManager.DIR)
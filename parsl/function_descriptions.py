@@ -1,4 +1,52 @@
 
+regions_property = {
+    'type': 'string',
+    'description': 'Optional BED file or comma separated contig[:start-end] list to restrict the analysis to'
+}
+
+samples_property = {
+    'type': 'string',
+    'description': 'Optional file or comma separated list of tumor samples to restrict the analysis to'
+}
+
+pruning_property = {
+    'type': 'object',
+    'description': 'Optional pruning of the clusters before SPRUCE, to bound its running time',
+    'properties': {
+        'max_clusters': {
+            'type': 'integer',
+            'description': 'Merge the smallest clusters until at most this many are left'
+        },
+        'min_cluster_size': {
+            'type': 'integer',
+            'description': 'Merge clusters with fewer mutations into their closest cluster'
+        },
+        'min_assignment_prob': {
+            'type': 'number',
+            'description': 'Drop mutations assigned to their cluster with a lower probability'
+        },
+    }
+}
+
+spruce_budget_property = {
+    'type': 'object',
+    'description': 'Optional budget of SPRUCE, for a result within a fixed time on hard samples',
+    'properties': {
+        'time_limit': {
+            'type': 'integer',
+            'description': 'Seconds SPRUCE enumerates trees for before keeping those found so far'
+        },
+        'max_trees': {
+            'type': 'integer',
+            'description': 'Maximum number of trees SPRUCE enumerates'
+        },
+        'top_k': {
+            'type': 'integer',
+            'description': 'Number of trees aggregated in the JSON'
+        },
+    }
+}
+
 functions = [
     {
         'name': 'fcall_vcf_transform_from_files',
@@ -10,8 +58,20 @@ functions = [
                     'type': 'string',
                     'description': 'The path to the vcf_file'
                 },
+                'outputs': {
+                    'type': 'array',
+                    'items': {
+                        'type': 'string',
+                        'enum': ['headers.json', 'mutations.json',
+                                 'pyclone_vi_formatted.tsv', 'pyclone_samples',
+                                 'variant_index.tsv']
+                    },
+                    'description': 'Outputs to write, pyclone_vi_formatted.tsv and variant_index.tsv by default'
+                },
+                'regions': regions_property,
+                'samples': samples_property,
             },
-            'required': ['vcf_file']
+            'required': ['vep_vcf']
         }
     },
     {
@@ -24,6 +84,10 @@ functions = [
                     'type': 'string',
                     'description': 'The path to the pyclone_vi_formatted file outputed by the vcf_transform'
                 },
+                'restart_tasks': {
+                    'type': 'integer',
+                    'description': 'Number of parallel pyclone-vi fits with different seeds'
+                },
             },
             'required': ['pyclone_vi_formatted']
         }
@@ -38,8 +102,309 @@ functions = [
                     'type': 'string',
                     'description': 'The vcf_transform id'
                 },
+                'restart_tasks': {
+                    'type': 'integer',
+                    'description': 'Number of parallel pyclone-vi fits with different seeds'
+                },
             },
             'required': ['vcf_future_id']
         }
+    },
+    {
+        'name': 'fcall_cluster_transform_from_files',
+        'description': 'Summarizes pyclone_vi clusters into the input format of SPRUCE (tree inference)',
+        'parameters': {
+            'type': 'object',
+            'properties': {
+                'pyclone_vi_formatted': {
+                    'type': 'string',
+                    'description': 'The path to the pyclone_vi_formatted file outputed by the vcf_transform'
+                },
+                'cluster_assignment': {
+                    'type': 'string',
+                    'description': 'The path to the cluster_assignment file outputed by pyclone_vi'
+                },
+                'pruning': pruning_property,
+            },
+            'required': ['pyclone_vi_formatted', 'cluster_assignment']
+        }
+    },
+    {
+        'name': 'fcall_cluster_transform_from_futures',
+        'description': 'Summarizes pyclone_vi clusters from vcf_transform and pyclone_vi AppFuture ids',
+        'parameters': {
+            'type': 'object',
+            'properties': {
+                'vcf_future_id': {
+                    'type': 'string',
+                    'description': 'The vcf_transform id'
+                },
+                'pyclone_future_id': {
+                    'type': 'string',
+                    'description': 'The pyclone_vi id'
+                },
+                'pruning': pruning_property,
+            },
+            'required': ['vcf_future_id', 'pyclone_future_id']
+        }
+    },
+    {
+        'name': 'fcall_cluster_transform_sweep_from_files',
+        'description': 'Summarizes pyclone_vi clusters for several confidence levels in one task',
+        'parameters': {
+            'type': 'object',
+            'properties': {
+                'pyclone_vi_formatted': {
+                    'type': 'string',
+                    'description': 'The path to the pyclone_vi_formatted file outputed by the vcf_transform'
+                },
+                'cluster_assignment': {
+                    'type': 'string',
+                    'description': 'The path to the cluster_assignment file outputed by pyclone_vi'
+                },
+                'alphas': {
+                    'type': 'array',
+                    'items': {'type': 'number'},
+                    'description': 'Significance levels of the cluster VAF confidence intervals'
+                },
+            },
+            'required': ['pyclone_vi_formatted', 'cluster_assignment', 'alphas']
+        }
+    },
+    {
+        'name': 'fcall_spruce_tree_from_files',
+        'description': 'Infers phylogenetic trees with SPRUCE from a cluster_transform file',
+        'parameters': {
+            'type': 'object',
+            'properties': {
+                'spruce_formatted': {
+                    'type': 'string',
+                    'description': 'The path to the spruce_formatted file outputed by cluster_transform'
+                },
+                'time_limit': {
+                    'type': 'integer',
+                    'description': 'Optional seconds to enumerate trees for, the result may be truncated'
+                },
+                'max_trees': {
+                    'type': 'integer',
+                    'description': 'Optional maximum number of trees to enumerate'
+                },
+            },
+            'required': ['spruce_formatted']
+        }
+    },
+    {
+        'name': 'fcall_spruce_tree_from_futures',
+        'description': 'Infers phylogenetic trees with SPRUCE from a cluster_transform AppFuture id',
+        'parameters': {
+            'type': 'object',
+            'properties': {
+                'cluster_future_id': {
+                    'type': 'string',
+                    'description': 'The cluster_transform id'
+                },
+                'time_limit': {
+                    'type': 'integer',
+                    'description': 'Optional seconds to enumerate trees for, the result may be truncated'
+                },
+                'max_trees': {
+                    'type': 'integer',
+                    'description': 'Optional maximum number of trees to enumerate'
+                },
+            },
+            'required': ['cluster_future_id']
+        }
+    },
+    {
+        'name': 'fcall_aggregate_json_from_files',
+        'description': 'Aggregates variants, clusters and trees into one JSON file for visualization',
+        'parameters': {
+            'type': 'object',
+            'properties': {
+                'vep_vcf': {
+                    'type': 'string',
+                    'description': 'The path to the VEP annotated vcf_file'
+                },
+                'cluster_assignment': {
+                    'type': 'string',
+                    'description': 'The path to the cluster_assignment file outputed by pyclone_vi'
+                },
+                'spruce_json': {
+                    'type': 'string',
+                    'description': 'The path to the spruce.res.json file outputed by SPRUCE'
+                },
+                'spruce_gz': {
+                    'type': 'string',
+                    'description': 'The path to the spruce.res.gz file outputed by SPRUCE'
+                },
+            },
+            'required': ['vep_vcf', 'cluster_assignment', 'spruce_json', 'spruce_gz']
+        }
+    },
+    {
+        'name': 'fcall_aggregate_json_from_futures',
+        'description': 'Aggregates variants, clusters and trees from pyclone_vi and SPRUCE AppFuture ids',
+        'parameters': {
+            'type': 'object',
+            'properties': {
+                'vep_vcf': {
+                    'type': 'string',
+                    'description': 'The path to the VEP annotated vcf_file'
+                },
+                'pyclone_future_id': {
+                    'type': 'string',
+                    'description': 'The pyclone_vi id'
+                },
+                'spruce_future_id': {
+                    'type': 'string',
+                    'description': 'The spruce_tree id'
+                },
+                'vcf_future_id': {
+                    'type': 'string',
+                    'description': 'Optional vcf_transform id, its variant index speeds up the joins'
+                },
+                'cluster_future_id': {
+                    'type': 'string',
+                    'description': 'Optional cluster_transform id, needed when it pruned the clusters'
+                },
+                'top_k': {
+                    'type': 'integer',
+                    'description': 'Optional number of SPRUCE trees to aggregate'
+                },
+                'regions': regions_property,
+                'samples': samples_property,
+            },
+            'required': ['vep_vcf', 'pyclone_future_id', 'spruce_future_id']
+        }
+    },
+    {
+        'name': 'fcall_full_workflow',
+        'description': 'Runs the whole workflow, from the VEP annotated vcf_file to the aggregated JSON',
+        'parameters': {
+            'type': 'object',
+            'properties': {
+                'vep_vcf': {
+                    'type': 'string',
+                    'description': 'The path to the VEP annotated vcf_file'
+                },
+                'fused': {
+                    'type': 'boolean',
+                    'description': 'Run the light python stages inside the workflow process'
+                },
+                'regions': regions_property,
+                'samples': samples_property,
+                'pruning': pruning_property,
+                'spruce_budget': spruce_budget_property,
+            },
+            'required': ['vep_vcf']
+        }
+    },
+    {
+        'name': 'fcall_parallel_workflows',
+        'description': 'Runs the whole workflow for several vcf_files and combines their aggregated JSON',
+        'parameters': {
+            'type': 'object',
+            'properties': {
+                'vep_vcf_files': {
+                    'type': 'array',
+                    'items': {'type': 'string'},
+                    'description': 'The paths to the VEP annotated vcf_files'
+                },
+                'fused': {
+                    'type': 'boolean',
+                    'description': 'Run the light python stages inside the workflow process'
+                },
+                'batched': {
+                    'type': 'boolean',
+                    'description': 'Run the light python stages of small samples together in batch tasks'
+                },
+                'by_patient': {
+                    'type': 'boolean',
+                    'description': 'Group the vcf_files of the regions of one patient into a single clustering and tree inference, needs sample_sheet or patient_pattern'
+                },
+                'sample_sheet': {
+                    'type': 'string',
+                    'description': 'Tab separated file with vcf and patient columns grouping the vcf_files by patient'
+                },
+                'patient_pattern': {
+                    'type': 'string',
+                    'description': 'Regular expression whose first group is the patient in the tumor_sample header of a vcf_file, e.g. ^(P\\d+)_'
+                },
+            },
+            'required': ['vep_vcf_files']
+        }
+    },
+    {
+        'name': 'fcall_update_cohort',
+        'description': 'Runs the whole workflow for several vcf_files and stores their results in a cohort store',
+        'parameters': {
+            'type': 'object',
+            'properties': {
+                'vep_vcf_files': {
+                    'type': 'array',
+                    'items': {'type': 'string'},
+                    'description': 'The paths to the VEP annotated vcf_files'
+                },
+                'cohort_store': {
+                    'type': 'string',
+                    'description': 'The path to the SQLite cohort store'
+                },
+                'fused': {
+                    'type': 'boolean',
+                    'description': 'Run the light python stages inside the workflow process'
+                },
+            },
+            'required': ['vep_vcf_files', 'cohort_store']
+        }
+    },
+    {
+        'name': 'fcall_export_cohort',
+        'description': 'Exports every sample of a cohort store into one aggregated JSON file',
+        'parameters': {
+            'type': 'object',
+            'properties': {
+                'cohort_store': {
+                    'type': 'string',
+                    'description': 'The path to the SQLite cohort store'
+                },
+            },
+            'required': ['cohort_store']
+        }
+    },
+    {
+        'name': 'fcall_compact_run',
+        'description': 'Drops unused outputs, compresses and deduplicates the current run directory',
+        'parameters': {
+            'type': 'object',
+            'properties': {
+                'compress': {
+                    'type': 'string',
+                    'enum': ['gzip', 'zstd'],
+                    'description': 'Compression codec'
+                },
+                'level': {
+                    'type': 'integer',
+                    'description': 'Compression level, the codec default if absent'
+                },
+                'dedupe': {
+                    'type': 'boolean',
+                    'description': 'Hardlink files identical across runs'
+                },
+                'drop_unused': {
+                    'type': 'boolean',
+                    'description': 'Remove outputs nothing downstream reads'
+                },
+            },
+            'required': []
+        }
+    },
+    {
+        'name': 'fcall_profile_report',
+        'description': 'Merges the stage profiles of the current run directory into pstats and collapsed stacks for a flamegraph',
+        'parameters': {
+            'type': 'object',
+            'properties': {},
+            'required': []
+        }
     }
 ]
@@ -0,0 +1,92 @@
+import inspect
+from typing import Callable, Dict, List
+
+# --------------------- Function Registry ---------------------
+
+# The functions the agent and the service may call, each with the JSON
+# schema of its parameters. Schemas are checked against the function
+# signatures when registered, and arguments against the schemas before
+# every call, so a malformed call fails before anything is submitted.
+
+class InvalidCall(ValueError):
+    pass
+
+
+JSON_TYPES = {
+    'string': (str,),
+    'integer': (int,),
+    'number': (int, float),
+    'boolean': (bool,),
+    'array': (list,),
+    'object': (dict,)
+}
+
+def validate(value, schema:dict, path:str) -> None:
+    expected = schema.get('type')
+    if expected is not None:
+        # bool is an int subclass, but JSON keeps them apart
+        if isinstance(value, bool) and expected in ('integer', 'number'):
+            raise InvalidCall(f'{path} should be of type {expected}')
+        if not isinstance(value, JSON_TYPES[expected]):
+            raise InvalidCall(f'{path} should be of type {expected}')
+    if 'enum' in schema and value not in schema['enum']:
+        raise InvalidCall(f'{path} should be one of {schema["enum"]}')
+    if expected == 'array' and 'items' in schema:
+        for i, item in enumerate(value):
+            validate(item, schema['items'], f'{path}[{i}]')
+    if expected == 'object':
+        properties = schema.get('properties', {})
+        missing = [name for name in schema.get('required', []) if name not in value]
+        if missing:
+            raise InvalidCall(f'{path} is missing {missing}')
+        unknown = [name for name in value if name not in properties]
+        if unknown:
+            raise InvalidCall(f'{path} has unknown arguments {unknown}')
+        for name, item in value.items():
+            validate(item, properties[name], f'{path}.{name}')
+
+
+class FunctionRegistry:
+
+    def __init__(self) -> None:
+        self.functions = {}
+        self.descriptions = {}
+
+    def register(self, function:Callable, description:dict) -> None:
+        name = description['name']
+        parameters = inspect.signature(function).parameters
+        properties = description['parameters'].get('properties', {})
+        required = description['parameters'].get('required', [])
+        unknown = [prop for prop in list(properties) + required if prop not in parameters]
+        if unknown:
+            raise ValueError(f'{name} has no parameters {sorted(set(unknown))}')
+        for parameter in parameters.values():
+            no_default = parameter.default is inspect.Parameter.empty
+            if no_default and parameter.name not in required:
+                raise ValueError(f'{name} requires {parameter.name} but its schema does not')
+        self.functions[name] = function
+        self.descriptions[name] = description
+
+    def register_all(self, descriptions:List[dict], namespace:Dict[str, Callable]) -> None:
+        for description in descriptions:
+            self.register(namespace[description['name']], description)
+
+    def schemas(self) -> List[dict]:
+        return list(self.descriptions.values())
+
+    def check(self, name:str, arguments:dict) -> None:
+        if name not in self.functions:
+            raise InvalidCall(f'Unknown function {name}')
+        validate(arguments, self.descriptions[name]['parameters'], name)
+
+    def call(self, name:str, arguments:dict):
+        self.check(name, arguments)
+        return self.functions[name](**arguments)
+
+
+def default_registry() -> FunctionRegistry:
+    import function_calls
+    from function_descriptions import functions
+    registry = FunctionRegistry()
+    registry.register_all(functions, vars(function_calls))
+    return registry
@@ -0,0 +1,221 @@
+import argparse
+import fnmatch
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional
+
+from appfuture_manager import AppFutureManager
+from task_planner import file_digest
+
+import parsl
+
+# --------------------- Hot Folder Ingestion ---------------------
+
+# Watches a directory for new VEP vcf files and submits them as cohort runs.
+# A file is ready once its size and mtime stayed the same for stable_seconds,
+# or, with a sentinel suffix, once '<file><suffix>' exists. Ready files are
+# submitted batch_size at a time, a smaller batch goes out when its oldest
+# file waited max_wait_seconds, so a file is submitted at most
+# stable_seconds + max_wait_seconds + poll_seconds after it was written.
+# The ledger keeps the sha256 of every submitted file, a file with the same
+# content is never run twice, whatever its name. Failed runs stay in the
+# ledger with their status, delete their row to have them ingested again.
+
+@dataclass
+class IngestPolicy:
+    patterns: List[str] = field(default_factory=lambda: ['*.vcf', '*.vcf.gz'])
+    stable_seconds: float = 30          # unchanged size and mtime before a file is ready
+    sentinel_suffix: Optional[str] = None   # e.g. '.done', replaces the stability check
+    batch_size: int = 16                # files per cohort run
+    max_wait_seconds: float = 600       # oldest ready file waits at most this long
+    poll_seconds: float = 5
+
+
+class IngestLedger:
+
+    def __init__(self, path:str) -> None:
+        self.path = path
+        self.lock = threading.Lock()
+        with self.connect() as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS ingested (
+                    digest TEXT PRIMARY KEY,
+                    path TEXT NOT NULL,
+                    batch INTEGER NOT NULL,
+                    submitted_at REAL NOT NULL,
+                    future_ids TEXT NOT NULL,
+                    status TEXT NOT NULL
+                )''')
+
+    def connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=60)
+
+    def contains(self, digest:str) -> bool:
+        with self.lock, self.connect() as conn:
+            row = conn.execute('SELECT 1 FROM ingested WHERE digest = ?', (digest,)).fetchone()
+        return row is not None
+
+    def next_batch(self) -> int:
+        with self.lock, self.connect() as conn:
+            row = conn.execute('SELECT MAX(batch) FROM ingested').fetchone()
+        return 0 if row[0] is None else row[0] + 1
+
+    def record(self, digest:str, path:str, batch:int, future_ids:List[str]) -> None:
+        with self.lock, self.connect() as conn:
+            conn.execute('''
+                INSERT INTO ingested (digest, path, batch, submitted_at, future_ids, status)
+                VALUES (?, ?, ?, ?, ?, 'submitted')
+                ''', (digest, path, batch, time.time(), ' '.join(future_ids)))
+
+    def set_status(self, digest:str, status:str) -> None:
+        with self.lock, self.connect() as conn:
+            conn.execute('UPDATE ingested SET status = ? WHERE digest = ?', (status, digest))
+
+    def rows(self) -> List[Dict]:
+        with self.lock, self.connect() as conn:
+            rows = conn.execute('''
+                SELECT digest, path, batch, submitted_at, future_ids, status
+                FROM ingested ORDER BY rowid''').fetchall()
+        columns = ['digest', 'path', 'batch', 'submitted_at', 'future_ids', 'status']
+        return [dict(zip(columns, row)) for row in rows]
+
+
+class HotFolder:
+
+    def __init__(self, watch_dir:str, ledger:IngestLedger,
+                 submit:Callable[[List[str]], List[str]], policy:IngestPolicy=None) -> None:
+        # submit(vcf files) starts a cohort run and returns one future id per file
+        self.watch_dir = watch_dir
+        self.ledger = ledger
+        self.submit = submit
+        self.policy = policy or IngestPolicy()
+        self.observed = {}      # path -> (size, mtime_ns, unchanged since)
+        self.pending = []       # (ready at, path, digest)
+        self.updates = []       # futures of the ledger status updates, set once written
+        self.stop_event = threading.Event()
+
+    def candidates(self) -> List[str]:
+        names = sorted(os.listdir(self.watch_dir))
+        return [os.path.join(self.watch_dir, name) for name in names
+                if any(fnmatch.fnmatch(name, pattern) for pattern in self.policy.patterns)]
+
+    def is_ready(self, path:str, now:float) -> bool:
+        if self.policy.sentinel_suffix:
+            return os.path.exists(path + self.policy.sentinel_suffix)
+        stat = os.stat(path)
+        size, mtime_ns, since = self.observed.get(path, (None, None, now))
+        if (size, mtime_ns) != (stat.st_size, stat.st_mtime_ns):
+            since = now
+        self.observed[path] = (stat.st_size, stat.st_mtime_ns, since)
+        return now - since >= self.policy.stable_seconds
+
+    def scan(self, now:float) -> None:
+        pending_paths = {path for _, path, _ in self.pending}
+        for path in self.candidates():
+            if path in pending_paths or not os.path.exists(path):
+                continue
+            if not self.is_ready(path, now):
+                continue
+            self.observed.pop(path, None)
+            digest = file_digest(path)
+            if self.ledger.contains(digest) or digest in {d for _, _, d in self.pending}:
+                continue
+            self.pending.append((now, path, digest))
+            pending_paths.add(path)
+
+    def poll(self, now:float=None) -> List[List[str]]:
+        # returns the batches submitted by this poll
+        now = time.time() if now is None else now
+        self.scan(now)
+        submitted = []
+        while len(self.pending) >= self.policy.batch_size:
+            submitted.append(self.submit_batch(self.pending[:self.policy.batch_size]))
+            self.pending = self.pending[self.policy.batch_size:]
+        if self.pending and now - self.pending[0][0] >= self.policy.max_wait_seconds:
+            submitted.append(self.submit_batch(self.pending))
+            self.pending = []
+        return submitted
+
+    def submit_batch(self, entries:list) -> List[str]:
+        paths = [path for _, path, _ in entries]
+        future_ids = self.submit(paths)
+        batch = self.ledger.next_batch()
+        for (_, path, digest), future_id in zip(entries, future_ids):
+            self.ledger.record(digest, path, batch, [future_id])
+            self.watch(digest, future_id)
+        print(f'Ingested batch {batch}: {len(paths)} files')
+        return paths
+
+    def watch(self, digest:str, future_id:str) -> None:
+        future = AppFutureManager.query(future_id)
+        recorded = Future()
+        def update(future):
+            failed = future.cancelled() or future.exception() is not None
+            status = 'failed' if failed else 'done'
+            self.ledger.set_status(digest, status)
+            recorded.set_result(status)
+        self.updates.append(recorded)
+        future.add_done_callback(update)
+
+    def wait(self) -> List[str]:
+        # statuses of the files submitted so far, once the ledger has them
+        return [recorded.result() for recorded in self.updates]
+
+    def run(self) -> None:
+        while not self.stop_event.is_set():
+            self.poll()
+            self.stop_event.wait(self.policy.poll_seconds)
+
+    def start(self) -> threading.Thread:
+        thread = threading.Thread(target=self.run, daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self) -> None:
+        self.stop_event.set()
+
+
+def cohort_submitter(cohort_store:str, fused:bool=False) -> Callable[[List[str]], List[str]]:
+    from function_calls import fcall_update_cohort
+    def submit(vep_vcf_files:List[str]) -> List[str]:
+        return fcall_update_cohort(vep_vcf_files=vep_vcf_files, cohort_store=cohort_store,
+                                   fused=fused)
+    return submit
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser('Phyloflow hot folder ingestion')
+    parser.add_argument('watch_dir', help='directory the vcf files are dropped in')
+    parser.add_argument('--cohort-store', default='cohort.sqlite',
+                        help='SQLite cohort store the results are added to')
+    parser.add_argument('--ledger', default=None,
+                        help='SQLite ledger of the ingested files, in the watched directory by default')
+    parser.add_argument('--stable-seconds', type=float, default=30)
+    parser.add_argument('--sentinel-suffix', default=None,
+                        help='wait for <file><suffix> instead of a stable size')
+    parser.add_argument('--batch-size', type=int, default=16)
+    parser.add_argument('--max-wait-seconds', type=float, default=600)
+    parser.add_argument('--poll-seconds', type=float, default=5)
+    parser.add_argument('--fused', action='store_true',
+                        help='run the light python stages inside the workflow process')
+    args = parser.parse_args()
+
+    from main import load_config
+    load_config()
+    AppFutureManager.new_dir()
+
+    policy = IngestPolicy(stable_seconds=args.stable_seconds, sentinel_suffix=args.sentinel_suffix,
+                          batch_size=args.batch_size, max_wait_seconds=args.max_wait_seconds,
+                          poll_seconds=args.poll_seconds)
+    ledger = IngestLedger(args.ledger or os.path.join(args.watch_dir, '.ingested.sqlite'))
+    folder = HotFolder(args.watch_dir, ledger, cohort_submitter(args.cohort_store, args.fused), policy)
+    print(f'Watching {args.watch_dir}')
+    try:
+        folder.run()
+    except KeyboardInterrupt:
+        folder.stop()
+        parsl.dfk().cleanup()
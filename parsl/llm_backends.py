@@ -0,0 +1,255 @@
+import copy
+import hashlib
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+from agent_plan import REFERENCE
+
+try:
+    import openai
+except ImportError:
+    openai = None
+
+# Include here your OpenAI API Key
+
+OPENAI_API_KEY = 'YOUR-API-KEY'
+
+# --------------------- LLM Backends ---------------------
+
+# A backend turns the conversation so far into the next chat completion
+# response, in the dict layout of the OpenAI ChatCompletion API. Responses
+# either hold one function_call or a list of tool_calls run together.
+
+class OpenAIBackend:
+
+    def __init__(self, model:str='gpt-3.5-turbo-0613', temperature:float=0,
+                 parallel_tools:bool=False) -> None:
+        if openai is None:
+            raise ImportError('The OpenAI backend needs the openai package')
+        openai.api_key = OPENAI_API_KEY
+        self.model = model
+        self.temperature = temperature
+        # tool calls need a model supporting them, e.g. gpt-3.5-turbo-1106
+        self.parallel_tools = parallel_tools
+
+    def complete(self, messages:List[dict], functions:List[dict]) -> dict:
+        if self.parallel_tools:
+            tools = [{'type': 'function', 'function': function} for function in functions]
+            response = openai.ChatCompletion.create(
+                model=self.model,
+                messages=messages,
+                tools=tools,
+                tool_choice='auto',
+                temperature=self.temperature
+            )
+        else:
+            response = openai.ChatCompletion.create(
+                model=self.model,
+                messages=messages,
+                functions=functions,
+                function_call='auto',
+                temperature=self.temperature
+            )
+        return response.to_dict_recursive()
+
+    def cache_key(self) -> str:
+        return f'openai:{self.model}:{self.temperature}:{self.parallel_tools}'
+
+
+# Deterministic stand-in for offline testing. It replays a script of
+# (function name, arguments) calls, where '$step<i>' in an argument is the
+# future id returned by the i-th call. In 'sequential' mode it sends one
+# call per response, in 'parallel' mode the calls as tool calls, each
+# response holding the next calls that only refer to earlier responses,
+# in 'plan' mode a single submit_plan call. Without a script it runs the
+# workflow on the first vcf path of the request.
+
+VCF_PATH = re.compile(r'\S+\.vcf(?:\.gz)?')
+FUTURE_ID = re.compile(r'AppFuture ids?: ([^\n]+)')
+
+def workflow_script(vep_vcf:str) -> List[Tuple[str, dict]]:
+    return [
+        ('fcall_vcf_transform_from_files', {'vep_vcf': vep_vcf}),
+        ('fcall_pyclone_vi_from_futures', {'vcf_future_id': '$step0'}),
+        ('fcall_cluster_transform_from_futures', {'vcf_future_id': '$step0',
+                                                  'pyclone_future_id': '$step1'}),
+        ('fcall_spruce_tree_from_futures', {'cluster_future_id': '$step2'}),
+        ('fcall_aggregate_json_from_futures', {'vep_vcf': vep_vcf,
+                                               'pyclone_future_id': '$step1',
+                                               'spruce_future_id': '$step3',
+                                               'vcf_future_id': '$step0'}),
+    ]
+
+class StubLLM:
+
+    def __init__(self, script:Optional[List[Tuple[str, dict]]]=None,
+                 mode:str='sequential') -> None:
+        if mode not in ('sequential', 'parallel', 'plan'):
+            raise ValueError(f'Unknown stub mode {mode}')
+        self.script = script
+        self.mode = mode
+
+    def complete(self, messages:List[dict], functions:List[dict]) -> dict:
+        calls = self.plan(messages)
+        done = sum(1 for message in messages
+                   if message.get('function_call') or message.get('tool_calls'))
+        if self.mode == 'plan':
+            if done > 0 or not calls:
+                return self.stop()
+            steps = [{'id': f'step{i}', 'function': name, 'arguments': arguments}
+                     for i, (name, arguments) in enumerate(calls)]
+            return self.tool_calls([('submit_plan', {'steps': steps})], 0)
+
+        future_ids = self.future_ids(messages)
+        if self.mode == 'parallel':
+            start = len(future_ids)
+            if start >= len(calls):
+                return self.stop()
+            wave = [(name, {key: self.resolve(value, future_ids) for key, value in arguments.items()})
+                    for name, arguments in calls[start:self.independent(calls, start)]]
+            return self.tool_calls(wave, start)
+
+        if done >= len(calls):
+            return self.stop()
+        name, arguments = calls[done]
+        arguments = {key: self.resolve(value, future_ids) for key, value in arguments.items()}
+        message = {
+            'role': 'assistant',
+            'content': None,
+            'function_call': {'name': name, 'arguments': json.dumps(arguments)}
+        }
+        return self.response('function_call', message)
+
+    def plan(self, messages:List[dict]) -> List[Tuple[str, dict]]:
+        if self.script is not None:
+            return self.script
+        # the first user message is the context, the second the request
+        requests = [message['content'] for message in messages if message['role'] == 'user']
+        match = VCF_PATH.search(requests[1]) if len(requests) > 1 else None
+        if match is None:
+            return []
+        if self.mode == 'sequential':
+            return [('fcall_full_workflow', {'vep_vcf': match.group(0)})]
+        return workflow_script(match.group(0))
+
+    def future_ids(self, messages:List[dict]) -> List[str]:
+        future_ids = []
+        for message in messages:
+            match = FUTURE_ID.search(message.get('content') or '')
+            if match and message['role'] in ('user', 'tool'):
+                future_ids.append(match.group(1).split()[0].strip("'"))
+        return future_ids
+
+    def independent(self, calls:List[Tuple[str, dict]], start:int) -> int:
+        # end of the calls from start on that only refer to calls before start
+        end = start
+        while end < len(calls):
+            steps = [REFERENCE.match(value).group(1) for value in calls[end][1].values()
+                     if isinstance(value, str) and REFERENCE.match(value)]
+            if any(int(step[len('step'):]) >= start for step in steps if step.startswith('step')):
+                break
+            end += 1
+        if end == start:
+            raise ValueError(f'Call {start} of the script refers to a later call')
+        return end
+
+    def tool_calls(self, calls:List[Tuple[str, dict]], start:int) -> dict:
+        tool_calls = [
+            {
+                'id': f'call_{start + i}',
+                'type': 'function',
+                'function': {'name': name, 'arguments': json.dumps(arguments)}
+            }
+            for i, (name, arguments) in enumerate(calls)
+        ]
+        message = {'role': 'assistant', 'content': None, 'tool_calls': tool_calls}
+        return self.response('tool_calls', message)
+
+    def resolve(self, value, future_ids:List[str]):
+        match = REFERENCE.match(value) if isinstance(value, str) else None
+        if match and match.group(1).startswith('step'):
+            return future_ids[int(match.group(1)[len('step'):])]
+        return value
+
+    def stop(self) -> dict:
+        return self.response('stop', {'role': 'assistant', 'content': 'All tasks scheduled.'})
+
+    def response(self, finish_reason:str, message:dict) -> dict:
+        return {'choices': [{'finish_reason': finish_reason, 'message': message}]}
+
+    def cache_key(self) -> str:
+        return f'stub:{self.mode}:{json.dumps(self.script, sort_keys=True)}'
+
+
+# --------------------- Response Cache ---------------------
+
+# Identical prompts (same backend, conversation and functions) get the
+# stored response instead of a new model round trip. Entries live in
+# memory, and optionally as JSON files in cache_dir across restarts.
+
+class ResponseCache:
+
+    def __init__(self, max_entries:int=256, cache_dir:str=None) -> None:
+        self.max_entries = max_entries
+        self.cache_dir = cache_dir
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def key(self, backend_key:str, messages:List[dict], functions:List[dict]) -> str:
+        content = json.dumps([backend_key, messages, functions], sort_keys=True)
+        return hashlib.sha256(content.encode()).hexdigest()
+
+    def get(self, key:str) -> Optional[dict]:
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return copy.deepcopy(self.entries[key])
+        path = self.path(key)
+        if path and os.path.exists(path):
+            with open(path) as file:
+                response = json.load(file)
+            self.put(key, response, persist=False)
+            with self.lock:
+                self.hits += 1
+            return response
+        with self.lock:
+            self.misses += 1
+        return None
+
+    def put(self, key:str, response:dict, persist:bool=True) -> None:
+        with self.lock:
+            self.entries[key] = copy.deepcopy(response)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        path = self.path(key)
+        if path and persist:
+            with open(path, 'w') as file:
+                json.dump(response, file)
+
+    def path(self, key:str) -> Optional[str]:
+        return os.path.join(self.cache_dir, f'{key}.json') if self.cache_dir else None
+
+
+class CachedBackend:
+
+    def __init__(self, backend, cache:ResponseCache) -> None:
+        self.backend = backend
+        self.cache = cache
+
+    def complete(self, messages:List[dict], functions:List[dict]) -> dict:
+        key = self.cache.key(self.backend.cache_key(), messages, functions)
+        response = self.cache.get(key)
+        if response is None:
+            response = self.backend.complete(messages, functions)
+            self.cache.put(key, response)
+        return response
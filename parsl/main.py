@@ -1,13 +1,19 @@
 
 
-from filesystem_util import LOGS_DIR
+import argparse
+
+import workflow_tasks
+from filesystem_util import LOGS_DIR, PARSL_DIR, ROOT
 from function_descriptions import functions
 from openai_agent import OpenAIAgent
+from profiling import PROFILERS, check_profiler, merge_profiles
+from staging import node_local_staging
 from testing import *
 
 import parsl
 from parsl.config import Config
-from parsl.executors import ThreadPoolExecutor
+from parsl.executors import HighThroughputExecutor, ThreadPoolExecutor
+from parsl.providers import LocalProvider
 
 # --------------------- Main Code ---------------------
 
@@ -23,33 +29,102 @@ def load_config():
     )
     parsl.load(config)
 
+def load_htex_config(scratch_dir:str):
+    # workers unpickle the apps from the parsl modules and resolve
+    # the stage code directories from the repository root
+    config = Config(
+        executors=[
+            HighThroughputExecutor(
+                label='htex',
+                storage_access=node_local_staging(ROOT, scratch_dir),
+                provider=LocalProvider(
+                    worker_init=f'cd {ROOT}; export PYTHONPATH={PARSL_DIR}:$PYTHONPATH'
+                )
+            )
+        ],
+        run_dir=LOGS_DIR
+    )
+    parsl.load(config)
+
+def new_run_dir():
+    # the profiles of a run directory are merged once it is left
+    if workflow_tasks.PROFILER and hasattr(AppFutureManager, 'DIR'):
+        parsl.wait_for_current_tasks()
+        merge_profiles(AppFutureManager.DIR)
+    AppFutureManager.new_dir()
+
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser('Phyloflow')
+    parser.add_argument('--profile', choices=PROFILERS, default=None,
+                        help='profile every python stage, see profiling.py')
+    parser.add_argument('--scratch-dir', default=None,
+                        help='run on a HighThroughputExecutor staging files through '
+                             'this node-local directory, see staging.py')
+    args = parser.parse_args()
+    try:
+        workflow_tasks.PROFILER = check_profiler(args.profile)
+    except ValueError as e:
+        parser.error(str(e))
 
-    load_config()
+    if args.scratch_dir:
+        load_htex_config(args.scratch_dir)
+    else:
+        load_config()
 
     print("\nIndividual Tasks\n")
-    AppFutureManager.new_dir()
+    new_run_dir()
+    test_node_local_staging()
     test_vcf_transform()
+    test_variant_index()
     test_pyclone_vi()
+    test_pyclone_vi_restarts()
+    test_stage_supervisor()
     test_cluster_transform()
+    test_cluster_transform_sweep()
     test_spruce_tree()
+    test_spruce_budget()
     test_aggregate_json()
+    test_aggregate_db()
 
     print("\nFull Workflow\n")
-    AppFutureManager.new_dir()
+    new_run_dir()
     test_full_workflow()
+    test_fused_workflow()
+    test_region_selection()
+    test_cluster_pruning()
     
     print("\nParallel Workflows\n")
-    AppFutureManager.new_dir()
+    new_run_dir()
     test_parallel_workflows()
+    test_batched_workflows()
+    test_compact_json()
+    test_patient_workflows()
+    test_schema_validation()
+    test_cohort_store()
+    test_ingest()
+    test_submission_queue()
+    test_storage_policy()
+
+    print("\nWorkflow Service\n")
+    new_run_dir()
+    test_service()
+    test_agent_batching()
+
+    print("\nProfiling\n")
+    new_run_dir()
+    test_profiling()
 
     print("\nOpenAI Function Calls\n")
-    AppFutureManager.new_dir()
+    new_run_dir()
     agent = OpenAIAgent(functions=functions)
     agent.start_conversation(
     '''
     Help me with two things: 
         First: transform the vcf file ./example_data/VEP_raw.A25.mutect2.filtered.snp.vcf.
         Second: execute pyclone-vi on the file outputed in the first step.
-    ''')
\ No newline at end of file
+    ''')
+
+    if workflow_tasks.PROFILER:
+        parsl.wait_for_current_tasks()
+        merge_profiles(AppFutureManager.DIR)
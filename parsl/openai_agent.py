@@ -1,67 +1,102 @@
-
 import json
 
-import openai
-from function_calls import *
-
-# Include here your OpenAI API Key
-
-openai.api_key = 'YOUR-API-KEY'
+from agent_plan import PLAN_DESCRIPTION, submit_plan
+from function_registry import FunctionRegistry, default_registry
+from llm_backends import OpenAIBackend
 
 
 class OpenAIAgent:
 
-    def __init__(self, functions) -> None:
-        self.functions = functions
+    def __init__(self, functions=None, registry:FunctionRegistry=None,
+                 backend=None, executor=None) -> None:
+        self.registry = registry or default_registry()
+        self.functions = (functions or self.registry.schemas()) + [PLAN_DESCRIPTION]
+        self.backend = backend or OpenAIBackend()
+        # executor(name, arguments) runs a validated call, directly by default
+        self.executor = executor or self.registry.call
         self.messages = None
         self.response = None
         self.response_message = None
+        self.round_trips = 0
         self.GREEN_COLOR = '\033[92m'
         self.END_COLOR = '\033[0m'
         self.context = '''
     If you are asked to execute one single task receive file names
     If you are asked to execute multiple tasks:
         Receive file names for the first task
-        Send the future ids to the other tasks'''
+        Send the future ids to the other tasks
+    Prefer submitting every task of a request at once with submit_plan'''
 
     def start_conversation(self, msg:str):
         self.messages = []
+        self.round_trips = 0
         self.add_context()
         next_msg = msg
+        future_ids = []
         while True:
             self.ask_openai(next_msg)
             if self.is_last_function_call():
                 break
-            future_id = self.execute_function_call()
-            next_msg = f"Task scheduled with AppFuture id: {future_id} '\nNow what?"
+            if self.response_message.get('tool_calls'):
+                # every call of the response is submitted before asking again
+                future_ids += self.execute_tool_calls()
+                next_msg = None
+            else:
+                scheduled_ids, content = self.scheduled(self.execute_function_call())
+                future_ids += scheduled_ids
+                next_msg = f"{content} '\nNow what?"
         print(f"\nDONE\n")
+        return future_ids
 
-    def ask_openai(self, msg:str):
-        self.add_user_msg(msg)
-        print(f"\n{self.GREEN_COLOR}User: {msg}{self.END_COLOR}")
-        self.response =  openai.ChatCompletion.create(
-            model='gpt-3.5-turbo-0613',
-            messages=self.messages,
-            functions=self.functions,
-            function_call='auto',
-            temperature=0
-        )   
+    def ask_openai(self, msg:str=None):
+        if msg is not None:
+            self.add_user_msg(msg)
+            print(f"\n{self.GREEN_COLOR}User: {msg}{self.END_COLOR}")
+        self.response = self.backend.complete(self.messages, self.functions)
+        self.round_trips += 1
         self.add_ai_message()
-        
+
     def is_last_function_call(self):
         finish_reason = self.response['choices'][0]['finish_reason']
         return finish_reason == 'stop'
 
     def execute_function_call(self):
-        function_name = self.response_message['function_call']['name']
-        fuction_to_call = globals()[function_name]
-        function_args = json.loads(self.response_message['function_call']['arguments'])
+        return self.call(self.response_message['function_call'])
+
+    def execute_tool_calls(self):
+        future_ids = []
+        for tool_call in self.response_message['tool_calls']:
+            scheduled_ids, content = self.scheduled(self.call(tool_call['function']))
+            future_ids += scheduled_ids
+            self.messages.append(
+                {
+                    'role': 'tool',
+                    'tool_call_id': tool_call['id'],
+                    'content': content
+                }
+            )
+        return future_ids
+
+    def scheduled(self, result):
+        # submit_plan returns the future id of every step, other calls one id
+        if isinstance(result, dict):
+            content = 'Plan scheduled with AppFuture ids: ' + \
+                ', '.join(f'{step}={future_id}' for step, future_id in result.items())
+            return list(result.values()), content
+        return [result], f'Task scheduled with AppFuture id: {result}'
+
+    def call(self, function_call:dict):
+        function_name = function_call['name']
+        function_args = json.loads(function_call['arguments'])
 
         print("\nFunction Calling")
         print("Function Name: ", function_name)
         print("Function Args: ", function_args)
 
-        return fuction_to_call(**function_args)
+        if function_name == PLAN_DESCRIPTION['name']:
+            return submit_plan(function_args['steps'], self.registry, self.executor)
+        self.registry.check(function_name, function_args)
+        return self.executor(function_name, function_args)
 
     # Messages
 
@@ -72,11 +107,11 @@ class OpenAIAgent:
     def add_user_msg(self, content:str):
         self.messages.append(
             {
-                'role': 'user', 
+                'role': 'user',
                 'content': content
             }
         )
-    
+
     def add_ai_message(self):
         self.response_message = self.response['choices'][0]['message']
-        self.messages.append(self.response_message.to_dict())
+        self.messages.append(self.response_message)
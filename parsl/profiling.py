@@ -0,0 +1,172 @@
+import argparse
+import cProfile
+import os
+import pstats
+import shutil
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+# --------------------- Stage Profiling ---------------------
+
+# 'cprofile' is deterministic and writes <stage>.pstats into the future
+# directory, 'py-spy' samples the stage (and its worker processes) and
+# writes <stage>.collapsed, one 'frame;frame;frame count' line per stack as
+# read by flamegraph.pl or speedscope. Python apps are always profiled with
+# cProfile. merge_profiles collapses every pstats file and merges the
+# profiles of a run, per stage and overall. py-spy is not part of the
+# stage images, it has to be on the PATH of the workers.
+
+PROFILERS = ['cprofile', 'py-spy']
+
+MERGED_PREFIX = 'profile'
+MAX_DEPTH = 200
+MIN_SECONDS = 1e-4     # shorter calls are folded into their caller
+
+def check_profiler(profiler:Optional[str]) -> Optional[str]:
+    if profiler is not None and profiler not in PROFILERS:
+        raise ValueError(f'Unknown profiler {profiler}, expected one of {PROFILERS}')
+    if profiler == 'py-spy' and shutil.which('py-spy') is None:
+        raise ValueError('py-spy is not installed, install it or profile with cprofile')
+    return profiler
+
+def python_command(profiler:Optional[str], profile_stem:str, flags:str='') -> str:
+    # the python interpreter of a stage command, wrapped by the profiler
+    python = f'python {flags}'.strip()
+    if check_profiler(profiler) is None:
+        return python
+    if profiler == 'cprofile':
+        return f'{python} -m cProfile -o {profile_stem}.pstats'
+    return f'py-spy record --subprocesses --format raw --output {profile_stem}.collapsed -- {python}'
+
+@contextmanager
+def profiled(profile_stem:Optional[str]):
+    if profile_stem is None:
+        yield
+        return
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        yield
+    finally:
+        profile.disable()
+        profile.dump_stats(f'{profile_stem}.pstats')
+
+
+# --------------------- Collapsed Stacks ---------------------
+
+# pstats only keeps caller -> callee edges, stacks are rebuilt from the
+# entry point down. The time of a function reached through several callers
+# is split between them in proportion to the time of each call edge.
+
+def label(func:tuple) -> str:
+    filename, line, name = func
+    if filename == '~':
+        return name.replace(';', ',')
+    return f'{name} ({os.path.basename(filename)}:{line})'.replace(';', ',')
+
+def collapse_stats(stats:pstats.Stats) -> Dict[str, int]:
+    entries = stats.stats
+    callees = defaultdict(dict)
+    for func, (_, _, _, _, callers) in entries.items():
+        for caller, edge in callers.items():
+            callees[caller][func] = edge[3]
+    stacks = Counter()
+
+    def walk(func, path, seconds):
+        path = path + [func]
+        edges = {}
+        if len(path) < MAX_DEPTH and entries[func][3] > 0:
+            edges = {callee: edge_time for callee, edge_time in callees[func].items()
+                     if callee not in path and edge_time > 0}
+        # recursive calls overlap, the children never get more than their caller
+        scale = seconds / max(entries[func][3], sum(edges.values()), 1e-12)
+        child_seconds = 0.0
+        for callee, edge_time in edges.items():
+            if edge_time * scale >= MIN_SECONDS:
+                child_seconds += walk(callee, path, edge_time * scale)
+        # the time of recursive and pruned calls stays with the caller
+        self_time = int((seconds - child_seconds) * 1e6)
+        if self_time > 0:
+            stacks[';'.join(label(f) for f in path)] += self_time
+        return seconds
+
+    # the entry point is called by nested frames as well (exec through
+    # imports), it is the function with the largest cumulative time
+    root = max(entries, key=lambda func: entries[func][3])
+    walk(root, [], entries[root][3])
+    return stacks
+
+def read_collapsed(collapsed_file:str) -> Counter:
+    stacks = Counter()
+    with open(collapsed_file) as file:
+        for line in file:
+            stack, _, count = line.rstrip('\n').rpartition(' ')
+            if stack:
+                stacks[stack] += int(count)
+    return stacks
+
+def write_collapsed(stacks:Dict[str, int], collapsed_file:str) -> None:
+    with open(collapsed_file, 'w') as file:
+        for stack, count in sorted(stacks.items()):
+            file.write(f'{stack} {count}\n')
+
+def collapse_pstats(pstats_file:str, collapsed_file:str) -> None:
+    write_collapsed(collapse_stats(pstats.Stats(pstats_file)), collapsed_file)
+
+
+# --------------------- Merged Profiles ---------------------
+
+def find_profiles(run_dir:str) -> Dict[str, Dict[str, List[str]]]:
+    # stage -> {'pstats': [...], 'collapsed': [...]}, merged files excluded
+    profiles = defaultdict(lambda: {'pstats': [], 'collapsed': []})
+    for dirpath, _, filenames in os.walk(run_dir):
+        for filename in sorted(filenames):
+            stage, extension = os.path.splitext(filename)
+            if extension not in ('.pstats', '.collapsed') or stage.startswith(MERGED_PREFIX):
+                continue
+            profiles[stage][extension[1:]].append(os.path.join(dirpath, filename))
+    return profiles
+
+def merge_profiles(run_dir:str) -> Dict[str, int]:
+    # returns the number of profiled tasks of every stage
+    profiles = find_profiles(run_dir)
+    all_stats, all_stacks, tasks = [], Counter(), {}
+    for stage, files in sorted(profiles.items()):
+        stacks = Counter()
+        for pstats_file in files['pstats']:
+            collapsed_file = pstats_file[:-len('.pstats')] + '.collapsed'
+            if collapsed_file not in files['collapsed']:
+                collapse_pstats(pstats_file, collapsed_file)
+                files['collapsed'].append(collapsed_file)
+        for collapsed_file in files['collapsed']:
+            stacks.update(read_collapsed(collapsed_file))
+        write_collapsed(stacks, os.path.join(run_dir, f'{MERGED_PREFIX}_{stage}.collapsed'))
+        if files['pstats']:
+            stats = pstats.Stats(*files['pstats'])
+            stats.dump_stats(os.path.join(run_dir, f'{MERGED_PREFIX}_{stage}.pstats'))
+            all_stats += files['pstats']
+        all_stacks.update({f'{stage};{stack}': count for stack, count in stacks.items()})
+        tasks[stage] = max(len(files['pstats']), len(files['collapsed']))
+    if all_stats:
+        pstats.Stats(*all_stats).dump_stats(os.path.join(run_dir, f'{MERGED_PREFIX}.pstats'))
+    if all_stacks:
+        write_collapsed(all_stacks, os.path.join(run_dir, f'{MERGED_PREFIX}.collapsed'))
+    return tasks
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser('Phyloflow profiles')
+    commands = parser.add_subparsers(dest='command', required=True)
+    merge = commands.add_parser('merge', help='merge the stage profiles of a run directory')
+    merge.add_argument('run_dir')
+    collapse = commands.add_parser('collapse', help='turn a pstats file into collapsed stacks')
+    collapse.add_argument('pstats_file')
+    collapse.add_argument('collapsed_file')
+    args = parser.parse_args()
+
+    if args.command == 'merge':
+        for stage, count in merge_profiles(args.run_dir).items():
+            print(f'{stage}: {count} profiled tasks')
+    else:
+        collapse_pstats(args.pstats_file, args.collapsed_file)
@@ -0,0 +1,169 @@
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from appfuture_manager import AppFutureManager
+from filesystem_util import (AGGREGATE_JSON_CODE_DIR, CLUSTER_TRANSFORM_CODE_DIR,
+                             import_stage_module, store_path)
+from function_registry import FunctionRegistry, InvalidCall, default_registry
+from llm_backends import CachedBackend, OpenAIBackend, ResponseCache, StubLLM
+from openai_agent import OpenAIAgent
+from submission_queue import QueueFull, SubmissionQueue
+
+import parsl
+
+# --------------------- Workflow Service ---------------------
+
+# Long lived process keeping the Parsl DFK and its executors warm. The
+# registered fcall functions are exposed over a local HTTP API, every call
+# goes through the submission queue, so a request only pays for its tasks.
+#
+#   GET  /functions                     registered function schemas
+#   POST /call     {function, arguments, tenant, priority}
+#   POST /chat     {message, backend, mode, tenant, priority}
+#   GET  /futures/<future_id>?wait=<s>  status and outputs of a future
+#   GET  /metrics                       submission queue and LLM cache metrics
+
+class WorkflowService:
+
+    def __init__(self, registry:FunctionRegistry, queue:SubmissionQueue) -> None:
+        self.registry = registry
+        self.queue = queue
+        self.backends = {
+            'stub': StubLLM
+        }
+        # shared by every conversation, repeated prompts skip the model
+        self.cache = ResponseCache()
+
+    def call(self, name:str, arguments:dict, tenant:str='default', priority:int=0):
+        self.registry.check(name, arguments)
+        ticket = self.queue.submit(tenant, self.registry.call, name, arguments, priority=priority)
+        return ticket.result()
+
+    def chat(self, message:str, backend:str='stub', tenant:str='default', priority:int=0,
+             mode:str='plan'):
+        # mode is how many calls a response may hold: one, several or a plan
+        if mode not in ('sequential', 'parallel', 'plan'):
+            raise InvalidCall(f'Unknown mode {mode}')
+        if backend == 'openai':
+            llm = OpenAIBackend(parallel_tools=mode != 'sequential')
+        elif backend in self.backends:
+            llm = self.backends[backend](mode=mode)
+        else:
+            raise InvalidCall(f'Unknown backend {backend}')
+        agent = OpenAIAgent(registry=self.registry, backend=CachedBackend(llm, self.cache),
+                            executor=lambda name, arguments: self.call(name, arguments, tenant, priority))
+        return agent.start_conversation(message)
+
+    def status(self, future_id:str, wait:float=0) -> dict:
+        future = AppFutureManager.query(future_id)
+        deadline = time.monotonic() + wait
+        while not future.done() and time.monotonic() < deadline:
+            time.sleep(min(0.5, max(0, deadline - time.monotonic())))
+        status = {'future_id': future_id, 'status': 'pending', 'outputs': []}
+        if future.done():
+            error = future.exception()
+            status['status'] = 'failed' if error is not None else 'done'
+            if error is not None:
+                status['error'] = repr(error)
+        status['outputs'] = [store_path(output) for output in future.outputs]
+        return status
+
+
+class ServiceHandler(BaseHTTPRequestHandler):
+    service = None
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == '/functions':
+            return self.reply(200, self.service.registry.schemas())
+        if url.path == '/metrics':
+            metrics = self.service.queue.metrics()
+            metrics['llm_cache'] = {'hits': self.service.cache.hits,
+                                    'misses': self.service.cache.misses}
+            return self.reply(200, metrics)
+        if url.path.startswith('/futures/'):
+            future_id = url.path[len('/futures/'):]
+            wait = float(parse_qs(url.query).get('wait', ['0'])[0])
+            try:
+                return self.reply(200, self.service.status(future_id, wait))
+            except KeyError:
+                return self.reply(404, {'error': f'Unknown future {future_id}'})
+        self.reply(404, {'error': f'Unknown path {url.path}'})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            request = json.loads(self.rfile.read(length) or b'{}')
+            tenant = request.get('tenant', 'default')
+            priority = request.get('priority', 0)
+            if url.path == '/call':
+                future_id = self.service.call(request['function'], request.get('arguments', {}),
+                                              tenant, priority)
+                return self.reply(200, {'future_id': future_id})
+            if url.path == '/chat':
+                future_ids = self.service.chat(request['message'], request.get('backend', 'stub'),
+                                               tenant, priority, request.get('mode', 'plan'))
+                return self.reply(200, {'future_ids': future_ids})
+            self.reply(404, {'error': f'Unknown path {url.path}'})
+        except (InvalidCall, KeyError, json.JSONDecodeError) as e:
+            self.reply(400, {'error': str(e)})
+        except QueueFull as e:
+            self.reply(429, {'error': str(e)})
+        except Exception as e:
+            # failures of the submitted call itself, the client still gets a reply
+            self.reply(500, {'error': repr(e)})
+
+    def reply(self, code:int, body):
+        content = json.dumps(body).encode()
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_service(host:str='127.0.0.1', port:int=8765,
+                  queue:SubmissionQueue=None) -> ThreadingHTTPServer:
+    # expects a loaded Parsl config and AppFutureManager.DIR
+    service = WorkflowService(default_registry(), queue or SubmissionQueue())
+    handler = type('BoundServiceHandler', (ServiceHandler,), {'service': service})
+    server = ThreadingHTTPServer((host, port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser('Phyloflow workflow service')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--max-running', type=int, default=16,
+                        help='submissions running at the same time')
+    parser.add_argument('--preload-fused', action='store_true',
+                        help='import the fused stage modules at startup')
+    args = parser.parse_args()
+
+    from main import load_config
+    load_config()
+    AppFutureManager.new_dir()
+    if args.preload_fused:
+        import_stage_module(CLUSTER_TRANSFORM_CODE_DIR, 'py_code.main')
+        import_stage_module(AGGREGATE_JSON_CODE_DIR, 'aggregate_json')
+
+    queue = SubmissionQueue(max_running=args.max_running)
+    server = start_service(args.host, args.port, queue)
+    print(f'Serving on http://{args.host}:{args.port}')
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+        queue.close()
+        parsl.dfk().cleanup()
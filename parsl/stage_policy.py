@@ -0,0 +1,141 @@
+import statistics
+import threading
+import time
+from concurrent.futures import Future
+from dataclasses import dataclass
+from typing import Callable, Optional
+
+from parsl.dataflow.futures import AppFuture
+
+# --------------------- Stage Policies ---------------------
+
+@dataclass
+class StagePolicy:
+    walltime: Optional[int] = None      # seconds per attempt, None for no limit
+    retries: int = 0                    # attempts launched after a failure
+    backoff: float = 10                 # seconds before the first retry
+    backoff_factor: float = 2           # growth of the delay between retries
+    speculative: bool = False           # duplicate attempts far past the median
+    speculative_factor: float = 3       # elapsed / cohort median that triggers a duplicate
+    speculative_min_samples: int = 3    # finished attempts needed for a median
+    speculative_poll: float = 30        # seconds between straggler checks
+
+    def supervised(self) -> bool:
+        return self.retries > 0 or self.speculative
+
+    def check(self, stage:str, supervised:bool) -> 'StagePolicy':
+        # retries and speculation need a stage launched by a StageSupervisor
+        if self.supervised() and not supervised:
+            raise ValueError(f'Stage {stage} is not supervised, its policy may only set a walltime')
+        return self
+
+
+class StageRuntimes:
+    durations = {}
+    lock = threading.Lock()
+
+    def record(stage:str, seconds:float):
+        with StageRuntimes.lock:
+            StageRuntimes.durations.setdefault(stage, []).append(seconds)
+
+    def median(stage:str, min_samples:int) -> Optional[float]:
+        with StageRuntimes.lock:
+            durations = StageRuntimes.durations.get(stage, [])
+            if len(durations) < min_samples:
+                return None
+            return statistics.median(durations)
+
+
+# --------------------- Stage Supervisor ---------------------
+
+# Runs one stage through several attempts. launch(attempt) submits an
+# attempt and returns its AppFuture, publish(attempt) moves the outputs
+# of the first successful attempt into place. Failed attempts are
+# relaunched with exponential backoff, and with speculation enabled a
+# straggler gets one duplicate attempt; whichever attempt succeeds first wins
+# and cancel(attempt) stops the attempts still running.
+
+class StageSupervisor:
+
+    def __init__(self, stage:str, policy:StagePolicy,
+                 launch:Callable[[int], AppFuture], publish:Callable[[int], None],
+                 cancel:Callable[[int], None]=None):
+        self.stage = stage
+        self.policy = policy
+        self.launch_attempt = launch
+        self.publish = publish
+        self.cancel = cancel
+        self.result = Future()
+        self.lock = threading.Lock()
+        self.attempts = 0
+        self.failures = 0
+        self.active = set()
+        self.speculated = False
+
+    def start(self) -> Future:
+        self.launch()
+        return self.result
+
+    def launch(self):
+        with self.lock:
+            if self.result.done():
+                return
+            attempt = self.attempts
+            self.attempts += 1
+            self.active.add(attempt)
+        started = time.monotonic()
+        future = self.launch_attempt(attempt)
+        future.add_done_callback(lambda f: self.done(attempt, started, f))
+        if self.policy.speculative and not self.speculated:
+            self.watch(attempt, started)
+
+    def done(self, attempt:int, started:float, future:AppFuture):
+        with self.lock:
+            self.active.discard(attempt)
+            if self.result.done():
+                return
+            if future.exception() is None:
+                StageRuntimes.record(self.stage, time.monotonic() - started)
+                try:
+                    self.publish(attempt)
+                    self.result.set_result(attempt)
+                except Exception as e:
+                    self.result.set_exception(e)
+                losers = sorted(self.active)
+            else:
+                self.failures += 1
+                if self.active:
+                    # a duplicate of this attempt is still running and may succeed
+                    return
+                if self.failures > self.policy.retries:
+                    self.result.set_exception(future.exception())
+                    return
+                delay = self.policy.backoff * self.policy.backoff_factor ** (self.failures - 1)
+                losers = None
+        if losers is None:
+            self.schedule(delay, self.launch)
+        elif self.cancel is not None:
+            # the attempts still running would only hold their workers
+            for loser in losers:
+                self.cancel(loser)
+
+    def watch(self, attempt:int, started:float):
+        def check():
+            with self.lock:
+                if self.result.done() or self.speculated or attempt not in self.active:
+                    return
+                median = StageRuntimes.median(self.stage, self.policy.speculative_min_samples)
+                straggling = (median is not None and
+                              time.monotonic() - started > self.policy.speculative_factor * median)
+                if straggling:
+                    self.speculated = True
+            if straggling:
+                self.launch()
+            else:
+                self.schedule(self.policy.speculative_poll, check)
+        self.schedule(self.policy.speculative_poll, check)
+
+    def schedule(self, delay:float, function:Callable):
+        timer = threading.Timer(delay, function)
+        timer.daemon = True
+        timer.start()
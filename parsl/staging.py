@@ -0,0 +1,92 @@
+import hashlib
+import os
+import shutil
+import threading
+
+from parsl.data_provider.data_manager import default_staging
+from parsl.data_provider.staging import Staging
+from parsl.utils import RepresentationMixin
+
+# --------------------- Node Local Staging ---------------------
+
+# Files under store_dir (the shared filesystem, or any local directory
+# standing in for it) are read and written through a node-local scratch
+# directory. Inputs are copied once per node and reused by every task on
+# that node, outputs are written to scratch and copied back to the store
+# when the task finishes.
+
+class NodeLocalStaging(Staging, RepresentationMixin):
+
+    def __init__(self, store_dir:str, scratch_dir:str='/tmp/phyloflow-scratch'):
+        self.store_dir = os.path.abspath(store_dir)
+        self.scratch_dir = scratch_dir
+
+    def in_store(self, file) -> bool:
+        if file.scheme != 'file':
+            return False
+        path = os.path.abspath(file.path)
+        return path.startswith(self.store_dir + os.sep)
+
+    def can_stage_in(self, file) -> bool:
+        return self.in_store(file)
+
+    def can_stage_out(self, file) -> bool:
+        return self.in_store(file)
+
+    def stage_in(self, dm, executor, file, parent_fut):
+        file.local_path = scratch_path(self.scratch_dir, file.path)
+        return None
+
+    def stage_out(self, dm, executor, file, app_fu):
+        file.local_path = scratch_path(self.scratch_dir, file.path)
+        return None
+
+    def replace_task(self, dm, executor, file, func):
+        return stage_in_wrapper(func, file.path, file.local_path)
+
+    def replace_task_stage_out(self, dm, executor, file, func):
+        return stage_out_wrapper(func, file.path, file.local_path)
+
+
+def node_local_staging(store_dir:str, scratch_dir:str='/tmp/phyloflow-scratch'):
+    return [NodeLocalStaging(store_dir, scratch_dir)] + default_staging
+
+
+# --------------------- Task Wrappers ---------------------
+
+def scratch_path(scratch_dir:str, store_path:str) -> str:
+    key = hashlib.sha1(os.path.abspath(store_path).encode()).hexdigest()[:16]
+    return os.path.join(scratch_dir, key, os.path.basename(store_path))
+
+def is_cached(store_path:str, local_path:str) -> bool:
+    if not os.path.exists(local_path):
+        return False
+    store_stat = os.stat(store_path)
+    local_stat = os.stat(local_path)
+    return (store_stat.st_size == local_stat.st_size and
+            int(store_stat.st_mtime) == int(local_stat.st_mtime))
+
+def copy_atomic(source:str, destination:str) -> None:
+    # concurrent tasks on the same node may stage the same file, the rename
+    # guarantees they never see a partially copied one
+    os.makedirs(os.path.dirname(destination), exist_ok=True)
+    partial = f'{destination}.{os.getpid()}.{threading.get_ident()}.partial'
+    shutil.copy2(source, partial)
+    os.replace(partial, destination)
+
+def stage_in_wrapper(func, store_path:str, local_path:str):
+    def wrapper(*args, **kwargs):
+        if not is_cached(store_path, local_path):
+            copy_atomic(store_path, local_path)
+        return func(*args, **kwargs)
+    return wrapper
+
+def stage_out_wrapper(func, store_path:str, local_path:str):
+    def wrapper(*args, **kwargs):
+        os.makedirs(os.path.dirname(local_path), exist_ok=True)
+        result = func(*args, **kwargs)
+        # the store copy keeps the scratch mtime, so tasks that read
+        # this output on the same node reuse it without a stage in
+        copy_atomic(local_path, store_path)
+        return result
+    return wrapper
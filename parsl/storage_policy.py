@@ -0,0 +1,185 @@
+import gzip
+import os
+import shutil
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from filesystem_util import RUNS_DIR
+from task_planner import file_digest
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# --------------------- Storage Policy ---------------------
+
+# Applied to a finished run directory. Outputs nothing downstream reads
+# are removed, outputs read through open_stored are compressed at rest, and
+# stage outputs identical across runs are hardlinked to a single copy in a
+# content addressed object store, objects no run links anymore are pruned.
+# open_stored reads a file whether it was compressed or not; the stages and
+# the *_from_futures calls open their inputs by their plain path, so the
+# outputs they read, the TSVs included, are never compressed. Logs, cohort
+# stores, ingest ledgers and other files a run keeps writing are not stage
+# outputs and are left as they are.
+
+UNUSED_OUTPUTS = [
+    'spruce.res',
+    'pyclone_samples',
+    'headers.json',
+    'mutations.json'
+]
+
+# outputs whose every reader goes through open_stored (aggregate_workflows,
+# the cohort store)
+STORED_OUTPUTS = [
+    'aggregated.json',
+    'aggregated_workflows.json'
+]
+
+# the logs of a stage stay readable as they are
+STD_FILES = ['stdout.txt', 'stderr.txt']
+
+CODEC_SUFFIXES = {
+    'gzip': '.gz',
+    'zstd': '.zst'
+}
+
+DEFAULT_LEVELS = {
+    'gzip': 6,
+    'zstd': 3
+}
+
+OBJECTS_DIR = os.path.join(RUNS_DIR, '.objects')
+
+@dataclass
+class StoragePolicy:
+    drop: List[str] = field(default_factory=lambda: list(UNUSED_OUTPUTS))
+    compress: Optional[str] = 'gzip'    # 'gzip', 'zstd' or None
+    level: Optional[int] = None         # codec level, None for the codec default
+    compress_names: List[str] = field(default_factory=lambda: list(STORED_OUTPUTS))
+    dedupe: bool = True
+    objects_dir: str = OBJECTS_DIR
+
+    def __post_init__(self):
+        if self.compress is not None and self.compress not in CODEC_SUFFIXES:
+            raise ValueError(f'Unknown codec {self.compress}')
+        if self.compress == 'zstd' and zstandard is None:
+            raise ValueError('zstd compression needs the zstandard package')
+
+
+def apply_storage_policy(run_dir:str, policy:StoragePolicy, outputs:List[str]) -> Dict:
+    # outputs are the paths of the stage outputs written into run_dir
+    outputs = {os.path.abspath(output) for output in outputs}
+    report = {
+        'bytes_before': directory_size(run_dir),
+        'dropped': 0,
+        'compressed': 0,
+        'linked': 0,
+        'pruned': 0
+    }
+    for root, dirs, files in os.walk(run_dir):
+        for name in [name for name in dirs if name in policy.drop]:
+            shutil.rmtree(os.path.join(root, name))
+            dirs.remove(name)
+            report['dropped'] += 1
+        for name in files:
+            path = os.path.join(root, name)
+            if name in policy.drop:
+                os.remove(path)
+                report['dropped'] += 1
+                continue
+            output = os.path.abspath(path) in outputs
+            if policy.compress is not None and compressible(name, policy):
+                path = compress_file(path, policy.compress, policy.level)
+                report['compressed'] += 1
+            if policy.dedupe and output and link_object(path, policy.objects_dir):
+                report['linked'] += 1
+    if policy.dedupe:
+        report['pruned'] = prune_objects(policy.objects_dir)
+    report['bytes_after'] = directory_size(run_dir)
+    return report
+
+def directory_size(run_dir:str) -> int:
+    # hardlinked files are counted once, as they are on disk
+    inodes = {}
+    for root, _, files in os.walk(run_dir):
+        for name in files:
+            stat = os.lstat(os.path.join(root, name))
+            inodes[(stat.st_dev, stat.st_ino)] = stat.st_size
+    return sum(inodes.values())
+
+def prune_objects(objects_dir:str=OBJECTS_DIR) -> int:
+    # objects no longer linked from any run directory
+    pruned = 0
+    for root, _, files in os.walk(objects_dir):
+        for name in files:
+            path = os.path.join(root, name)
+            if os.stat(path).st_nlink == 1:
+                os.remove(path)
+                pruned += 1
+    return pruned
+
+
+# --------------------- Compression ---------------------
+
+def compressible(name:str, policy:StoragePolicy) -> bool:
+    return name in policy.compress_names and name not in STD_FILES
+
+def compress_file(path:str, codec:str, level:int=None) -> str:
+    level = level if level is not None else DEFAULT_LEVELS[codec]
+    compressed = path + CODEC_SUFFIXES[codec]
+    partial = compressed + '.partial'
+    with open(path, 'rb') as source, open(partial, 'wb') as target:
+        if codec == 'gzip':
+            # no name or timestamp in the header, so equal inputs give equal files
+            with gzip.GzipFile(filename='', mode='wb', fileobj=target,
+                               compresslevel=level, mtime=0) as stream:
+                shutil.copyfileobj(source, stream)
+        else:
+            zstandard.ZstdCompressor(level=level).copy_stream(source, target)
+    os.replace(partial, compressed)
+    os.remove(path)
+    return compressed
+
+def stored_path(path:str) -> str:
+    if os.path.exists(path):
+        return path
+    for suffix in CODEC_SUFFIXES.values():
+        if os.path.exists(path + suffix):
+            return path + suffix
+    raise FileNotFoundError(path)
+
+def open_stored(path:str, mode:str='rt'):
+    path = stored_path(str(path))
+    if path.endswith(CODEC_SUFFIXES['gzip']):
+        return gzip.open(path, mode)
+    if path.endswith(CODEC_SUFFIXES['zstd']):
+        if zstandard is None:
+            raise ValueError('reading zstd files needs the zstandard package')
+        return zstandard.open(path, mode)
+    return open(path, mode)
+
+
+# --------------------- Deduplication ---------------------
+
+def link_object(path:str, objects_dir:str) -> bool:
+    digest = file_digest(path)
+    object_path = os.path.join(objects_dir, digest[:2], digest)
+    os.makedirs(os.path.dirname(object_path), exist_ok=True)
+    try:
+        if not os.path.exists(object_path):
+            os.link(path, object_path)
+            # shared by every run linking it, so nobody may edit it in place
+            os.chmod(object_path, 0o444)
+            return False
+        if os.path.samefile(path, object_path):
+            return False
+        partial = path + '.partial'
+        os.link(object_path, partial)
+        os.replace(partial, path)
+        return True
+    except OSError:
+        # the object store is on another filesystem, keep the plain copy
+        return False
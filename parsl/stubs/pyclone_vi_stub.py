@@ -0,0 +1,53 @@
+import argparse
+import csv
+import sys
+
+import h5py
+import numpy as np
+
+# --------------------- Stub pyclone-vi ---------------------
+
+# Stands in for the pyclone-vi command line when testing the workflow
+# without a pyclone-vi environment. fit puts every mutation in cluster 0
+# and stores a made-up ELBO that depends on the seed, write-results-file
+# writes the assignments in the pyclone-vi output format.
+
+def fit(args):
+    with open(args.in_file) as in_file:
+        rows = list(csv.DictReader(in_file, delimiter='\t'))
+    rng = np.random.default_rng(args.seed)
+    elbo = -rng.uniform(100, 1000, size=args.num_restarts)
+    with h5py.File(args.out_file, 'w') as fh:
+        fh.create_dataset('/data/mutations', data=[row['mutation_id'].encode() for row in rows])
+        fh.create_dataset('/data/samples', data=[row['sample_id'].encode() for row in rows])
+        fh.create_dataset('/stats/elbo', data=elbo)
+
+def write_results_file(args):
+    with h5py.File(args.in_file, 'r') as fh:
+        mutations = fh['/data/mutations'][()]
+        samples = fh['/data/samples'][()]
+    with open(args.out_file, 'w') as out_file:
+        out_file.write('mutation_id\tsample_id\tcluster_id\tcellular_prevalence\t'
+                       'cellular_prevalence_std\tcluster_assignment_prob\n')
+        for mutation, sample in zip(mutations, samples):
+            out_file.write(f'{mutation!r}\t{sample!r}\t0\t0.5\t0.01\t1.0\n')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser('pyclone-vi stub')
+    commands = parser.add_subparsers(dest='command', required=True)
+    fit_parser = commands.add_parser('fit')
+    fit_parser.add_argument('--in-file', required=True)
+    fit_parser.add_argument('--out-file', required=True)
+    fit_parser.add_argument('--seed', type=int, default=None)
+    fit_parser.add_argument('--num-restarts', type=int, default=1)
+    write_parser = commands.add_parser('write-results-file')
+    write_parser.add_argument('--in-file', required=True)
+    write_parser.add_argument('--out-file', required=True)
+    args = parser.parse_args()
+
+    if args.command == 'fit':
+        fit(args)
+    else:
+        write_results_file(args)
+    sys.exit(0)
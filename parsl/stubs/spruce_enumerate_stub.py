@@ -0,0 +1,55 @@
+
+import argparse
+import gzip
+import sys
+import time
+
+# --------------------- Stub SPRUCE enumerate ---------------------
+
+# Stands in for SPRUCE enumerate when testing budgeted runs without a hard
+# sample. The trees of a prepared result file are "found" one every
+# --seconds-per-tree, enumeration stops at the -ll time limit or -l tree
+# limit and the trees found so far are written in the SPRUCE result format.
+
+def read_solutions(result_file):
+    opener = gzip.open if result_file.endswith('.gz') else open
+    with opener(result_file, 'rt') as result:
+        lines = result.readlines()
+    solutions, solution = [], []
+    for line in lines[1:]:
+        solution.append(line)
+        # every solution ends with its distance
+        if line.startswith('#distance'):
+            solutions.append(solution)
+            solution = []
+    return solutions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser('SPRUCE enumerate stub', allow_abbrev=False)
+    parser.add_argument('--result', required=True, help='result file the trees are taken from')
+    parser.add_argument('--seconds-per-tree', type=float, default=0)
+    parser.add_argument('-clique')
+    parser.add_argument('-t', type=int)
+    parser.add_argument('-v', type=int)
+    parser.add_argument('-ll', type=int, default=-1)
+    parser.add_argument('-l', type=int, default=-1)
+    parser.add_argument('input')
+    args = parser.parse_args()
+
+    solutions = read_solutions(args.result)
+    start = time.time()
+    found = []
+    for solution in solutions:
+        if args.l >= 0 and len(found) >= args.l:
+            break
+        if args.ll >= 0 and time.time() - start + args.seconds_per_tree > args.ll:
+            time.sleep(max(0, args.ll - (time.time() - start)))
+            break
+        time.sleep(args.seconds_per_tree)
+        found.append(solution)
+
+    sys.stdout.write(f'{len(found)} # solutions\n')
+    for solution in found:
+        sys.stdout.writelines(solution)
+    sys.exit(0)
@@ -0,0 +1,197 @@
+import heapq
+import itertools
+import threading
+import time
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import Callable, Dict
+
+from appfuture_manager import AppFutureManager
+
+# --------------------- Submission Queue ---------------------
+
+# Workflow submissions wait here before they reach Parsl. A dispatcher
+# thread releases them by priority and, between tenants with the same
+# priority, to the tenant using the smallest share of its weight. Each
+# tenant has a cap on its running and queued submissions. Submissions
+# over the queue limits are rejected with QueueFull instead of piling up.
+
+class QueueFull(Exception):
+    pass
+
+
+@dataclass
+class TenantPolicy:
+    weight: float = 1           # relative share of the running submissions
+    max_running: int = 4        # submissions of the tenant in Parsl at once
+    max_queued: int = 100       # waiting submissions, further ones are rejected
+
+
+@dataclass(order=True)
+class Submission:
+    sort_key: tuple
+    fcall: Callable = field(compare=False)
+    args: tuple = field(compare=False)
+    kwargs: dict = field(compare=False)
+    ticket: Future = field(compare=False)
+    queued_at: float = field(compare=False)
+
+
+class TenantState:
+
+    def __init__(self, policy:TenantPolicy):
+        self.policy = policy
+        self.queue = []
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.dispatched = 0
+        self.wait_seconds = 0.0
+
+    def share(self) -> float:
+        return self.running / self.policy.weight
+
+    def metrics(self) -> Dict:
+        return {
+            'queued': len(self.queue),
+            'running': self.running,
+            'completed': self.completed,
+            'failed': self.failed,
+            'rejected': self.rejected,
+            'mean_wait_seconds': self.wait_seconds / self.dispatched if self.dispatched else 0.0
+        }
+
+
+class SubmissionQueue:
+
+    def __init__(self, max_running:int=16, max_queued:int=1000,
+                 default_policy:TenantPolicy=None):
+        self.max_running = max_running
+        self.max_queued = max_queued
+        self.default_policy = default_policy or TenantPolicy()
+        self.tenants = {}
+        self.running = 0
+        self.closed = False
+        self.counter = itertools.count()
+        self.condition = threading.Condition()
+        self.dispatcher = threading.Thread(target=self.dispatch_loop, daemon=True)
+        self.dispatcher.start()
+
+    def set_tenant(self, tenant:str, policy:TenantPolicy):
+        with self.condition:
+            self.tenant_state(tenant).policy = policy
+            self.condition.notify()
+
+    def tenant_state(self, tenant:str) -> TenantState:
+        if tenant not in self.tenants:
+            self.tenants[tenant] = TenantState(self.default_policy)
+        return self.tenants[tenant]
+
+    def depth(self) -> int:
+        return sum(len(state.queue) for state in self.tenants.values())
+
+    def submit(self, tenant:str, fcall:Callable, *args, priority:int=0, **kwargs) -> Future:
+        # the returned future resolves to what fcall returns once the
+        # submission is dispatched, a future id or a list of them
+        with self.condition:
+            if self.closed:
+                raise RuntimeError('submission queue is closed')
+            state = self.tenant_state(tenant)
+            if len(state.queue) >= state.policy.max_queued or self.depth() >= self.max_queued:
+                state.rejected += 1
+                raise QueueFull(f'queue full for tenant {tenant}')
+            ticket = Future()
+            submission = Submission((-priority, next(self.counter)), fcall, args, kwargs,
+                                    ticket, time.monotonic())
+            heapq.heappush(state.queue, submission)
+            self.condition.notify()
+        return ticket
+
+    def metrics(self) -> Dict:
+        with self.condition:
+            return {
+                'queued': self.depth(),
+                'running': self.running,
+                'max_running': self.max_running,
+                'max_queued': self.max_queued,
+                'tenants': {tenant: state.metrics() for tenant, state in self.tenants.items()}
+            }
+
+    def close(self):
+        # submissions still waiting are cancelled, their callers get a
+        # CancelledError instead of waiting for a dispatch that never comes
+        with self.condition:
+            self.closed = True
+            for state in self.tenants.values():
+                for submission in state.queue:
+                    submission.ticket.cancel()
+                state.queue.clear()
+            self.condition.notify()
+
+
+    # --------------------- Dispatching ---------------------
+
+    def next_submission(self):
+        if self.running >= self.max_running:
+            return None
+        eligible = [state for state in self.tenants.values()
+                    if state.queue and state.running < state.policy.max_running]
+        if not eligible:
+            return None
+        state = min(eligible, key=lambda state: (state.queue[0].sort_key[0],
+                                                 state.share(),
+                                                 state.queue[0].sort_key[1]))
+        return state, heapq.heappop(state.queue)
+
+    def dispatch_loop(self):
+        while True:
+            with self.condition:
+                picked = self.next_submission()
+                while picked is None and not self.closed:
+                    self.condition.wait()
+                    picked = self.next_submission()
+                if picked is None:
+                    return
+                state, submission = picked
+                state.running += 1
+                state.dispatched += 1
+                state.wait_seconds += time.monotonic() - submission.queued_at
+                self.running += 1
+            self.dispatch(state, submission)
+
+    def dispatch(self, state:TenantState, submission:Submission):
+        try:
+            result = submission.fcall(*submission.args, **submission.kwargs)
+            future_ids = result if isinstance(result, list) else [result]
+            futures = [AppFutureManager.query(future_id) for future_id in future_ids]
+        except Exception as e:
+            self.finish(state, failed=True)
+            submission.ticket.set_exception(e)
+            return
+        submission.ticket.set_result(result)
+        if not futures:
+            self.finish(state, failed=False)
+            return
+
+        lock = threading.Lock()
+        pending = {'count': len(futures), 'failed': False}
+        def done(future):
+            with lock:
+                pending['count'] -= 1
+                pending['failed'] |= future.cancelled() or future.exception() is not None
+                if pending['count'] > 0:
+                    return
+            self.finish(state, pending['failed'])
+        for future in futures:
+            future.add_done_callback(done)
+
+    def finish(self, state:TenantState, failed:bool):
+        with self.condition:
+            state.running -= 1
+            self.running -= 1
+            if failed:
+                state.failed += 1
+            else:
+                state.completed += 1
+            self.condition.notify()
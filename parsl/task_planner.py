@@ -0,0 +1,53 @@
+import hashlib
+import os
+from typing import Callable, Optional
+
+from parsl.app.futures import DataFuture
+from parsl.data_provider.files import File
+from parsl.dataflow.futures import AppFuture
+
+# --------------------- Task Planner ---------------------
+
+# Every stage is keyed by its run function, its parameters and its inputs,
+# files by their content and outputs of earlier stages by the task that
+# produces them. Duplicated stages resolve to the same future, so their
+# downstream stages get identical keys as well and a repeated sample
+# shares its whole subgraph with the first submission.
+
+CHUNK_SIZE = 1 << 20
+
+# Stages reading state that is not part of their inputs, never shared
+VOLATILE_STAGES = {'run_export_cohort', 'run_storage_policy', 'run_profile_report'}
+
+file_digests = {}
+
+def file_digest(path:str) -> str:
+    stat = os.stat(path)
+    cache_key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    if cache_key not in file_digests:
+        digest = hashlib.sha256()
+        with open(path, 'rb') as file:
+            for chunk in iter(lambda: file.read(CHUNK_SIZE), b''):
+                digest.update(chunk)
+        file_digests[cache_key] = digest.hexdigest()
+    return file_digests[cache_key]
+
+def value_token(value) -> str:
+    if isinstance(value, DataFuture):
+        return f'task:{value.tid}:{os.path.basename(value.filename)}'
+    if isinstance(value, AppFuture):
+        return f'task:{value.tid}'
+    if isinstance(value, File):
+        value = value.path
+    if isinstance(value, str) and os.path.isfile(value):
+        return f'file:{file_digest(value)}'
+    if isinstance(value, (list, tuple)):
+        return '[' + ','.join(value_token(item) for item in value) + ']'
+    return repr(value)
+
+def stage_key(run_function:Callable, inputs:list, kwargs:dict) -> Optional[str]:
+    if run_function.__name__ in VOLATILE_STAGES:
+        return None
+    tokens = [run_function.__name__, value_token(inputs)]
+    tokens += [f'{name}={value_token(kwargs[name])}' for name in sorted(kwargs)]
+    return hashlib.sha256('\n'.join(tokens).encode()).hexdigest()
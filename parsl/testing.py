@@ -1,10 +1,28 @@
 
+import json
 import os
+import shutil
+import subprocess
+import sys
+import urllib.request
 
-from filesystem_util import DATA_DIR
+import workflow_tasks
+from filesystem_util import (AGGREGATE_JSON_CODE_DIR, DATA_DIR, PARSL_DIR, import_stage_module,
+                             store_path)
 from function_calls import *
+from ingest import HotFolder, IngestLedger, IngestPolicy, cohort_submitter
+from llm_backends import CachedBackend, ResponseCache, StubLLM, workflow_script
+from openai_agent import OpenAIAgent
+from service import start_service
+from stage_policy import StagePolicy, StageRuntimes, StageSupervisor
+from staging import NodeLocalStaging, is_cached, node_local_staging, scratch_path
+from submission_queue import SubmissionQueue, TenantPolicy
 from workflow_tasks import *
 
+import parsl
+from parsl import bash_app, python_app
+from parsl.executors import ThreadPoolExecutor
+
 # --------------------- Test Files ---------------------
 
 test_files = {
@@ -23,27 +41,171 @@ for k,v in test_files.items():
 # --------------------- Unit Testing ---------------------
 
 
+@bash_app(executors=['staged'])
+def staged_copy(inputs=[], outputs=[]):
+    return f'cp {inputs[0]} {outputs[0]}'
+
+@python_app(executors=['staged'])
+def staged_lines(inputs=[], outputs=[]):
+    with open(inputs[0]) as input_file, open(outputs[0], 'w') as output_file:
+        output_file.write(str(sum(1 for _ in input_file)))
+
+def test_node_local_staging():
+    # a local directory stands in for the shared store: an input is copied
+    # to scratch once and reused, an output is copied back when the task ends.
+    # Staged files point filepath at their scratch copy, path at the store
+    store_dir = os.path.join(AppFutureManager.DIR, 'store')
+    scratch_dir = os.path.join(AppFutureManager.DIR, 'scratch')
+    os.makedirs(store_dir)
+    staging = NodeLocalStaging(store_dir, scratch_dir)
+    input_file = File(os.path.join(store_dir, 'input.tsv'))
+    shutil.copyfile(test_files['pyclone_vi_formatted'], input_file.path)
+    staging.stage_in(None, None, input_file, None)
+    read = staging.replace_task(None, None, input_file, lambda: open(input_file.local_path).read())
+    assert read() == open(test_files['pyclone_vi_formatted']).read()
+    assert is_cached(input_file.path, input_file.local_path)
+    staged_inode = os.stat(input_file.local_path).st_ino
+    read()
+    assert os.stat(input_file.local_path).st_ino == staged_inode, 'cached input staged again'
+    output_file = File(os.path.join(store_dir, 'output', 'output.txt'))
+    staging.stage_out(None, None, output_file, None)
+    def write():
+        with open(output_file.local_path, 'w') as output:
+            output.write('staged out')
+    staging.replace_task_stage_out(None, None, output_file, write)()
+    assert open(output_file.path).read() == 'staged out'
+    assert is_cached(output_file.path, output_file.local_path)
+    assert not staging.can_stage_in(File(test_files['vep_vcf']))
+    # real apps on an executor with the provider attached see only the
+    # scratch copies, their outputs land in the store
+    if 'staged' not in parsl.dfk().executors:
+        parsl.dfk().add_executors([ThreadPoolExecutor(label='staged', max_threads=2,
+                                                      storage_access=node_local_staging(store_dir, scratch_dir))])
+    copy_future = staged_copy(inputs=[File(input_file.path)], 
+                              outputs=[File(os.path.join(store_dir, 'apps', 'copy.tsv'))])
+    lines_future = staged_lines(inputs=[copy_future.outputs[0]],
+                                outputs=[File(os.path.join(store_dir, 'apps', 'lines.txt'))])
+    lines_future.result()
+    copy_path = store_path(copy_future.outputs[0])
+    lines_path = store_path(lines_future.outputs[0])
+    assert os.path.dirname(copy_path) == os.path.join(store_dir, 'apps')
+    assert open(copy_path).read() == open(test_files['pyclone_vi_formatted']).read()
+    assert is_cached(copy_path, scratch_path(scratch_dir, copy_path))
+    with open(test_files['pyclone_vi_formatted']) as input_lines:
+        assert open(lines_path).read() == str(sum(1 for _ in input_lines))
+    print(f'Staged {input_file.path} in and {output_file.path}, {copy_path}, {lines_path} '
+          f'out through {scratch_dir}')
+
 def test_vcf_transform():
     fcall_vcf_transform_from_files(
         vep_vcf=test_files['vep_vcf']
     )
 
+def test_variant_index():
+    # the index numbers exactly the mutations of the pyclone-vi input
+    future_id = fcall_vcf_transform_from_files(
+        vep_vcf=test_files['vep_vcf']
+    )
+    future = AppFutureManager.query(future_id)
+    future.result()
+    with open(store_path(get_output(future, 'variant_index.tsv'))) as index_file:
+        indexed = [line.split('\t')[1] for line in index_file.readlines()[1:]]
+    with open(store_path(get_output(future, 'pyclone_vi_formatted.tsv'))) as pyclone_file:
+        mutations = {line.split('\t')[1] for line in pyclone_file.readlines()[1:]}
+    print(f'{len(indexed)} variants indexed, matching the pyclone-vi input: {set(indexed) == mutations}')
+
 def test_pyclone_vi():
     fcall_pyclone_vi_from_files(
         pyclone_vi_formatted=test_files['pyclone_vi_formatted']
     )
 
+def test_pyclone_vi_restarts():
+    # the restart fan-out and best ELBO selection run against the stub fitter
+    pyclone_vi_command = workflow_tasks.PYCLONE_VI
+    workflow_tasks.PYCLONE_VI = f'python {PARSL_DIR}/stubs/pyclone_vi_stub.py'
+    future_id = fcall_pyclone_vi_from_files(
+        pyclone_vi_formatted=test_files['pyclone_vi_formatted'],
+        restart_tasks=4
+    )
+    AppFutureManager.query(future_id).result()
+    workflow_tasks.PYCLONE_VI = pyclone_vi_command
+
+@python_app
+def flaky_stage(attempt, failures):
+    if attempt < failures:
+        raise RuntimeError(f'attempt {attempt} failed')
+    return attempt
+
+@python_app
+def slow_stage(attempt, seconds):
+    import time
+    time.sleep(seconds)
+    return attempt
+
+def test_stage_supervisor():
+    # stub stages: retried until an attempt succeeds, failing once the 
+    # retries are exhausted, and a straggler overtaken and cancelled by its duplicate
+    published = []
+    policy = StagePolicy(retries=2, backoff=0.1)
+    supervisor = StageSupervisor('test_retries', policy, 
+                                 lambda attempt: flaky_stage(attempt, failures=2), published.append)
+    assert supervisor.start().result() == 2 and published == [2]
+    policy = StagePolicy(retries=1, backoff=0.1)
+    supervisor = StageSupervisor('test_exhausted', policy,
+                                 lambda attempt: flaky_stage(attempt, failures=3), published.append)
+    try:
+        supervisor.start().result()
+        raise AssertionError('exhausted retries did not fail the stage')
+    except RuntimeError as e:
+        assert supervisor.attempts == 2 and published == [2], e
+    for _ in range(3):
+        StageRuntimes.record('test_speculative', 0.1)
+    policy = StagePolicy(speculative=True, speculative_factor=2, speculative_poll=0.1)
+    cancelled = []
+    supervisor = StageSupervisor('test_speculative', policy,
+                                 lambda attempt: slow_stage(attempt, seconds=5 if attempt == 0 else 0),
+                                 published.append, cancelled.append)
+    assert supervisor.start().result() == 1 and supervisor.attempts == 2 and cancelled == [0]
+    try:
+        StagePolicy(retries=1).check('vcf_transform', supervised=False)
+        raise AssertionError('an unsupervised stage accepted retries')
+    except ValueError:
+        pass
+    print(f'Stage supervisor published attempts {published}')
+
 def test_cluster_transform():
     fcall_cluster_transform_from_files(
         pyclone_vi_formatted=test_files['pyclone_vi_formatted'],
         cluster_assignment=test_files['cluster_assignment']
     )
 
+def test_cluster_transform_sweep():
+    fcall_cluster_transform_sweep_from_files(
+        pyclone_vi_formatted=test_files['pyclone_vi_formatted'],
+        cluster_assignment=test_files['cluster_assignment'],
+        alphas=[0.01, 0.05, 0.1]
+    )
+
 def test_spruce_tree():
     fcall_spruce_tree_from_files(
         spruce_formatted=test_files['spruce_formatted']
     )
 
+def test_spruce_budget():
+    # the stub finds a tree per second, the 3 second budget keeps the first ones
+    enumerate_command = workflow_tasks.SPRUCE_ENUMERATE
+    workflow_tasks.SPRUCE_ENUMERATE = (f"python {PARSL_DIR}/stubs/spruce_enumerate_stub.py "
+                                       f"--result {test_files['spruce_gz']} --seconds-per-tree 1")
+    future_id = fcall_spruce_tree_from_files(
+        spruce_formatted=test_files['spruce_formatted'],
+        time_limit=3
+    )
+    spruce_future = AppFutureManager.query(future_id)
+    spruce_future.result()
+    with open(store_path(get_spruce_status(spruce_future)[0])) as status_file:
+        print(json.load(status_file))
+    workflow_tasks.SPRUCE_ENUMERATE = enumerate_command
+
 def test_aggregate_json():
     fcall_aggregate_json_from_files(
         vep_vcf=test_files['vep_vcf'],
@@ -52,14 +214,239 @@ def test_aggregate_json():
         spruce_gz=test_files['spruce_gz']
     )
 
+def test_aggregate_db():
+    # the indexed SQLite export next to the JSON one, queried back
+    db_dir = os.path.join(AppFutureManager.DIR, 'aggregate_db')
+    os.makedirs(db_dir)
+    json_file = os.path.join(db_dir, 'aggregated.json')
+    db_file = os.path.join(db_dir, 'aggregated.sqlite')
+    subprocess.run([sys.executable, 'aggregate_json.py',
+                    '-v', test_files['vep_vcf'],
+                    '-c', test_files['cluster_assignment'],
+                    '-s', test_files['spruce_json'],
+                    '-S', test_files['spruce_gz'],
+                    '-j', json_file, '-d', db_file, '-r', 'A25',
+                    '--program', 'mutect'], cwd=AGGREGATE_JSON_CODE_DIR, check=True)
+    with open(json_file) as aggregated_file:
+        data = json.load(aggregated_file)
+    aggregate_db = import_stage_module(AGGREGATE_JSON_CODE_DIR, 'aggregate_db')
+    conn = aggregate_db.connect(db_file)
+    snv = data['SNV'][0]
+    assert aggregate_db.get_variant(conn, 'A25', f"{snv['chr']}:{snv['start']}") == snv
+    assert aggregate_db.get_variant(conn, 'A25', 'Y:0') is None
+    # SPRUCE gives no scores, the best tree is the first one enumerated
+    assert aggregate_db.best_tree(conn, 'A25') == data['trees'][0]
+    assert aggregate_db.best_tree(conn, 'unknown') is None
+    conn.close()
+    print(f"SQLite export of {len(data['SNV'])} SNVs and {len(data['trees'])} trees queried back")
+
 def test_full_workflow():
     future_id = fcall_full_workflow(
         vep_vcf=test_files['vep_vcf']
     )
     AppFutureManager.query(future_id).result()
 
+def test_fused_workflow():
+    future_id = fcall_full_workflow(
+        vep_vcf=test_files['vep_vcf'],
+        fused=True
+    )
+    AppFutureManager.query(future_id).result()
+
 def test_parallel_workflows():
     future_id = fcall_parallel_workflows(
         vep_vcf_files=[test_files['vep_vcf']]*3
     )
-    AppFutureManager.query(future_id).result()
\ No newline at end of file
+    AppFutureManager.query(future_id).result()
+
+def test_batched_workflows():
+    # the three small samples share one cluster_transform and one aggregate_json task
+    future_id = fcall_parallel_workflows(
+        vep_vcf_files=[test_files['vep_vcf']]*3,
+        batched=True
+    )
+    AppFutureManager.query(future_id).result()
+
+def test_compact_json():
+    # compact aggregates, merged by aggregate_workflows as they are
+    compact = workflow_tasks.COMPACT_JSON
+    workflow_tasks.COMPACT_JSON = True
+    future_id = fcall_parallel_workflows(
+        vep_vcf_files=[test_files['vep_vcf']]*2,
+        fused=True
+    )
+    future = AppFutureManager.query(future_id)
+    future.result()
+    with open(store_path(future.outputs[0])) as aggregated_file:
+        print(f'{len(json.load(aggregated_file))} compact aggregates merged')
+    workflow_tasks.COMPACT_JSON = compact
+
+def test_patient_workflows():
+    # a second region of the test tumor, its sample renamed, grouped with 
+    # the first by a sample sheet: one pyclone-vi fit over both regions
+    patient_dir = os.path.join(AppFutureManager.DIR, 'patient')
+    os.makedirs(patient_dir)
+    region_vcf = os.path.join(patient_dir, 'region_2.vcf')
+    with open(test_files['vep_vcf']) as vcf_file, open(region_vcf, 'w') as region_file:
+        for line in vcf_file:
+            if line.startswith('##tumor_sample=') or line.startswith('#CHROM'):
+                line = line.replace('A25', 'A25_R2')
+            region_file.write(line)
+    sample_sheet = os.path.join(patient_dir, 'sample_sheet.tsv')
+    with open(sample_sheet, 'w') as sheet_file:
+        sheet_file.write('vcf\tpatient\n')
+        sheet_file.write(f"{test_files['vep_vcf']}\tA25\n")
+        sheet_file.write('region_2.vcf\tA25\n')
+    future_id = fcall_parallel_workflows(
+        vep_vcf_files=[test_files['vep_vcf'], region_vcf],
+        sample_sheet=sample_sheet
+    )
+    future = AppFutureManager.query(future_id)
+    future.result()
+    with open(store_path(future.outputs[0])) as aggregated_file:
+        patients = json.load(aggregated_file)
+    print(f"{len(patients)} patient aggregates, samples: {[s['name'] for s in patients[0]['samples']]}")
+
+def test_schema_validation():
+    # every aggregate is validated after it is written, bash and fused, 
+    # and again when aggregate_workflows merges them
+    validate = workflow_tasks.VALIDATE_AGGREGATES
+    workflow_tasks.VALIDATE_AGGREGATES = True
+    for fused in [False, True]:
+        future_id = fcall_parallel_workflows(
+            vep_vcf_files=[test_files['vep_vcf']],
+            fused=fused
+        )
+        future = AppFutureManager.query(future_id)
+        future.result()
+        with open(store_path(future.outputs[1])) as report_file:
+            reports = json.load(report_file)
+        print(f"fused={fused}: {sum(report['valid'] for report in reports)}/{len(reports)} valid aggregates")
+    # streamed a few characters at a time, numbers and strings cut by every chunk
+    schema_validation = import_stage_module(AGGREGATE_JSON_CODE_DIR, 'schema_validation')
+    for chunk_size in [1, 7, 64]:
+        report = schema_validation.validate_file(store_path(future.outputs[0]), many=True, 
+                                                 chunk_size=chunk_size)
+        print(f"chunk_size={chunk_size}: valid={report['valid']}")
+    workflow_tasks.VALIDATE_AGGREGATES = validate
+
+def test_cohort_store():
+    cohort_store = os.path.join(AppFutureManager.DIR, 'cohort.sqlite')
+    future_ids = fcall_update_cohort(
+        vep_vcf_files=[test_files['vep_vcf']],
+        cohort_store=cohort_store
+    )
+    for future_id in future_ids:
+        AppFutureManager.query(future_id).result()
+    future_id = fcall_export_cohort(
+        cohort_store=cohort_store
+    )
+    AppFutureManager.query(future_id).result()
+
+def test_ingest():
+    # the copy has the same content, only the first file is ingested
+    watch_dir = os.path.join(AppFutureManager.DIR, 'hot_folder')
+    os.makedirs(watch_dir)
+    for name in ['first.vcf', 'copy.vcf']:
+        shutil.copyfile(test_files['vep_vcf'], os.path.join(watch_dir, name))
+    ledger = IngestLedger(os.path.join(watch_dir, '.ingested.sqlite'))
+    cohort_store = os.path.join(AppFutureManager.DIR, 'ingested.sqlite')
+    folder = HotFolder(watch_dir, ledger, cohort_submitter(cohort_store),
+                       IngestPolicy(stable_seconds=0, batch_size=2, max_wait_seconds=0))
+    batches = folder.poll()
+    # the ledger status is written by a done callback of each future
+    folder.wait()
+    print(f'Ingested {batches}, ledger: {[row["status"] for row in ledger.rows()]}')
+
+def test_submission_queue():
+    queue = SubmissionQueue(max_running=2)
+    queue.set_tenant('batch', TenantPolicy(weight=1, max_running=1))
+    queue.set_tenant('interactive', TenantPolicy(weight=4, max_running=1))
+    tickets = [
+        queue.submit('batch', fcall_cluster_transform_sweep_from_files,
+                     pyclone_vi_formatted=test_files['pyclone_vi_formatted'],
+                     cluster_assignment=test_files['cluster_assignment'],
+                     alphas=[alpha])
+        for alpha in [0.01, 0.02, 0.05, 0.1]
+    ]
+    tickets.append(
+        queue.submit('interactive', fcall_full_workflow, priority=10,
+                     vep_vcf=test_files['vep_vcf'])
+    )
+    for ticket in tickets:
+        AppFutureManager.query(ticket.result()).result()
+    print(queue.metrics())
+    queue.close()
+
+def test_storage_policy():
+    # only stage outputs are linked into the object store, logs stay writable
+    run_dir = AppFutureManager.DIR
+    future_id = fcall_compact_run(
+        compress='gzip'
+    )
+    print(AppFutureManager.query(future_id).result())
+    for root, _, files in os.walk(run_dir):
+        for name in files:
+            if name in ('stdout.txt', 'stderr.txt'):
+                path = os.path.join(root, name)
+                assert os.stat(path).st_nlink == 1 and os.access(path, os.W_OK), path
+
+def test_region_selection():
+    future_id = fcall_full_workflow(
+        vep_vcf=test_files['vep_vcf'],
+        regions='1,2,3',
+        samples='A25'
+    )
+    AppFutureManager.query(future_id).result()
+
+def test_cluster_pruning():
+    # vcf_transform and pyclone-vi are shared with the full workflow,
+    # SPRUCE runs on at most 3 clusters
+    future_id = fcall_full_workflow(
+        vep_vcf=test_files['vep_vcf'],
+        pruning={'max_clusters': 3, 'min_cluster_size': 10, 'min_assignment_prob': 0.6}
+    )
+    AppFutureManager.query(future_id).result()
+
+def test_service():
+    server = start_service(port=0)
+    url = f'http://127.0.0.1:{server.server_address[1]}'
+    def post(path, body):
+        request = urllib.request.Request(url + path, data=json.dumps(body).encode(), method='POST')
+        with urllib.request.urlopen(request) as response:
+            return json.load(response)
+    reply = post('/chat', {
+        'message': f"Run the workflow on {test_files['vep_vcf']}",
+        'backend': 'stub'
+    })
+    for future_id in reply['future_ids']:
+        with urllib.request.urlopen(f'{url}/futures/{future_id}?wait=3600') as response:
+            print(json.load(response))
+    server.shutdown()
+
+def test_agent_batching():
+    # the same five stages, one per response, as tool calls once the
+    # stages they depend on are scheduled, or all in one plan
+    cache = ResponseCache()
+    script = workflow_script(test_files['vep_vcf'])
+    for mode in ['sequential', 'parallel', 'plan', 'plan']:
+        agent = OpenAIAgent(backend=CachedBackend(StubLLM(script, mode=mode), cache))
+        future_ids = agent.start_conversation(f"Run the workflow on {test_files['vep_vcf']}")
+        print(f'{mode}: {agent.round_trips} round trips for {len(future_ids)} tasks')
+        for future_id in future_ids:
+            AppFutureManager.query(future_id).result()
+    print(f'LLM cache hits: {cache.hits}, misses: {cache.misses}')
+
+def test_profiling():
+    # python apps are profiled in the worker, bash stages through their interpreter
+    profiler = workflow_tasks.PROFILER
+    workflow_tasks.PROFILER = 'cprofile'
+    future_id = fcall_full_workflow(
+        vep_vcf=test_files['vep_vcf'],
+        fused=True,
+        regions='1,2'
+    )
+    AppFutureManager.query(future_id).result()
+    future_id = fcall_profile_report()
+    print(AppFutureManager.query(future_id).result())
+    workflow_tasks.PROFILER = profiler
@@ -1,116 +1,457 @@
 
+import csv
 import json
 import os
-from typing import List
+import re
+import shutil
+import threading
+from concurrent.futures import Future
+from typing import Dict, List, Tuple
 
-from filesystem_util import format_files, get_stdfiles
+from filesystem_util import (AGGREGATE_JSON_CODE_DIR, CLUSTER_TRANSFORM_CODE_DIR, ROOT,
+                             format_files, generate_subdir, get_stdfiles, store_path)
+from profiling import merge_profiles, profiled, python_command
+from stage_policy import StagePolicy, StageSupervisor
 
-from parsl import bash_app, python_app
+from parsl import bash_app, join_app, python_app
 from parsl.data_provider.files import File
 from parsl.dataflow.futures import AppFuture
 
+# --------------------- Stage Policies ---------------------
+
+# Walltime of every stage, and retries and speculation of the supervised
+# ones (SUPERVISED_STAGES, a single pyclone-vi fit). The defaults keep the
+# single unbounded attempt, e.g. set STAGE_POLICIES['pyclone_vi'] to
+# StagePolicy(walltime=3600, retries=2, speculative=True) for large cohorts.
+# A stage that is not supervised rejects a policy with retries or speculation.
+
+STAGE_POLICIES = {
+    'vcf_transform': StagePolicy(),
+    'pyclone_vi': StagePolicy(),
+    'cluster_transform': StagePolicy(),
+    'spruce_tree': StagePolicy(),
+    'aggregate_json': StagePolicy()
+}
+
+SUPERVISED_STAGES = {'pyclone_vi'}
+
+def stage_policy(stage:str, supervised:bool=False) -> StagePolicy:
+    return STAGE_POLICIES[stage].check(stage, supervised)
+
+
+
+# --------------------- Profiling ---------------------
+
+# None, 'cprofile' or 'py-spy' (see profiling.py), set by main.py --profile.
+# Every stage writes its profile into its future directory.
+PROFILER = None
+
+def stage_python(rundir:str, stage:str, flags:str='') -> str:
+    return python_command(PROFILER, os.path.join(rundir, stage), flags)
+
+def stage_profile(rundir:str, stage:str):
+    # python apps run in the parsl worker and are always profiled with cProfile
+    return os.path.join(rundir, stage) if PROFILER else None
+
+
+
+# --------------------- Stage Switches ---------------------
+
+# Module settings read when a stage is submitted. They change what a stage
+# runs or writes without being one of its inputs, so they are part of its
+# stage key (see task_planner.py) and a switched stage is not shared.
+
+def stage_switches() -> dict:
+    return {
+        'PROFILER': PROFILER,
+        'STAGE_POLICIES': STAGE_POLICIES,
+        'PYCLONE_VI': PYCLONE_VI,
+        'PYCLONE_VI_RESTART_TASKS': PYCLONE_VI_RESTART_TASKS,
+        'PYCLONE_VI_RESTARTS_PER_TASK': PYCLONE_VI_RESTARTS_PER_TASK,
+        'SPRUCE_TOOL_DIR': SPRUCE_TOOL_DIR,
+        'SPRUCE_ENUMERATE': SPRUCE_ENUMERATE,
+        'COMPACT_JSON': COMPACT_JSON,
+        'VALIDATE_AGGREGATES': VALIDATE_AGGREGATES,
+        'VALIDATION_FAIL_FAST': VALIDATION_FAIL_FAST
+    }
+
+
+# --------------------- Output Lookup ---------------------
+
+def get_output(future:AppFuture, name:str):
+    for output in future.outputs:
+        if os.path.basename(output.filename) == name:
+            return output
+    raise KeyError(f'{name} is not an output of task {future.tid}')
+
+def get_variant_index(vcf_future:AppFuture) -> list:
+    # the variant index is optional for the later stages, they number 
+    # the variants themselves when vcf_transform did not write one
+    try:
+        return [get_output(vcf_future, 'variant_index.tsv')]
+    except KeyError:
+        return []
+
+def get_cluster_map(cluster_future:AppFuture) -> list:
+    # only written when cluster_transform pruned the clusters
+    try:
+        return [get_output(cluster_future, CLUSTER_MAP)]
+    except KeyError:
+        return []
+
+# optional inputs of aggregate_json, after the four it always reads
+OPTIONAL_INPUT_OPTIONS = {
+    'variant_index.tsv': '--variant-index',
+    'cluster_map.json': '--cluster-map',
+    'spruce.status.json': '--spruce-status'
+}
+
+def optional_input_options(inputs:list) -> str:
+    return ' '.join(f'{OPTIONAL_INPUT_OPTIONS[os.path.basename(str(item))]} {item}' 
+                    for item in inputs)
+
+
+# --------------------- Region and Sample Selection ---------------------
+
+# regions: BED file or comma separated contig[:start-end] list
+# samples: file or comma separated list of tumor samples
+
+def selection_options(regions:str=None, samples:str=None) -> str:
+    options = []
+    if regions:
+        options.append(f'--regions {regions}')
+    if samples:
+        options.append(f'--samples {samples}')
+    return ' '.join(options)
+
+
 # --------------------- VCF Transform ---------------------
 
+# Outputs vcf_transform can write, in the order of its command line
+VCF_TRANSFORM_OUTPUTS = [
+    'headers.json',
+    'mutations.json',
+    'pyclone_vi_formatted.tsv',
+    'pyclone_samples',
+    'variant_index.tsv'
+]
+
+# Only the pyclone-vi input and the variant index are used by the rest of 
+# the workflow, the index gives every variant the integer id the later 
+# stages join on
+VCF_TRANSFORM_DEFAULT_OUTPUTS = [
+    'pyclone_vi_formatted.tsv',
+    'variant_index.tsv'
+]
+
 @bash_app
-def vcf_transform(samples_dir, inputs=[], outputs=[], 
-                  stdout=None, stderr=None):
+def vcf_transform(targets, selection='', python='python -B', inputs=[], outputs=[], 
+                  stdout=None, stderr=None, walltime=None):
+    targets = ' '.join(targets)
     return f''' 
         cd './vcf_transform/code';
-        conda run -n vcf-transform python -B -m py_code.main mutect \\
-        {inputs[0]} {outputs[0]} {outputs[1]} {outputs[2]} {samples_dir}
+        conda run -n vcf-transform {python} -m py_code.main mutect \\
+        {inputs[0]} {targets} {selection}
         '''
 
-def run_vcf_transform(inputs:list, rundir:str) -> AppFuture:
-    samples_dir = f'{rundir}/pyclone_samples'
-    os.makedirs(samples_dir)
-    outputs = [
-        'headers.json',
-        'mutations.json',
-        'pyclone_vi_formatted.tsv'
-    ]
-    outputs = format_files(rundir, outputs)
+def run_vcf_transform(inputs:list, rundir:str, outputs:List[str]=None,
+                      regions:str=None, samples:str=None) -> AppFuture:
+    outputs = outputs or VCF_TRANSFORM_DEFAULT_OUTPUTS
+    unknown = set(outputs) - set(VCF_TRANSFORM_OUTPUTS)
+    if unknown:
+        raise ValueError(f'Unknown vcf_transform outputs: {sorted(unknown)}')
+    # skipped outputs are passed to vcf_transform as '-'
+    targets = [os.path.join(rundir, name) if name in outputs else '-'
+               for name in VCF_TRANSFORM_OUTPUTS]
+    if 'pyclone_samples' in outputs:
+        os.makedirs(os.path.join(rundir, 'pyclone_samples'))
+    outputs = format_files(rundir, [name for name in VCF_TRANSFORM_OUTPUTS 
+                                    if name in outputs and name != 'pyclone_samples'])
     stdout, stderr = get_stdfiles(rundir)
-    vcf_future = vcf_transform(inputs=inputs, outputs=outputs, 
+    vcf_future = vcf_transform(targets=targets, selection=selection_options(regions, samples),
+                               python=stage_python(rundir, 'vcf_transform', '-B'),
+                               inputs=inputs, outputs=outputs, 
                                stdout=stdout, stderr=stderr,
-                               samples_dir=samples_dir,)
+                               walltime=stage_policy('vcf_transform').walltime)
     return vcf_future
 
 
 
 # --------------------- Pyclone Vi Clustering ---------------------
 
+# Command used to run pyclone-vi, can point to a stub fitter for testing
+PYCLONE_VI = 'conda run -n pyclone-vi pyclone-vi'
+
+# Number of parallel fit tasks, each with its own seed and restarts
+PYCLONE_VI_RESTART_TASKS = 1
+PYCLONE_VI_RESTARTS_PER_TASK = 10
+
+# Dataset of the pyclone-vi HDF5 fit holding the ELBO
+ELBO_DATASET = '/stats/elbo'
+
 @bash_app
-def pyclone_vi(inputs=[], outputs=[], 
-               stdout=None, stderr=None):
+def pyclone_vi(seed=None, attempt_dir=None, inputs=[], outputs=[], 
+               stdout=None, stderr=None, walltime=None):
+    seed_option = f'--seed {seed}' if seed is not None else ''
+    if attempt_dir is None:
+        return f'''
+        {PYCLONE_VI} fit --in-file {inputs[0]} --out-file {outputs[0]} {seed_option}
+        {PYCLONE_VI} write-results-file --in-file {outputs[0]} --out-file {outputs[1]}
+        '''
+    # a supervised attempt runs in a process group of its own, killed by
+    # cancel_attempt once another attempt has won
+    pid_file, cancel_file = attempt_files(attempt_dir)
     return f'''
-        conda run -n pyclone-vi pyclone-vi fit --in-file {inputs[0]} --out-file {outputs[0]}
-        conda run -n pyclone-vi pyclone-vi write-results-file --in-file {outputs[0]} --out-file {outputs[1]}
+        setsid sh -c "{PYCLONE_VI} fit --in-file {inputs[0]} --out-file {outputs[0]} {seed_option} && \\
+            {PYCLONE_VI} write-results-file --in-file {outputs[0]} --out-file {outputs[1]}" &
+        echo $! > {pid_file}
+        [ -e {cancel_file} ] && kill -TERM -$!
+        wait $!
+        '''
+
+def attempt_files(attempt_dir:str) -> Tuple[str, str]:
+    return os.path.join(attempt_dir, 'attempt.pid'), os.path.join(attempt_dir, 'attempt.cancelled')
+
+def cancel_attempt(attempt_dir:str):
+    # the marker stops an attempt that has not started its process yet
+    import signal
+    pid_file, cancel_file = attempt_files(attempt_dir)
+    open(cancel_file, 'w').close()
+    try:
+        with open(pid_file) as pid:
+            os.killpg(int(pid.read()), signal.SIGTERM)
+    except (FileNotFoundError, ValueError, ProcessLookupError):
+        pass
+
+@bash_app
+def pyclone_vi_fit(seed, restarts, inputs=[], outputs=[], 
+                   stdout=None, stderr=None, walltime=None):
+    return f'''
+        {PYCLONE_VI} fit --in-file {inputs[0]} --out-file {outputs[0]} \\
+        --seed {seed} --num-restarts {restarts}
+        '''
+
+@python_app
+def pyclone_vi_best_fit(elbo_dataset, inputs=[]):
+    import h5py
+    import numpy as np
+    def final_elbo(fit_file):
+        with h5py.File(fit_file, 'r') as fh:
+            return float(np.max(fh[elbo_dataset][()]))
+    elbos = [final_elbo(str(fit)) for fit in inputs]
+    return int(np.argmax(elbos))
+
+@bash_app
+def pyclone_vi_write_results(best, inputs=[], outputs=[], 
+                             stdout=None, stderr=None, walltime=None):
+    return f'''
+        cp {inputs[best]} {outputs[0]}
+        {PYCLONE_VI} write-results-file --in-file {outputs[0]} --out-file {outputs[1]}
         '''
 
 def get_inputs_pyclone_vi(vcf_future:AppFuture):
     inputs = [
-        vcf_future.outputs[2]
+        get_output(vcf_future, 'pyclone_vi_formatted.tsv')
     ]
     return inputs
 
 
-def run_pyclone_vi(inputs:list, rundir:str) -> AppFuture:
+@join_app
+def pyclone_vi_supervised(policy, rundir, inputs=[], outputs=[]):
+    # every attempt fits with its own seed in its own directory, 
+    # the outputs of the first successful one are copied to rundir
+    output_names = [os.path.basename(str(output)) for output in outputs]
+
+    def launch(attempt):
+        attempt_dir = generate_subdir(rundir, f'attempt_{attempt}')
+        attempt_outputs = format_files(attempt_dir, output_names)
+        stdout, stderr = get_stdfiles(attempt_dir)
+        return pyclone_vi(seed=attempt, attempt_dir=attempt_dir, 
+                          inputs=inputs, outputs=attempt_outputs,
+                          stdout=stdout, stderr=stderr, walltime=policy.walltime)
+
+    def publish(attempt):
+        for output_name, output in zip(output_names, outputs):
+            shutil.copyfile(os.path.join(rundir, f'attempt_{attempt}', output_name), str(output))
+
+    def cancel(attempt):
+        cancel_attempt(os.path.join(rundir, f'attempt_{attempt}'))
+
+    return StageSupervisor('pyclone_vi', policy, launch, publish, cancel).start()
+
+def run_pyclone_vi(inputs:list, rundir:str, restart_tasks:int=None) -> AppFuture:
     outputs = [
         'cluster_fit.hdf5',
         'cluster_assignment.tsv'
     ]
     outputs = format_files(rundir, outputs)
+    restart_tasks = restart_tasks or PYCLONE_VI_RESTART_TASKS
+    if restart_tasks > 1:
+        return run_pyclone_vi_restarts(inputs, rundir, outputs, restart_tasks)
+    policy = stage_policy('pyclone_vi', supervised=True)
+    if policy.supervised():
+        return pyclone_vi_supervised(policy=policy, rundir=rundir,
+                                     inputs=inputs, outputs=outputs)
     stdout, stderr = get_stdfiles(rundir)
     pyclone_future = pyclone_vi(inputs=inputs, outputs=outputs,
-                                stdout=stdout, stderr=stderr)
+                                stdout=stdout, stderr=stderr,
+                                walltime=policy.walltime)
+    return pyclone_future
+
+def run_pyclone_vi_restarts(inputs:list, rundir:str, outputs:List[File], 
+                            restart_tasks:int) -> AppFuture:
+    # the restarts are split across parallel fits with different seeds,
+    # results are only written for the fit with the best ELBO, the fits
+    # are not supervised
+    policy = stage_policy('pyclone_vi')
+    fits, fit_files = [], []
+    for seed in range(restart_tasks):
+        fit_dir = generate_subdir(rundir, f'restart_{seed}')
+        fit_outputs = format_files(fit_dir, ['cluster_fit.hdf5'])
+        stdout, stderr = get_stdfiles(fit_dir)
+        fit_future = pyclone_vi_fit(seed=seed, restarts=PYCLONE_VI_RESTARTS_PER_TASK,
+                                    inputs=inputs, outputs=fit_outputs,
+                                    stdout=stdout, stderr=stderr,
+                                    walltime=policy.walltime)
+        fits.append(fit_future.outputs[0])
+        fit_files += fit_outputs
+    best_future = pyclone_vi_best_fit(elbo_dataset=ELBO_DATASET, inputs=fits)
+    stdout, stderr = get_stdfiles(rundir)
+    # best_future already waits on every fit, the plain files avoid 
+    # handing the same DataFutures to a second app
+    pyclone_future = pyclone_vi_write_results(best=best_future, inputs=fit_files, outputs=outputs,
+                                              stdout=stdout, stderr=stderr,
+                                              walltime=policy.walltime)
     return pyclone_future
 
 
 
 # --------------------- Cluster Transform ---------------------
 
+# Pruning bounds the number of clusters handed to SPRUCE, a dict with any of
+# max_clusters, min_cluster_size and min_assignment_prob (see 
+# cluster_transform/code/py_code/pruning.py). The cluster map it writes is 
+# passed on to aggregate_json, which applies and reports it.
+PRUNING_OPTIONS = ['max_clusters', 'min_cluster_size', 'min_assignment_prob']
+CLUSTER_MAP = 'cluster_map.json'
+
+def pruning_settings(pruning:dict=None) -> dict:
+    pruning = {name: value for name, value in (pruning or {}).items() if value is not None}
+    unknown = set(pruning) - set(PRUNING_OPTIONS)
+    if unknown:
+        raise ValueError(f'Unknown pruning options: {sorted(unknown)}')
+    return pruning
+
+def pruning_options(pruning:dict=None) -> str:
+    return ' '.join(f"--{name.replace('_', '-')} {value}" 
+                    for name, value in pruning_settings(pruning).items())
+
 @bash_app
-def cluster_transform(alpha, cluster_type, inputs=[], outputs=[], 
-                      stdout=None, stderr=None):
+def cluster_transform(alphas, cluster_type, pruning='', python='python -B', inputs=[], outputs=[], 
+                      stdout=None, stderr=None, walltime=None):
+    alphas = ' '.join(str(alpha) for alpha in alphas)
+    # the cluster map, when pruning, is the last output
+    spruce_files = ' '.join(str(output) for output in (outputs[:-1] if pruning else outputs))
+    index_option = f'-i {inputs[2]}' if len(inputs) > 2 else ''
+    map_option = f'--cluster-map {outputs[-1]}' if pruning else ''
     return f''' 
         cd './cluster_transform/code' ;
-        conda run -n cluster-transform python -B -m \\
-        py_code.main -t {cluster_type} -c {inputs[1]} -a {alpha} -o {outputs[0]} -v {inputs[0]}
+        conda run -n cluster-transform {python} -m \\
+        py_code.main -t {cluster_type} -c {inputs[1]} -a {alphas} -o {spruce_files} -v {inputs[0]} {index_option} \\
+        {pruning} {map_option}
         '''
 
 def get_inputs_cluster_transform(vcf_future:AppFuture, 
                                  pyclone_future:AppFuture):
     inputs = [
-        vcf_future.outputs[2],
+        get_output(vcf_future, 'pyclone_vi_formatted.tsv'),
         pyclone_future.outputs[1]
-    ]
+    ] + get_variant_index(vcf_future)
     return inputs
 
-def run_cluster_transform(inputs:list, rundir:str):
+def run_cluster_transform(inputs:list, rundir:str, pruning:dict=None):
+    pruning = pruning_options(pruning)
     outputs = [
         'spruce_formatted.tsv'
     ]
+    if pruning:
+        outputs.append(CLUSTER_MAP)
     outputs = format_files(rundir, outputs)
     stdout, stderr = get_stdfiles(rundir)
-    cluster_future = cluster_transform(alpha=0.05, cluster_type='pyclone-vi',
+    cluster_future = cluster_transform(alphas=[0.05], cluster_type='pyclone-vi', pruning=pruning,
+                                       python=stage_python(rundir, 'cluster_transform', '-B'),
                                        inputs=inputs, outputs=outputs,
-                                       stdout=stdout, stderr=stderr)
+                                       stdout=stdout, stderr=stderr,
+                                       walltime=stage_policy('cluster_transform').walltime)
+    return cluster_future
+
+def run_cluster_transform_sweep(inputs:list, rundir:str, alphas:List[float]):
+    outputs = [
+        f'spruce_formatted_alpha_{alpha}.tsv' for alpha in alphas
+    ]
+    outputs = format_files(rundir, outputs)
+    stdout, stderr = get_stdfiles(rundir)
+    cluster_future = cluster_transform(alphas=alphas, cluster_type='pyclone-vi',
+                                       python=stage_python(rundir, 'cluster_transform', '-B'),
+                                       inputs=inputs, outputs=outputs,
+                                       stdout=stdout, stderr=stderr,
+                                       walltime=stage_policy('cluster_transform').walltime)
     return cluster_future
 
 
 
 # --------------------- Spruce Tree ---------------------
 
+# SPRUCE binaries, SPRUCE_ENUMERATE can be pointed at a stub for testing
+SPRUCE_TOOL_DIR = './spruce/tool'
+SPRUCE_ENUMERATE = None     # SPRUCE_TOOL_DIR/enumerate when None
+
+# A budgeted run passes its limits to enumerate (-ll seconds, -l trees), 
+# which stops and writes the trees found so far. enumerate only writes its
+# result once it stops, so a timeout a grace period past the time limit
+# fails the task if it overruns. spruce.status.json records the budget and
+# whether the result may be truncated: the time limit was reached or 
+# enumerate found as many trees as the cap allows.
+SPRUCE_STATUS = 'spruce.status.json'
+SPRUCE_GRACE_SECONDS = 60
+
+def spruce_status_script(time_limit:int, max_trees:int, res_file, status_file) -> str:
+    null = lambda value: 'null' if value is None else value
+    time_reached = f'[ $seconds -ge {time_limit} ]' if time_limit is not None else 'false'
+    capped = f'[ $trees -ge {max_trees} ]' if max_trees is not None else 'false'
+    return f'''
+        trees=$(head -n 1 {res_file} | cut -d ' ' -f 1)
+        reason=null
+        if {time_reached}; then reason='"time_limit"'; elif {capped}; then reason='"tree_limit"'; fi
+        truncated=true
+        if [ "$reason" = null ]; then truncated=false; fi
+        printf '{{"time_limit": %s, "max_trees": %s, "seconds": %s, "trees": %s, "truncated": %s, "reason": %s}}\\n' \\
+            {null(time_limit)} {null(max_trees)} $seconds $trees $truncated $reason > {status_file}
+        '''
+
 @bash_app
-def spruce_tree(inputs=[], outputs=[], 
-                stdout=None, stderr=None):
+def spruce_tree(time_limit=None, max_trees=None, inputs=[], outputs=[], 
+                stdout=None, stderr=None, walltime=None):
+    tool_dir = SPRUCE_TOOL_DIR
+    enumerate_command = SPRUCE_ENUMERATE or f'{tool_dir}/enumerate'
+    budgeted = time_limit is not None or max_trees is not None
+    limits = ''
+    if time_limit is not None:
+        limits += f' -ll {time_limit}'
+        enumerate_command = f'timeout {time_limit + SPRUCE_GRACE_SECONDS} {enumerate_command}'
+    if max_trees is not None:
+        limits += f' -l {max_trees}'
+    status = spruce_status_script(time_limit, max_trees, outputs[1], outputs[6]) if budgeted else ''
     return f''' 
-        ./spruce/tool/cliques -s -1 {inputs[0]} > {outputs[0]}
-        ./spruce/tool/enumerate -clique {outputs[0]} -t 2 -v 3 {inputs[0]} > {outputs[1]}
+        {tool_dir}/cliques -s -1 {inputs[0]} > {outputs[0]}
+        start=$(date +%s)
+        {enumerate_command} -clique {outputs[0]} -t 2 -v 3{limits} {inputs[0]} > {outputs[1]} || exit 1
+        seconds=$(( $(date +%s) - start ))
+        {status}
         gzip -c {outputs[1]} > {outputs[2]}
-        zcat {outputs[2]} | ./spruce/tool/rank - > {outputs[3]}
-        zcat {outputs[2]} | ./spruce/tool/visualize -i 0 -a - > {outputs[4]}
-        zcat {outputs[2]} | ./spruce/tool/visualize -i 0 -j - > {outputs[5]}
+        zcat {outputs[2]} | {tool_dir}/rank - > {outputs[3]}
+        zcat {outputs[2]} | {tool_dir}/visualize -i 0 -a - > {outputs[4]}
+        zcat {outputs[2]} | {tool_dir}/visualize -i 0 -j - > {outputs[5]}
         '''
 
 def get_inputs_spruce_tree(cluster_future:AppFuture):
@@ -119,7 +460,15 @@ def get_inputs_spruce_tree(cluster_future:AppFuture):
     ]
     return inputs
 
-def run_spruce_tree(inputs:list, rundir:str) -> AppFuture:
+def get_spruce_status(spruce_future:AppFuture) -> list:
+    # only written by budgeted runs
+    try:
+        return [get_output(spruce_future, SPRUCE_STATUS)]
+    except KeyError:
+        return []
+
+def run_spruce_tree(inputs:list, rundir:str, 
+                    time_limit:int=None, max_trees:int=None) -> AppFuture:
     outputs = [
         'spruce.cliques', 
         'spruce.res',
@@ -128,65 +477,517 @@ def run_spruce_tree(inputs:list, rundir:str) -> AppFuture:
         'spruce.res.txt',
         'spruce.res.json'
     ]
+    if time_limit is not None or max_trees is not None:
+        outputs.append(SPRUCE_STATUS)
     outputs = format_files(rundir, outputs)
     stdout, stderr = get_stdfiles(rundir)
-    spruce_future = spruce_tree(inputs=inputs, outputs=outputs,
-                                stdout=stdout, stderr=stderr)
+    spruce_future = spruce_tree(time_limit=time_limit, max_trees=max_trees,
+                                inputs=inputs, outputs=outputs,
+                                stdout=stdout, stderr=stderr,
+                                walltime=stage_policy('spruce_tree').walltime)
     return spruce_future
     
 
 
 # --------------------- Aggregate JSON ---------------------
 
+# compact aggregates are about half the size and faster to write and read,
+# indented ones are easier to read by hand
+COMPACT_JSON = False
+
+# Aggregates are validated against aggregate_json/code/aggregate.schema 
+# after they are written, with the errors in a report next to them. With
+# VALIDATION_FAIL_FAST an invalid aggregate fails its stage, otherwise the
+# workflow goes on and only the report tells.
+VALIDATE_AGGREGATES = False
+VALIDATION_FAIL_FAST = True
+VALIDATION_REPORT = 'aggregated.validation.json'
+
+def validation_command(json_file, report_file, fail_fast:bool) -> str:
+    fail_fast_option = '--fail-fast' if fail_fast else ''
+    return f'''
+		conda run -n aggregate-json python schema_validation.py {json_file} \\
+			--report {report_file} {fail_fast_option}
+        '''
+
+def check_validation(reports:list, fail_fast:bool):
+    # python apps fail like the bash apps do, once the report is written
+    invalid = [report for report in reports if not report['valid']]
+    if invalid and fail_fast:
+        error = invalid[0]['errors'][0]
+        raise ValueError(f"{invalid[0]['file']} is not a valid aggregate, "
+                         f"{error['path']}: {error['message']}")
+
 @bash_app
-def aggregate_json(vcf_type, inputs=[], outputs=[], 
-                   stdout=None, stderr=None):
+def aggregate_json(vcf_type, selection='', top_k=None, compact=False, vep_count=1, 
+                   validate=False, fail_fast=True,
+                   python='python', inputs=[], outputs=[], stdout=None, stderr=None, walltime=None):
+    top_k_option = f'--top-k {top_k}' if top_k is not None else ''
+    compact_option = '--compact' if compact else ''
+    validation = validation_command(outputs[0], outputs[1], fail_fast) if validate else ''
+    # the vcf files of one patient come first, the other inputs follow as
+    # they do for a single vcf
+    vep_files = ' '.join(str(vep) for vep in inputs[:vep_count])
+    inputs = inputs[vep_count - 1:]
     return f''' 
         cd './aggregate_json/code' ;
-		conda run -n aggregate-json python aggregate_json.py \\
-			-v {inputs[0]} \\
+		conda run -n aggregate-json {python} aggregate_json.py \\
+			-v {vep_files} \\
 			-c {inputs[1]} \\
 			-s {inputs[2]} \\
 			-S {inputs[3]} \\
 			-j {outputs[0]} \\
-			--program {vcf_type}
+			--program {vcf_type} {selection} {top_k_option} {compact_option} \\
+			{optional_input_options(inputs[4:])} || exit 1 ;
+        {validation}
         '''
 
 def get_inputs_aggregate_json(vep_vcf:File, 
                               pyclone_future:AppFuture, 
-                              spruce_future:AppFuture):
+                              spruce_future:AppFuture,
+                              vcf_future:AppFuture=None,
+                              cluster_future:AppFuture=None):
     inputs = [
         vep_vcf,
         pyclone_future.outputs[1],
         spruce_future.outputs[5],
         spruce_future.outputs[2]
     ]
+    if vcf_future is not None:
+        inputs += get_variant_index(vcf_future)
+    if cluster_future is not None:
+        inputs += get_cluster_map(cluster_future)
+    inputs += get_spruce_status(spruce_future)
     return inputs
 
-def run_aggregate_json(inputs:list, rundir:str) -> AppFuture:
+def run_aggregate_json(inputs:list, rundir:str, 
+                       regions:str=None, samples:str=None, top_k:int=None,
+                       vep_count:int=1) -> AppFuture:
     outputs = [
         'aggregated.json'
     ]
+    if VALIDATE_AGGREGATES:
+        outputs.append(VALIDATION_REPORT)
     outputs = format_files(rundir, outputs)
     stdout, stderr = get_stdfiles(rundir)
-    aggregate_future = aggregate_json(vcf_type = 'mutect',
+    aggregate_future = aggregate_json(vcf_type = 'mutect', 
+                                      selection=selection_options(regions, samples),
+                                      top_k=top_k, compact=COMPACT_JSON, vep_count=vep_count,
+                                      validate=VALIDATE_AGGREGATES, 
+                                      fail_fast=VALIDATION_FAIL_FAST,
+                                      python=stage_python(rundir, 'aggregate_json'),
                                       inputs=inputs, outputs=outputs,
-                                      stdout=stdout, stderr=stderr )
+                                      stdout=stdout, stderr=stderr,
+                                      walltime=stage_policy('aggregate_json').walltime)
     return aggregate_future
 
 
 
+# --------------------- Fused Stages ---------------------
+
+# The light python stages run inside the parsl worker instead of their own 
+# conda environment: the cluster assignments parsed by cluster_transform are 
+# returned in memory and handed to aggregate_json without re-reading them.
+
+@python_app
+def cluster_transform_fused(alpha, cluster_type, pruning=None, profile=None, inputs=[], outputs=[]):
+    from filesystem_util import import_stage_module
+    cluster_main = import_stage_module(CLUSTER_TRANSFORM_CODE_DIR, 'py_code.main')
+    index_file = str(inputs[2]) if len(inputs) > 2 else None
+    with profiled(profile):
+        df_clusters, vaf_column = cluster_main.load_clusters(cluster_type, str(inputs[1]), 
+                                                             str(inputs[0]), index_file)
+        if pruning:
+            # the returned assignments already carry the pruned cluster ids
+            df_clusters, cluster_map = cluster_main.pruning.prune_clusters(df_clusters, vaf_column,
+                                                                           **pruning)
+            cluster_main.pruning.write_cluster_map(cluster_map, str(outputs[1]))
+        list_clustered, n_cluster, n_sample = cluster_main.summarize_clusters(df_clusters, 
+                                                                              vaf_column, alpha)
+        cluster_main.write_spruce(list_clustered, n_cluster, n_sample, str(outputs[0]))
+    return df_clusters
+
+def run_cluster_transform_fused(inputs:list, rundir:str, pruning:dict=None) -> AppFuture:
+    pruning = pruning_settings(pruning)
+    outputs = [
+        'spruce_formatted.tsv'
+    ]
+    if pruning:
+        outputs.append(CLUSTER_MAP)
+    outputs = format_files(rundir, outputs)
+    cluster_future = cluster_transform_fused(alpha=0.05, cluster_type='pyclone-vi', pruning=pruning,
+                                             profile=stage_profile(rundir, 'cluster_transform'),
+                                             inputs=inputs, outputs=outputs)
+    return cluster_future
+
+
+@python_app
+def aggregate_json_fused(vcf_type, df_clusters, regions=None, samples=None, top_k=None,
+                         compact=False, vep_count=1, validate=False, fail_fast=True,
+                         profile=None, inputs=[], outputs=[]):
+    from filesystem_util import import_stage_module
+    # the vcf files of one patient come first, see aggregate_json
+    vep_files = [str(vep) for vep in inputs[:vep_count]]
+    inputs = inputs[vep_count - 1:]
+    aggregate_stage = import_stage_module(AGGREGATE_JSON_CODE_DIR, 'aggregate_json')
+    regions = aggregate_stage.parse_regions(regions) if regions else None
+    samples = aggregate_stage.parse_samples(samples) if samples else None
+    optional = {os.path.basename(str(item)): str(item) for item in inputs[3:]}
+    with profiled(profile):
+        variant_index = None
+        if 'variant_index.tsv' in optional:
+            variant_index = aggregate_stage.read_variant_index(optional['variant_index.tsv'])
+        # the fused cluster_transform already applied the cluster map
+        cluster_map = None
+        if CLUSTER_MAP in optional:
+            cluster_map = aggregate_stage.read_cluster_map(optional[CLUSTER_MAP])
+        spruce_status = None
+        if SPRUCE_STATUS in optional:
+            spruce_status = aggregate_stage.read_spruce_status(optional[SPRUCE_STATUS])
+        data = aggregate_stage.aggregate(vep_files, df_clusters, 
+                                         str(inputs[1]), str(inputs[2]), vcf_type,
+                                         regions=regions, samples=samples,
+                                         variant_index=variant_index, cluster_map=cluster_map,
+                                         top_k=top_k, spruce_status=spruce_status)
+        aggregate_stage.write_aggregate(data, str(outputs[0]), compact)
+        if validate:
+            schema_validation = import_stage_module(AGGREGATE_JSON_CODE_DIR, 'schema_validation')
+            reports = schema_validation.validate_files([str(outputs[0])], fail_fast=fail_fast)
+            schema_validation.write_report(reports, str(outputs[1]))
+            check_validation(reports, fail_fast)
+
+def get_inputs_aggregate_json_fused(vep_vcf:File, 
+                                    spruce_future:AppFuture,
+                                    vcf_future:AppFuture=None,
+                                    cluster_future:AppFuture=None):
+    inputs = [
+        vep_vcf,
+        spruce_future.outputs[5],
+        spruce_future.outputs[2]
+    ]
+    if vcf_future is not None:
+        inputs += get_variant_index(vcf_future)
+    if cluster_future is not None:
+        inputs += get_cluster_map(cluster_future)
+    inputs += get_spruce_status(spruce_future)
+    return inputs
+
+def run_aggregate_json_fused(inputs:list, rundir:str, cluster_future:AppFuture,
+                             regions:str=None, samples:str=None, top_k:int=None,
+                             vep_count:int=1) -> AppFuture:
+    outputs = [
+        'aggregated.json'
+    ]
+    if VALIDATE_AGGREGATES:
+        outputs.append(VALIDATION_REPORT)
+    outputs = format_files(rundir, outputs)
+    aggregate_future = aggregate_json_fused(vcf_type='mutect', df_clusters=cluster_future,
+                                            regions=regions, samples=samples, top_k=top_k,
+                                            compact=COMPACT_JSON, vep_count=vep_count,
+                                            validate=VALIDATE_AGGREGATES, 
+                                            fail_fast=VALIDATION_FAIL_FAST,
+                                            profile=stage_profile(rundir, 'aggregate_json'),
+                                            inputs=inputs, outputs=outputs)
+    return aggregate_future
+
+
+
+# --------------------- Batched Stages ---------------------
+
+# Small samples run cluster_transform and aggregate_json in batch tasks,
+# each reading a manifest of its samples in one interpreter. The outputs of
+# a sample are plain files listed in the batch report: a failing sample is
+# reported without failing its batch, and a batch waits for its upstream
+# tasks to settle instead of failing with the first of them.
+
+# Samples with a smaller vcf are batched, at most BATCH_MAX_SAMPLES per task
+BATCH_SMALL_VCF_BYTES = 10 * 2**20
+BATCH_MAX_SAMPLES = 32
+BATCH_PROCESSES = 4
+BATCH_REPORT = 'batch_report.json'
+
+def group_samples(vep_vcf_files:List[str]) -> Tuple[List[List[str]], List[str]]:
+    small = [vep_vcf for vep_vcf in vep_vcf_files 
+             if os.path.getsize(os.path.join(ROOT, vep_vcf)) < BATCH_SMALL_VCF_BYTES]
+    large = [vep_vcf for vep_vcf in vep_vcf_files if vep_vcf not in small]
+    batches = [small[i:i + BATCH_MAX_SAMPLES] for i in range(0, len(small), BATCH_MAX_SAMPLES)]
+    return batches, large
+
+def settled(futures:list) -> Future:
+    # done once every future is done, whether it failed or not
+    done, remaining, lock = Future(), [len(futures)], threading.Lock()
+    def count(_):
+        with lock:
+            remaining[0] -= 1
+            if remaining[0] == 0:
+                done.set_result(None)
+    if not futures:
+        done.set_result(None)
+    for future in futures:
+        future.add_done_callback(count)
+    return done
+
+def write_batch_manifest(rundir:str, rows:List[dict]) -> File:
+    manifest = os.path.join(rundir, 'manifest.jsonl')
+    with open(manifest, 'w') as manifest_file:
+        for row in rows:
+            manifest_file.write(json.dumps(row) + '\n')
+    return File(manifest)
+
+def batch_sample_dir(rundir:str, index:int) -> str:
+    return os.path.join(rundir, f'sample_{index}')
+
+def get_batch_output(batch_future:AppFuture, index:int, name:str) -> File:
+    rundir = os.path.dirname(store_path(batch_future.outputs[0]))
+    return File(os.path.join(batch_sample_dir(rundir, index), name))
+
+def get_upstream(sample_inputs:list) -> list:
+    return [item for item in sample_inputs if isinstance(item, Future)]
+
+
+@bash_app
+def cluster_transform_batch(alpha, cluster_type, processes, python='python -B', inputs=[], outputs=[], 
+                            stdout=None, stderr=None, walltime=None):
+    return f''' 
+        cd './cluster_transform/code' ;
+        conda run -n cluster-transform {python} -m \\
+        py_code.main -t {cluster_type} -a {alpha} \\
+        --manifest {inputs[0]} --processes {processes} --report {outputs[0]}
+        '''
+
+def get_inputs_cluster_transform_batch(vcf_futures:List[AppFuture], 
+                                       pyclone_futures:List[AppFuture]):
+    return [get_inputs_cluster_transform(vcf_future, pyclone_future)
+            for vcf_future, pyclone_future in zip(vcf_futures, pyclone_futures)]
+
+def run_cluster_transform_batch(inputs:list, rundir:str) -> AppFuture:
+    rows, upstream = [], []
+    for index, sample_inputs in enumerate(inputs):
+        sample_dir = generate_subdir(rundir, f'sample_{index}')
+        row = {
+            'sample': f'sample_{index}',
+            'pyclone-vi': store_path(sample_inputs[0]),
+            'cluster': store_path(sample_inputs[1]),
+            'output': os.path.join(sample_dir, 'spruce_formatted.tsv')
+        }
+        if len(sample_inputs) > 2:
+            row['variant-index'] = store_path(sample_inputs[2])
+        rows.append(row)
+        upstream += get_upstream(sample_inputs)
+    manifest = write_batch_manifest(rundir, rows)
+    outputs = format_files(rundir, [BATCH_REPORT])
+    stdout, stderr = get_stdfiles(rundir)
+    batch_future = cluster_transform_batch(alpha=0.05, cluster_type='pyclone-vi', 
+                                           processes=BATCH_PROCESSES,
+                                           python=stage_python(rundir, 'cluster_transform', '-B'),
+                                           inputs=[manifest, settled(upstream)], outputs=outputs,
+                                           stdout=stdout, stderr=stderr,
+                                           walltime=stage_policy('cluster_transform').walltime)
+    return batch_future
+
+def get_inputs_spruce_tree_batch(batch_future:AppFuture, index:int):
+    # the batch report is an extra input so that the tree waits for its batch
+    inputs = [
+        get_batch_output(batch_future, index, 'spruce_formatted.tsv'),
+        batch_future.outputs[0]
+    ]
+    return inputs
+
+
+@bash_app
+def aggregate_json_batch(vcf_type, processes, python='python', inputs=[], outputs=[], 
+                         stdout=None, stderr=None, walltime=None):
+    return f''' 
+        cd './aggregate_json/code' ;
+		conda run -n aggregate-json {python} aggregate_json.py \\
+			--program {vcf_type} \\
+			--manifest {inputs[0]} --processes {processes} --report {outputs[0]}
+        '''
+
+def get_inputs_aggregate_json_batch(vep_vcfs:List[File], 
+                                    pyclone_futures:List[AppFuture], 
+                                    spruce_futures:List[AppFuture],
+                                    vcf_futures:List[AppFuture]):
+    return [get_inputs_aggregate_json(*sample_futures)
+            for sample_futures in zip(vep_vcfs, pyclone_futures, spruce_futures, vcf_futures)]
+
+def run_aggregate_json_batch(inputs:list, rundir:str) -> AppFuture:
+    rows, upstream = [], []
+    for index, sample_inputs in enumerate(inputs):
+        sample_dir = generate_subdir(rundir, f'sample_{index}')
+        row = {
+            'sample': f'sample_{index}',
+            'vep': store_path(sample_inputs[0]),
+            'cluster': store_path(sample_inputs[1]),
+            'spruce-json': store_path(sample_inputs[2]),
+            'spruce-res': store_path(sample_inputs[3]),
+            'json': os.path.join(sample_dir, 'aggregated.json')
+        }
+        for item in sample_inputs[4:]:
+            row[OPTIONAL_INPUT_OPTIONS[os.path.basename(store_path(item))][2:]] = store_path(item)
+        rows.append(row)
+        upstream += get_upstream(sample_inputs)
+    manifest = write_batch_manifest(rundir, rows)
+    outputs = format_files(rundir, [BATCH_REPORT])
+    stdout, stderr = get_stdfiles(rundir)
+    batch_future = aggregate_json_batch(vcf_type='mutect', processes=BATCH_PROCESSES,
+                                        python=stage_python(rundir, 'aggregate_json'),
+                                        inputs=[manifest, settled(upstream)], outputs=outputs,
+                                        stdout=stdout, stderr=stderr,
+                                        walltime=stage_policy('aggregate_json').walltime)
+    return batch_future
+
+
+
+# --------------------- Patient Groups ---------------------
+
+# The vcf files of the regions of one tumor are grouped by patient, from a
+# sample sheet (tab separated, 'vcf' and 'patient' columns, vcf paths relative
+# to the sheet) or else from the tumor_sample header of every vcf, the
+# patient being the first group of a pattern (PATIENT_PATTERN by default) in
+# the sample name. The pyclone-vi inputs of the regions are merged into one 
+# multi-sample input, the patient gets a single pyclone-vi fit and SPRUCE 
+# run over its regions. Every region needs a tumor sample name of its own.
+PATIENT_PATTERN = None      # e.g. r'^(P\d+)_' for P1_R1 and P1_R2
+
+def read_sample_sheet(sample_sheet:str) -> Dict[str, str]:
+    # vcf path -> patient
+    sheet_dir = os.path.dirname(os.path.abspath(sample_sheet))
+    with open(sample_sheet, newline='') as sheet_file:
+        reader = csv.DictReader(sheet_file, delimiter='\t')
+        missing = {'vcf', 'patient'} - set(reader.fieldnames or [])
+        if missing:
+            raise ValueError(f'Sample sheet {sample_sheet} has no {sorted(missing)} column')
+        return {os.path.normpath(os.path.join(sheet_dir, row['vcf'])): row['patient'] 
+                for row in reader}
+
+def patient_of(tumor_sample:str, pattern:str) -> str:
+    match = re.match(pattern, tumor_sample)
+    if match is None:
+        raise ValueError(f'Tumor sample {tumor_sample} does not match the patient pattern {pattern}')
+    return match.group(1)
+
+def header_patient(vep_vcf:str, pattern:str) -> str:
+    import pysam
+    with pysam.VariantFile(vep_vcf) as vcf:
+        tumor_samples = [rec.value for rec in vcf.header.records if rec.key == 'tumor_sample']
+    patients = {patient_of(tumor_sample, pattern) for tumor_sample in tumor_samples}
+    if len(patients) != 1:
+        raise ValueError(f'{vep_vcf} has tumor samples of {len(patients)} patients, '
+                         'group it with a sample sheet')
+    return patients.pop()
+
+def group_patients(vep_vcf_files:List[str], sample_sheet:str=None,
+                   patient_pattern:str=None) -> Dict[str, List[str]]:
+    # patient -> vcf files, in the order the files were given
+    sheet = read_sample_sheet(os.path.join(ROOT, sample_sheet)) if sample_sheet else None
+    pattern = patient_pattern or PATIENT_PATTERN
+    if sheet is None and pattern is None:
+        # the whole sample name would only group regions sharing their name
+        raise ValueError('Grouping by patient needs a sample sheet or a patient pattern')
+    groups = {}
+    for vep_vcf in vep_vcf_files:
+        path = os.path.normpath(os.path.join(ROOT, vep_vcf))
+        if sheet is None:
+            patient = header_patient(path, pattern)
+        elif path in sheet:
+            patient = sheet[path]
+        else:
+            raise ValueError(f'{vep_vcf} is not in the sample sheet {sample_sheet}')
+        groups.setdefault(patient, []).append(vep_vcf)
+    return groups
+
+@python_app
+def merge_patient(profile=None, inputs=[], outputs=[]):
+    # outputs are named like the vcf_transform outputs they replace
+    import pandas as pd
+    with profiled(profile):
+        regions = [pd.read_csv(str(file), sep='\t', dtype={'mutation_id': str, 'sample_id': str})
+                   for file in inputs]
+        # regions sharing a sample name would be merged into one sample
+        seen = {}
+        for file, region in zip(inputs, regions):
+            for sample_id in region['sample_id'].unique():
+                if sample_id in seen:
+                    raise ValueError(f'Sample {sample_id} is in both {seen[sample_id]} and {file}, '
+                                     'the regions of a patient need sample names of their own')
+                seen[sample_id] = file
+        merged = pd.concat(regions)
+        # pyclone-vi only fits the mutations present in every sample, the 
+        # mutations private to a region are dropped here so that the variant 
+        # index numbers the mutations that are actually clustered
+        sample_count = merged['sample_id'].nunique()
+        present = merged.groupby('mutation_id')['sample_id'].transform('nunique') == sample_count
+        print(f'{(~present).sum()} rows of mutations missing from some of the '
+              f'{sample_count} samples dropped')
+        merged = merged[present]
+        merged.to_csv(str(outputs[0]), sep='\t', index=False)
+        with open(str(outputs[1]), 'w', newline='') as index_file:
+            writer = csv.writer(index_file, delimiter='\t')
+            writer.writerow(['variant_id', 'mutation_id', 'chrom', 'pos'])
+            for variant_id, mutation_id in enumerate(merged['mutation_id'].unique()):
+                chrom, pos = mutation_id.rsplit(':', 1)
+                writer.writerow([variant_id, mutation_id, chrom, pos])
+
+def get_inputs_merge_patient(vcf_futures:List[AppFuture]):
+    return [get_output(vcf_future, 'pyclone_vi_formatted.tsv') for vcf_future in vcf_futures]
+
+def run_merge_patient(inputs:list, rundir:str) -> AppFuture:
+    outputs = [
+        'pyclone_vi_formatted.tsv',
+        'variant_index.tsv'
+    ]
+    outputs = format_files(rundir, outputs)
+    merge_future = merge_patient(profile=stage_profile(rundir, 'merge_patient'),
+                                 inputs=inputs, outputs=outputs)
+    return merge_future
+
+def get_inputs_aggregate_json_patient(vep_vcfs:List[str], pyclone_future:AppFuture,
+                                      spruce_future:AppFuture, merge_future:AppFuture,
+                                      cluster_future:AppFuture):
+    # every vcf of the patient, then the inputs of a single vcf aggregate
+    return list(vep_vcfs) + get_inputs_aggregate_json(vep_vcfs[0], pyclone_future, spruce_future,
+                                                      merge_future, cluster_future)[1:]
+
+def get_inputs_aggregate_json_patient_fused(vep_vcfs:List[str], spruce_future:AppFuture,
+                                            merge_future:AppFuture, cluster_future:AppFuture):
+    return list(vep_vcfs) + get_inputs_aggregate_json_fused(vep_vcfs[0], spruce_future,
+                                                            merge_future, cluster_future)[1:]
+
+
+
 # --------------------- Aggregate Workflows ---------------------
 
 @python_app
-def aggregate_workflows(inputs=[], outputs=[]):
+def aggregate_workflows(validate=False, fail_fast=True, profile=None, inputs=[], outputs=[]):
     output_json = []
+    reports = []
+    from storage_policy import open_stored
+    from filesystem_util import import_stage_module
+    # the JSON backend of the aggregate stage, orjson when it is installed
+    serialization = import_stage_module(AGGREGATE_JSON_CODE_DIR, 'serialization')
+    schema_validation = import_stage_module(AGGREGATE_JSON_CODE_DIR, 'schema_validation')
+    files = []
     for file in inputs:
-        workflow_json = json.load(open(file))
-        output_json.append(workflow_json)
-    output_file = open(outputs[0], 'w')
-    output_file.write(json.dumps(output_json))
-    output_file.close()
+        if os.path.basename(str(file)) == BATCH_REPORT:
+            # the aggregates of the samples that succeeded in a batch
+            with open(str(file)) as report_file:
+                files += [output for sample in json.load(report_file) 
+                          if sample['status'] == 'ok' for output in sample['outputs']]
+        else:
+            files.append(str(file))
+    with profiled(profile):
+        for file in files:
+            with open_stored(file, 'rb') as workflow_file:
+                workflow_json = serialization.loads(workflow_file.read())
+            if validate:
+                # the aggregate is already decoded, its checks cost a fraction of the decoding
+                reports.append(schema_validation.validate_value(workflow_json, name=file))
+            output_json.append(workflow_json)
+        if validate:
+            schema_validation.write_report(reports, str(outputs[1]))
+            check_validation(reports, fail_fast)
+        serialization.dump(output_json, str(outputs[0]), indent=None)
 
 
 def get_inputs_aggregate_workflows(aggregate_futures:List[AppFuture]):
@@ -197,6 +998,68 @@ def run_aggregate_workflows(inputs:list, rundir):
     outputs = [
         'aggregated_workflows.json'
     ]
+    if VALIDATE_AGGREGATES:
+        outputs.append('aggregated_workflows.validation.json')
     outputs = format_files(rundir, outputs)
-    aggregate_workflows_future = aggregate_workflows(inputs=inputs, outputs=outputs)
+    aggregate_workflows_future = aggregate_workflows(validate=VALIDATE_AGGREGATES, 
+                                                     fail_fast=VALIDATION_FAIL_FAST,
+                                                     profile=stage_profile(rundir, 'aggregate_workflows'),
+                                                     inputs=inputs, outputs=outputs)
     return aggregate_workflows_future
+
+
+# --------------------- Cohort Store ---------------------
+
+@python_app
+def store_workflow(sample, store_path, inputs=[]):
+    from cohort_store import CohortStore
+    CohortStore(store_path).put(sample, str(inputs[0]))
+
+def run_store_workflow(inputs:list, rundir:str, store_path:str, sample:str) -> AppFuture:
+    store_future = store_workflow(sample=sample, store_path=store_path, inputs=inputs)
+    return store_future
+
+
+@python_app
+def export_cohort(store_path, outputs=[]):
+    from cohort_store import CohortStore
+    CohortStore(store_path).export(str(outputs[0]))
+
+def run_export_cohort(inputs:list, rundir:str, store_path:str) -> AppFuture:
+    outputs = [
+        'aggregated_workflows.json'
+    ]
+    outputs = format_files(rundir, outputs)
+    export_future = export_cohort(store_path=store_path, outputs=outputs)
+    return export_future
+
+
+# --------------------- Storage Policy ---------------------
+
+@python_app
+def apply_storage(run_dir, policy, output_paths, inputs=[]):
+    from storage_policy import apply_storage_policy
+    return apply_storage_policy(run_dir, policy, output_paths)
+
+def run_storage_policy(inputs:list, rundir:str, run_dir:str, policy) -> AppFuture:
+    # inputs are the futures of every stage writing into run_dir, the policy
+    # is only applied once all of them have settled, failed stages included.
+    # Only their outputs are deduplicated
+    output_paths = [store_path(output) for future in inputs 
+                    for output in getattr(future, 'outputs', [])]
+    storage_future = apply_storage(run_dir=run_dir, policy=policy, output_paths=output_paths,
+                                   inputs=[settled(inputs)])
+    return storage_future
+
+
+# --------------------- Profile Report ---------------------
+
+@python_app
+def merge_run_profiles(run_dir, inputs=[]):
+    return merge_profiles(run_dir)
+
+def run_profile_report(inputs:list, rundir:str, run_dir:str) -> AppFuture:
+    # inputs are the futures of the run, failed stages still leave a profile
+    # behind so the report waits for all of them to settle
+    report_future = merge_run_profiles(run_dir=run_dir, inputs=[settled(inputs)])
+    return report_future
@@ -1,49 +1,111 @@
+import argparse
 import sys
 import vcf
-import json
 from pathlib import Path
 
 import py_code.mutation as mutation
+import py_code.selection as selection
+import py_code.serialization as serialization
+import py_code.variant_index as variant_index
+from py_code.bgzf import open_compressed
 from py_code.mutation import Mutation
 
+# an output given as '-' is neither computed nor written
+SKIP_OUTPUT = '-'
+
 def main(args):
     success = False
     print("main.py: got the args: " + str(args))
 
-    vcf_type:str = args[0]
+    options = parse_args(args)
+    vcf_type:str = options.vcf_type
     if vcf_type not in ['mutect', 'moss']:
         raise Exception('Can only understand vcf from mutect or moss')
 
-    vcf_fn:str = args[1]
-    header_json_out_fn = args[2]
-    mutations_json_out_fn = args[3]
-    pyclone_vi_out_fn = args[4]
-    pyclone_out_dirname = args[5]
+    vcf_fn:str = options.vcf_fn
+    header_json_out_fn = options.header_json_out_fn
+    mutations_json_out_fn = options.mutations_json_out_fn
+    pyclone_vi_out_fn = options.pyclone_vi_out_fn
+    pyclone_out_dirname = options.pyclone_out_dirname
+    variant_index_out_fn = options.variant_index_out_fn
+    regions = selection.parse_regions(options.regions) if options.regions else None
+    samples = selection.parse_samples(options.samples) if options.samples else None
+
+    vcf_reader:vcf.Reader = load_vcf(vcf_fn, options.threads)
+
+    json_indent = None if options.compact_json else serialization.PRETTY_INDENT
 
-    vcf_reader:vcf.Reader = load_vcf(vcf_fn)
+    if is_requested(header_json_out_fn):
+        write_headers_as_json(vcf_reader, header_json_out_fn, json_indent)
 
-    write_headers_as_json(vcf_reader, header_json_out_fn)
+    mutation_outputs = [mutations_json_out_fn, pyclone_vi_out_fn, pyclone_out_dirname,
+                        variant_index_out_fn]
+    if not any(is_requested(out) for out in mutation_outputs):
+        success = True
+        return success
 
     sample_id = extract_sample_id(vcf_fn)
 
+    records = selection.select_records(vcf_reader, vcf_fn, regions)
     if vcf_type == 'mutect':
-        mutations = Mutation.mutation_list_from_mutect(sample_id, vcf_reader)
+        mutations = Mutation.mutation_list_from_mutect(sample_id, vcf_reader, records, samples)
     elif vcf_type == 'moss':
-        mutations = Mutation.mutation_list_from_moss(sample_id, vcf_reader)
-
-    mutation.write_mutations_json(mutations_json_out_fn, mutations)
-    mutation.write_pyclone_vi_input(pyclone_vi_out_fn, mutations)
-    mutation.write_pyclone_inputs(pyclone_out_dirname, mutations)
+        mutations = Mutation.mutation_list_from_moss(sample_id, vcf_reader, records, samples)
+
+    if is_requested(mutations_json_out_fn):
+        mutation.write_mutations_json(mutations_json_out_fn, mutations, json_indent)
+    if is_requested(pyclone_vi_out_fn):
+        mutation.write_pyclone_vi_input(pyclone_vi_out_fn, mutations)
+    if is_requested(pyclone_out_dirname):
+        mutation.write_pyclone_inputs(pyclone_out_dirname, mutations)
+    if is_requested(variant_index_out_fn):
+        index = variant_index.build_variant_index(m.mutation_id for m in mutations)
+        variant_index.write_variant_index(variant_index_out_fn, index)
 
     success = True
     return success
 
-def load_vcf(vcf_fn:str) -> vcf.Reader:
+def parse_args(args):
+    """
+    the outputs stay positional for the existing callers, the variant
+    index is an optional last one. Region and sample selection are
+    optional flags after them
+    """
+    parser = argparse.ArgumentParser(prog='vcf_transform')
+    parser.add_argument('vcf_type')
+    parser.add_argument('vcf_fn')
+    parser.add_argument('header_json_out_fn')
+    parser.add_argument('mutations_json_out_fn')
+    parser.add_argument('pyclone_vi_out_fn')
+    parser.add_argument('pyclone_out_dirname')
+    parser.add_argument('variant_index_out_fn', nargs='?', default=SKIP_OUTPUT)
+    parser.add_argument('--regions',
+        help='BED file or comma separated contig[:start-end] list, '
+             'read through the index when the vcf is bgzipped and indexed')
+    parser.add_argument('--samples',
+        help='file with one tumor sample per line or comma separated sample list')
+    parser.add_argument('--threads', type=int, default=None,
+        help='threads decompressing a bgzipped vcf, the CPU count up to 4 by default')
+    parser.add_argument('--compact-json', action='store_true',
+        help='write the json outputs without indentation')
+    return parser.parse_args(args)
+
+def is_requested(out_fn:str) -> bool:
+    """
+    whether the caller asked for an output, outputs can be skipped
+    by passing SKIP_OUTPUT in place of their filename
+    """
+    return out_fn != SKIP_OUTPUT
+
+def load_vcf(vcf_fn:str, threads:int=None) -> vcf.Reader:
     """ 
     given the filename of a vcf, returns a Reader object that is an
     iterator over the rows in the file (yields vcf._Record objects)
     """
-    reader = vcf.Reader(open(vcf_fn, 'r'))
+    # decompressed here (BGZF blocks on threads), the filename is kept so
+    # that bgzipped files can still be fetched by region
+    vcf_file = open_compressed(vcf_fn, 'rt', threads)
+    reader = vcf.Reader(fsock=vcf_file, filename=vcf_fn, compressed=False)
     return reader
 
 def extract_sample_id(input_filename):
@@ -67,11 +129,12 @@ def pp_jsons(jdata) -> str:
     convert a data structure to json and create a pretty print string.
     works best on nested dicts/lists/primitives.
     """
-    s = json.dumps(jdata, indent=4)
+    s = serialization.dumps(jdata)
     return s
   
 
-def write_headers_as_json(vcf_reader:vcf.Reader, fn_out:str) -> None:
+def write_headers_as_json(vcf_reader:vcf.Reader, fn_out:str,
+                          indent=serialization.PRETTY_INDENT) -> None:
     """
     Once the vcf if loaded, put all the metadata from the header into
     a single json object and pretty print it to a file.
@@ -86,8 +149,7 @@ def write_headers_as_json(vcf_reader:vcf.Reader, fn_out:str) -> None:
     header_json["samples"] = vcf_reader.samples
 
     print("writing header info as json to : " + str(fn_out))
-    with open(fn_out, 'w') as outfile:
-        json.dump(header_json, outfile, indent=4)
+    serialization.dump(header_json, fn_out, indent)
     return
 
 
@@ -1,10 +1,12 @@
 from dataclasses import dataclass, asdict
-from typing import List
+from typing import Iterable, List, Optional
 import vcf
-import json
 import csv
 from pathlib import Path
 
+import py_code.serialization as serialization
+from py_code.selection import select_samples
+
 @dataclass
 class Mutation(object):
     """
@@ -44,18 +46,21 @@ class Mutation(object):
         return mut
 
     @staticmethod
-    def mutation_list_from_mutect(sample_id:str, vcf_reader: vcf.Reader):
+    def mutation_list_from_mutect(sample_id:str, vcf_reader: vcf.Reader,
+                                  records: Optional[Iterable[vcf.model._Record]] = None,
+                                  samples: Optional[List[str]] = None):
         """
-        Generate a list of Mutations from VCF file
+        Generate a list of Mutations from VCF file, optionally restricted
+        to some records (see selection.select_records) and tumor samples
         """
 
         mutation_list = []
         print(vcf_reader.metadata)
-        tumor_samples = vcf_reader.metadata["tumor_sample"]
-        for rec in vcf_reader:
+        tumor_samples = select_samples(vcf_reader.metadata["tumor_sample"], samples)
+        for rec in (vcf_reader if records is None else records):
             if len(rec.FILTER) == 0:
+                mutation_id = Mutation._construct_mutation_id(rec)
                 for sample in tumor_samples:
-                    mutation_id = Mutation._construct_mutation_id(rec)
                     tumor_call = rec.genotype(sample)
                     call_data = tumor_call.data
                     counts = call_data.AD
@@ -71,18 +76,21 @@ class Mutation(object):
         return mutation_list
 
     @staticmethod
-    def mutation_list_from_moss(sample_id:str, vcf_reader: vcf.Reader):
+    def mutation_list_from_moss(sample_id:str, vcf_reader: vcf.Reader,
+                                  records: Optional[Iterable[vcf.model._Record]] = None,
+                                  samples: Optional[List[str]] = None):
         """
-        Generate a list of Mutations from VCF file
+        Generate a list of Mutations from VCF file, optionally restricted
+        to some records (see selection.select_records) and tumor samples
         """
 
         mutation_list = []
-        tumor_samples = vcf_reader.metadata["tumor_sample"]
+        tumor_samples = select_samples(vcf_reader.metadata["tumor_sample"], samples)
 
-        for rec in vcf_reader:
+        for rec in (vcf_reader if records is None else records):
             if len(rec.FILTER) == 0:
+                mutation_id = Mutation._construct_mutation_id(rec)
                 for sample in tumor_samples:
-                    mutation_id = Mutation._construct_mutation_id(rec)
                     tumor_call = rec.genotype(sample)
                     call_data = tumor_call.data
                     depth = int(call_data.DP)
@@ -112,11 +120,11 @@ class Mutation(object):
         return mid
 
 
-def write_mutations_json(out_fn:str, mutations:List[Mutation]) -> None:
+def write_mutations_json(out_fn:str, mutations:List[Mutation],
+                         indent=serialization.PRETTY_INDENT) -> None:
     print("writing mutations as json to : " + str(out_fn))
     jd = [asdict(x) for x in mutations]
-    with open(out_fn, 'w') as outfile:
-        json.dump(jd, outfile, indent=4)
+    serialization.dump(jd, out_fn, indent)
     return
 
 def write_pyclone_vi_input(out_fn:str, mutations:List[Mutation]) -> None:
@@ -0,0 +1,118 @@
+import os
+from collections import namedtuple
+from typing import Iterator, List, Optional
+
+import vcf
+
+# zero based, half open, end is None for the whole contig
+Region = namedtuple('Region', ['contig', 'start', 'end'])
+
+INDEX_SUFFIXES = ['.tbi', '.csi']
+
+def parse_regions(spec:str) -> List[Region]:
+    """
+    parse a region selection, either a BED file or a comma separated
+    list of contig or contig:start-end items (one based, inclusive, as
+    written by samtools and bcftools). Overlapping regions are merged
+    so no record is read twice.
+    """
+    regions = []
+    if os.path.isfile(spec):
+        with open(spec, 'r') as bed:
+            for line in bed:
+                if not line.strip() or line.startswith(('#', 'track', 'browser')):
+                    continue
+                fields = line.split('\t')
+                regions.append(Region(fields[0], int(fields[1]), int(fields[2])))
+    else:
+        for item in spec.split(','):
+            item = item.strip()
+            if ':' in item:
+                contig, interval = item.rsplit(':', 1)
+                start, end = interval.replace(',', '').split('-')
+                regions.append(Region(contig, int(start) - 1, int(end)))
+            elif item:
+                regions.append(Region(item, 0, None))
+    return merge_regions(regions)
+
+def merge_regions(regions:List[Region]) -> List[Region]:
+    merged = []
+    for region in sorted(regions, key=lambda r: (r.contig, r.start)):
+        last = merged[-1] if merged else None
+        if last is not None and last.contig == region.contig and \
+                (last.end is None or region.start <= last.end):
+            end = None if last.end is None or region.end is None else max(last.end, region.end)
+            merged[-1] = Region(last.contig, last.start, end)
+        else:
+            merged.append(region)
+    return merged
+
+def order_regions(regions:List[Region], contigs:List[str]) -> List[Region]:
+    """
+    merge the regions and sort them in file order, by the contig order of
+    the vcf header then by start
+    """
+    rank = {contig: index for index, contig in enumerate(contigs)}
+    return sorted(merge_regions(regions), key=lambda r: (rank.get(r.contig, len(rank)), r.contig, r.start))
+
+def in_region(position:int, region:Region) -> bool:
+    return position >= region.start and (region.end is None or position < region.end)
+
+def parse_samples(spec:str) -> List[str]:
+    """
+    parse a sample selection, either a file with one sample per line
+    or a comma separated list of sample names
+    """
+    if os.path.isfile(spec):
+        with open(spec, 'r') as sample_file:
+            return [line.strip() for line in sample_file if line.strip()]
+    return [sample.strip() for sample in spec.split(',') if sample.strip()]
+
+def is_indexed(vcf_fn:str) -> bool:
+    """
+    region lookups need a bgzipped vcf with a tabix or CSI index next to it
+    """
+    return vcf_fn.endswith('.gz') and \
+        any(os.path.exists(vcf_fn + suffix) for suffix in INDEX_SUFFIXES)
+
+def in_regions(record:vcf.model._Record, regions:List[Region]) -> bool:
+    position = record.POS - 1
+    return any(record.CHROM == r.contig and in_region(position, r) for r in regions)
+
+def select_records(vcf_reader:vcf.Reader, vcf_fn:str,
+                   regions:Optional[List[Region]]) -> Iterator[vcf.model._Record]:
+    """
+    iterate over the records of the selected regions. Indexed files only
+    read the blocks overlapping the regions, other files are streamed
+    and filtered record by record. Both keep the records starting in a
+    region, in file order, each record once.
+    """
+    if not regions:
+        yield from vcf_reader
+    elif is_indexed(vcf_fn):
+        for region in order_regions(regions, list(vcf_reader.contigs)):
+            try:
+                records = vcf_reader.fetch(region.contig, region.start, region.end)
+            except ValueError:
+                # contig absent from the index, nothing to read
+                continue
+            # fetch also returns the records overlapping the region from before it
+            for record in records:
+                if in_region(record.POS - 1, region):
+                    yield record
+    else:
+        for record in vcf_reader:
+            if in_regions(record, regions):
+                yield record
+
+def select_samples(tumor_samples:List[str], samples:Optional[List[str]]) -> List[str]:
+    """
+    restrict the tumor samples of the vcf header to the selected ones,
+    keeping the header order
+    """
+    if not samples:
+        return tumor_samples
+    selected = [sample for sample in tumor_samples if sample in samples]
+    if not selected:
+        raise Exception(f'None of the samples {samples} is a tumor sample of the vcf')
+    return selected
@@ -0,0 +1,28 @@
+import csv
+from typing import Dict, Iterable
+
+# variant_index.tsv maps every variant key (chrom:pos, the mutation_id of
+# the pyclone inputs) to a dense integer id, in the order of the vcf. The
+# later stages join on these ids instead of hashing the key strings.
+VARIANT_INDEX_FIELDS = ['variant_id', 'mutation_id', 'chrom', 'pos']
+
+
+def build_variant_index(mutation_ids:Iterable[str]) -> Dict[str, int]:
+    """
+    numbers the distinct mutation ids from 0, in order of first appearance
+    """
+    variant_index = dict()
+    for mutation_id in mutation_ids:
+        if mutation_id not in variant_index:
+            variant_index[mutation_id] = len(variant_index)
+    return variant_index
+
+def write_variant_index(out_fn:str, variant_index:Dict[str, int]) -> None:
+    print("writing variant index to: " + str(out_fn))
+    with open(out_fn, 'w', newline='') as csvfile:
+        writer = csv.writer(csvfile, delimiter='\t')
+        writer.writerow(VARIANT_INDEX_FIELDS)
+        for mutation_id, variant_id in variant_index.items():
+            chrom, pos = mutation_id.rsplit(':', 1)
+            writer.writerow([variant_id, mutation_id, chrom, pos])
+    return